@@ -62,12 +62,47 @@ class fpga_register():
 
 
 
+class fpga_memory():
+    """
+    Memory window of the FPGA module: depth words of nbits, one for each 32
+    bits bus address from offset. Writes go to the memory and reads come from
+    a registered port, so the bus ack is delayed one clock.
+    offset must be aligned to the window size (depth*4, a power of 2).
+    """
+    def __init__(self, name, offset, depth, nbits=14, signed=False, desc='todo', group='mix'):
+        """Initialize attributes."""
+        self.name        = name
+        self.offset      = offset
+        self.depth       = depth
+        self.nbits       = nbits
+        self.signed      = signed
+        self.desc        = desc
+        self.group       = group
+        self.abits       = (depth-1).bit_length()
+        k                = self.abits+2
+        if depth != 1<<self.abits or offset % (1<<k) != 0:
+            raise ValueError('fpga_memory: depth must be a power of 2 and offset aligned to depth*4')
+        self.addr        = "20'h{:05X}".format(offset)
+        self.sel         = "sys_addr[19:{:d}]=={:d}'h{:X}".format(k, 20-k, offset>>k)
+        self.pattern     = "20'b" + '{:0{:d}b}'.format(offset>>k, 20-k) + '?'*k
+
+    def __repr__(self):
+        txt  = self.name + ','
+        txt += 'offset='+hex(self.offset) + ','
+        txt += 'depth='+str(self.depth) + ','
+        txt += 'nbits='+str(self.nbits) + ','
+        txt += ( 'int' if self.signed else 'uint' ) + ','
+        txt += 'group='+ self.group
+        return 'fpga_memory('+txt+')'
+
+
 class fpga_registers():
     """Collection os fpga_register clasess"""
     def __init__(self):
         self.data  = []
         self.names = []
         self.len   = 0
+        self.mems  = []
 
     def __getitem__(self, key):
         if type(key)==int:
@@ -91,6 +126,11 @@ class fpga_registers():
         self.names.append(name)
         self.len = len(self.names)
 
+    def add_memory(self, name, offset, depth, nbits=14, signed=False, desc='todo', group='mix'):
+        """Memory window outside the registers space (not in the C/HTML parameters)"""
+        self.mems.append(fpga_memory(name=name, offset=offset, depth=depth, nbits=nbits,
+                                     signed=signed, desc=desc, group=group))
+
     def update_verilog_files(self,folder):
         fpga_mod_fn = os.path.join('fpga','rtl','dummy.v')
         print('Updating verilog file: '+fpga_mod_fn)
@@ -123,6 +163,9 @@ class fpga_registers():
         for r in self:
             txt+="dm.add( fpga_reg(name={:21s}, index={:3d}, rw={:5s}, nbits={:2d},signed={:5s}) )\n".format(
                     "'"+r.name+"'" , r.index , str(r.rw) , r.nbits , str(r.signed) )
+        for m in self.mems:
+            txt+="dm.add_mem( fpga_mem(name={:17s}, offset=0x{:05X}, depth={:5d}, nbits={:2d},signed={:5s}) )\n".format(
+                    "'"+m.name+"'" , m.offset , m.depth , m.nbits , str(m.signed) )
         if ret:
             return txt
         else:
@@ -661,6 +704,13 @@ def fpga_reg_write(f,indent=1):
     txt.indent_minus()
     txt.add('end')
 
+    for m in f.mems:
+        txt.nl()
+        txt.add('// {:s} memory: {:d} words from {:s} // {:s}'.format(m.name, m.depth, m.addr, inline(m.desc)))
+        txt.add('assign {:<20} = sys_wen & ({:s}) ;'.format(m.name+'_we', m.sel))
+        txt.add('assign {:<20} = sys_addr[{:>2d}:2] ;'.format(m.name+'_addr', m.abits+1))
+        txt.add('assign {:<20} = sys_wdata[{:>2d}-1: 0] ;'.format(m.name+'_wdata', m.nbits))
+
     return txt.out()
 
 
@@ -679,11 +729,15 @@ def fpga_reg_read(f,indent=1):
     txt.indent_plus()
     txt.add("sys_err <= 1'b0  ;")
     txt.add("sys_ack <= 1'b0  ;")
+    for m in f.mems:
+        txt.add("{:s}_rd <= 1'b0  ;".format(m.name))
     txt.indent_minus()
 
     txt.add("end else begin")
     txt.indent_plus()
     txt.add("sys_err <= 1'b0 ;")
+    for m in f.mems:
+        txt.add("{:s}_rd <= sys_ren & ({:s}) ; // memory read port is registered".format(m.name, m.sel))
     txt.nl()
     txt.add("casez (sys_addr[19:0])")
 
@@ -718,6 +772,15 @@ def fpga_reg_read(f,indent=1):
                         ",  {:>15s}  }};".format(  (r.name+'_reg' if r.reg_read else r.name )  ) +
                         " end // {:}".format(inline(r.desc))
                         )
+    for m in f.mems:
+        if m.signed:
+            ext = "{{{:d}{{{:s}_rdata[{:d}]}}}}".format(32-m.nbits, m.name, m.nbits-1)
+        else:
+            ext = "{:d}'b0".format(32-m.nbits)
+        txt.add(
+                "{:s} : begin sys_ack <= sys_wen | {:s}_rd;  sys_rdata <= {{  {:s} ,  {:s}_rdata  }}; end // {:s}".format(
+                m.pattern, m.name, ext, m.name, inline(m.desc))
+                )
     txt.add("default   : begin sys_ack <= sys_en;  sys_rdata <=  32'h0        ; end")
     txt.indent_minus()
     txt.add("endcase")
@@ -760,6 +823,14 @@ def fpga_defs(f,indent=1):
             txt.add(','.join( [ y.name for y in filter(lambda x: x.group==group and x.rw==False and x.nbits==nbits and x.signed==True and x.write_def==True, f) ] )
                    +';')
         txt.nl()
+    for m in f.mems:
+        sg = 'signed' if m.signed else '      '
+        txt.add('// {:s} memory --------------------------'.format(m.name))
+        txt.add('wire                 {:s}_we;'.format(m.name))
+        txt.add('wire        [{:>2d}-1:0] {:s}_addr;'.format(m.abits, m.name))
+        txt.add('wire {:s} [{:>2d}-1:0] {:s}_wdata,{:s}_rdata;'.format(sg, m.nbits, m.name, m.name))
+        txt.add('reg                  {:s}_rd;'.format(m.name))
+        txt.nl()
     return txt.out()
 
 
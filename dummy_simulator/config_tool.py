@@ -144,9 +144,14 @@ f.add( name="noise_std"         , group=grp , val=    0, rw= False, nbits=14  ,
 
 
 #grp='aux_signals'
-#f.add( name="cnt_clk"            , group=grp , val=    0, rw=False,  nbits=32, min_val=          0, max_val= 4294967295, fpga_update=False, signed=False, desc="Clock count" )
-#f.add( name="cnt_clk2"           , group=grp , val=    0, rw=False,  nbits=32, min_val=          0, max_val= 4294967295, fpga_update=False, signed=False, desc="Clock count" )
 f.add( name="read_ctrl"          , group=grp , val=    0, rw=True ,  nbits= 3, min_val=          0, max_val=          7, fpga_update=True , signed=False, desc="[unused,start_clk,Freeze]" )
+# Sample clock: 64 bits count of clk since start_clk, held while Freeze is set
+f.add( name="cnt_clk"            , group=grp , val=    0, rw=False,  nbits=32, min_val=          0, max_val= 4294967295, fpga_update=False, signed=False, desc="Clock count, low 32 bits" )
+f.add( name="cnt_clk2"           , group=grp , val=    0, rw=False,  nbits=32, min_val=          0, max_val= 4294967295, fpga_update=False, signed=False, desc="Clock count, high 32 bits" )
+
+# Memory windows (bus access only, not in the C/HTML parameters)
+grp='dummy'
+f.add_memory( name="pico"          , group=grp , offset=0x02000, depth=2048, nbits=14, signed=True , desc="peak table of fun_pico (pico_data.dat at power up)" )
 #
 ## aux
 #grp='mix'
@@ -46,6 +46,7 @@ module dummy(
     reg         [ 3-1:0] entrada,read_ctrl;
     reg         [ 4-1:0] lpf_val,hpf_val,drift_time;
     reg  signed [14-1:0] peak_pos,sg_amp,sg_width,sg_base,noise_amp;
+    wire        [32-1:0] cnt_clk,cnt_clk2;
     wire signed [14-1:0] val_fun,noise_std;
     
     // inout --------------------------
@@ -59,6 +60,12 @@ module dummy(
     reg         [ 5-1:0] oscA_sw,oscB_sw;
     reg         [ 8-1:0] trig_sw;
     
+    // pico memory --------------------------
+    wire                 pico_we;
+    wire        [11-1:0] pico_addr;
+    wire signed [14-1:0] pico_wdata,pico_rdata;
+    reg                  pico_rd;
+    
     // [WIREREG DOCK END]
 
     wire signed [14-1:0] slow_out1_14,slow_out2_14,slow_out3_14,slow_out4_14 ;
@@ -156,7 +163,9 @@ module dummy(
         satprotect #(.Ri(15),.Ro(14),.SAT(14)) i_satprotect_pico_in_sum  ( .in(pico_in_sum),  .out(pico_in) );
 
 
-        fun_pico i_fun_pico_A  ( .clk(clk), .rst(rst), .in( pico_in ),  .out( pico_out ) );
+        // both tables are written together from the bus (pico memory window)
+        fun_pico i_fun_pico_A  ( .clk(clk), .rst(rst), .in( pico_in ),  .out( pico_out ),
+                                 .we( pico_we ), .addr( pico_addr ), .wdata( pico_wdata ), .rdata( pico_rdata ) );
 
         rand_gen_uni i_rand_gen_uni_A  ( .clk(clk), .rst(rst), .run( noise_enable ),  .out( rand_out ) );
         fun_icdf i_fun_icdf  ( .clk(clk), .rst(rst), .in( $signed(rand_out[32-1:21]) ),  .out( rand_norm ) );
@@ -208,7 +217,8 @@ module dummy(
 
         satprotect #(.Ri(15),.Ro(14),.SAT(14)) i_satprotect_pico_simul_in ( .in(simul_in_sum),  .out(simul_in) );
 
-        fun_pico i_fun_pico_B  ( .clk(clk), .rst(rst), .in(simul_in ),  .out( pico_simul_out ) );
+        fun_pico i_fun_pico_B  ( .clk(clk), .rst(rst), .in(simul_in ),  .out( pico_simul_out ),
+                                 .we( pico_we ), .addr( pico_addr ), .wdata( pico_wdata ), .rdata(            ) );
         assign fun_simul_out =  pico_simul_out * $signed( sg_amp ) ;
 
         assign val_simul     = $signed( fun_simul_out[27-1:13] ) ;
@@ -586,6 +596,31 @@ module dummy(
     ) ;
 
 
+    // -----------------------------------------------------------------------------------------
+    // Sample clock
+    // -----------------------------------------------------------------------------------------
+
+    // 64 bits count of clk, runs while start_clk (read_ctrl[1]) is set and
+    // it is cleared when start_clk goes low. The bus copy is held while
+    // Freeze (read_ctrl[0]) is set, so both halves come from the same clock.
+    reg          [64-1:0] clk_count, clk_count_latch ;
+
+    always @(posedge clk)
+    if (rst | ~read_ctrl[1])
+        clk_count <= 64'd0 ;
+    else
+        clk_count <= clk_count + 64'd1 ;
+
+    always @(posedge clk)
+    if (rst)
+        clk_count_latch <= 64'd0 ;
+    else if (~read_ctrl[0])
+        clk_count_latch <= clk_count ;
+
+    assign cnt_clk  = clk_count_latch[32-1: 0] ;
+    assign cnt_clk2 = clk_count_latch[64-1:32] ;
+
+
 
 
 
@@ -665,8 +700,15 @@ module dummy(
           //if (sys_addr[19:0]==20'h00084)  val_fun               <=  sys_wdata[14-1: 0] ; // Added automatically by script
           //if (sys_addr[19:0]==20'h00088)  noise_std             <=  sys_wdata[14-1: 0] ; // Added automatically by script
             if (sys_addr[19:0]==20'h0008C)  read_ctrl             <=  sys_wdata[ 3-1: 0] ; // [unused,start_clk,Freeze]
+          //if (sys_addr[19:0]==20'h00090)  cnt_clk               <=  sys_wdata[32-1: 0] ; // Clock count, low 32 bits
+          //if (sys_addr[19:0]==20'h00094)  cnt_clk2              <=  sys_wdata[32-1: 0] ; // Clock count, high 32 bits
         end
     end
+    
+    // pico memory: 2048 words from 20'h02000 // peak table of fun_pico (pico_data.dat at power up)
+    assign pico_we              = sys_wen & (sys_addr[19:13]==7'h1) ;
+    assign pico_addr            = sys_addr[12:2] ;
+    assign pico_wdata           = sys_wdata[14-1: 0] ;
     //---------------------------------------------------------------------------------
     // FPGA --> MEMORIA --> SO
     wire sys_en;
@@ -676,8 +718,10 @@ module dummy(
     if (rst) begin
         sys_err <= 1'b0  ;
         sys_ack <= 1'b0  ;
+        pico_rd <= 1'b0  ;
     end else begin
         sys_err <= 1'b0 ;
+        pico_rd <= sys_ren & (sys_addr[19:13]==7'h1) ; // memory read port is registered
         
         casez (sys_addr[19:0])
             20'h00000 : begin sys_ack <= sys_en;  sys_rdata <= {  27'b0                   ,          oscA_sw  }; end // switch for muxer oscA
@@ -716,6 +760,9 @@ module dummy(
             20'h00084 : begin sys_ack <= sys_en;  sys_rdata <= {  {18{val_fun[13]}}       ,          val_fun  }; end // Added automatically by script
             20'h00088 : begin sys_ack <= sys_en;  sys_rdata <= {  {18{noise_std[13]}}     ,        noise_std  }; end // Added automatically by script
             20'h0008C : begin sys_ack <= sys_en;  sys_rdata <= {  29'b0                   ,        read_ctrl  }; end // [unused,start_clk,Freeze]
+            20'h00090 : begin sys_ack <= sys_en;  sys_rdata <=                                       cnt_clk   ; end // Clock count, low 32 bits
+            20'h00094 : begin sys_ack <= sys_en;  sys_rdata <=                                      cnt_clk2   ; end // Clock count, high 32 bits
+            20'b0000001????????????? : begin sys_ack <= sys_wen | pico_rd;  sys_rdata <= {  {18{pico_rdata[13]}} ,  pico_rdata  }; end // peak table of fun_pico (pico_data.dat at power up)
             default   : begin sys_ack <= sys_en;  sys_rdata <=  32'h0        ; end
         endcase
     end
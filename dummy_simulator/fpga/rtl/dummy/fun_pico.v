@@ -6,18 +6,23 @@ module fun_pico
 (
     input clk,rst,
     input signed    [14-1:0] in,   // input
-    output signed   [14-1:0] out   // output
+    output signed   [14-1:0] out,  // output
+    // table write / read back port (system bus)
+    input                    we,
+    input           [11-1:0] addr,
+    input  signed   [14-1:0] wdata,
+    output reg signed [14-1:0] rdata
 );
     // Addr for memory slots
 
 
-    wire signed [14-1:0] out_pico ;
     wire signed [14-1:0] pos_absolute;
 
     wire        [11-1:0] pos ;
 
     reg signed  [14-1:0]  out_reg ;
 
+    (* ram_style = "block" *)
     reg signed [14-1:0] pico [2048-1:0]; // vector for amplitude value
     initial
     begin
@@ -34,9 +39,7 @@ module fun_pico
     assign pos_abs = { 3'b0  , pos };
     //satprotect #(.Ri(15),.Ro(14),.SAT(14)) i_satprotect_pos_plus  ( .in(pos_plus),  .out(pos) );
 
-    assign out_pico = pico[pos];
-
-
+    // read port, registered (block RAM output)
     always @(posedge clk)
         if (rst)
         begin
@@ -44,11 +47,19 @@ module fun_pico
         end
         else
         begin
-            out_reg       <=   out_pico   ;
+            out_reg       <=   pico[pos]  ;
         end
 
+    // write / read back port. The table keeps pico_data.dat until it is written
+    always @(posedge clk)
+    begin
+        if (we)
+            pico[addr]    <=   wdata    ;
+        rdata             <=   pico[addr] ;
+    end
+
     assign out  = $signed(out_reg) ;
 
 endmodule
 
-    //  fun_pico i_fun_pico_A  ( .clk(clk), .rst(rst), .in( IN ),  .out( OUT ) );
+    //  fun_pico i_fun_pico_A  ( .clk(clk), .rst(rst), .in( IN ),  .out( OUT ), .we( WE ), .addr( ADDR ), .wdata( WDATA ), .rdata( RDATA ) );
@@ -2,34 +2,43 @@
 
 from __future__ import print_function
 
+import os
+import mmap
 import signal
 from time import time
 from time import sleep
-import mmap
+from time import monotonic
+import math
+import socket
 import sys
 import struct
-import subprocess
 
 import argparse
 
 
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
 
 
-# Some config vars
-Dtime  = 2e-3  # seg
-Dtime2 = Dtime/2
+from hugo import osc,dm
 
-def eprint(*args, **kwargs):
-    print(*args, file=sys.stderr, **kwargs)
 
-# This is to prevent CTRL+C signal to go to nc subprocess
-def preexec_function():
-    # Ignore the SIGINT signal by setting the handler to the standard
-    # signal handler SIG_IGN.
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+CLK = 125000000     # sample clock (cnt_clk) frequency
+
+TRAILER    = 0xFFFFFFFFFFFFFFFF     # tick of the last record of the stats trailer
+stat_names = ('samples','rate','lag_mean','lag_std','lag_max','missed')
 
 
-from hugo import osc,li
+def stats_trailer(st,ss):
+    """
+    End of a '!Qq' stream with the sampler stats st (sampler.stats()):
+    the text 'stats samples N rate R lag_mean M lag_std S lag_max X missed K\n'
+    padded with spaces to whole records of ss, then one record with tick
+    TRAILER and the text length in the host time field.
+    """
+    txt  = 'stats '+' '.join([ '{:s} {:s}'.format(y, repr(st[y])) for y in stat_names ])+'\n'
+    size = -(-len(txt)//ss.size)*ss.size
+    return txt.encode('ascii').ljust(size) + struct.pack('!Qq', TRAILER, size).ljust(ss.size, b'\0')
 
 
 # Function to handle nice close with CTRL+C
@@ -43,6 +52,237 @@ class GracefulKiller:
         self.kill_now = True
 
 
+class sampler():
+    """
+    Samples dummy regs at a fixed rate and packs them as '!Qq'+'l'*N records:
+    sample clock tick (cnt_clk2:cnt_clk, 125 MHz clocks since start_clk), host
+    time in microseconds since self.t0, and the regs. The tick is read in the
+    same frozen snapshot as the regs, so it is the FPGA time of the values.
+    With ticks=False the records are the old '!f'+'l'*N (host time in seconds
+    as float32).
+
+    The sampling times follow a monotonic deadline schedule: sample k is taken
+    at t_start + k/rate. If a deadline is missed by more than one period the
+    schedule skips ahead instead of bursting, and the skipped deadlines are
+    counted in self.missed.
+
+    Records are packed into a buffer of `batch` records that is handed to
+    sink(memoryview) when it is full or `flush_time` seconds after the first
+    pending record. A '!Qq' stream ends with the stats (stats_trailer).
+    """
+    def __init__(self,params,rate=500,batch=256,flush_time=0.2,ticks=True):
+        self.params     = params
+        self.ticks      = ticks
+        self.plan       = dm.plan((['cnt_clk','cnt_clk2'] if ticks else [])+list(params), signed=True)
+        self.rate       = rate
+        self.period     = 1.0/rate
+        self.batch      = batch
+        self.flush_time = flush_time
+        self.ss         = struct.Struct(('!Qq' if ticks else '!f')+'l'*len(params))
+        self.buff       = bytearray(self.ss.size*batch)
+        self.t0         = time()
+        self.count      = 0
+        self.missed     = 0
+        self.lag_sum    = 0.0
+        self.lag_sum2   = 0.0
+        self.lag_max    = 0.0
+        self.elapsed    = 0.0
+
+    def header(self):
+        """
+        100 bytes column header + 3400 bytes params header.
+        The 'clock' line (sample clock frequency) marks '!Qq' records.
+        """
+        txt='Columns: '+','.join(self.params)+'\n'+'timestamp {:>20f}\n'.format(self.t0)
+        if self.ticks:
+            txt+='clock {:d}\n'.format(CLK)
+        txt=(txt.ljust(99)+'\n').encode('ascii')
+        vals=dm.read_all()
+        txt2=[]
+        for r in dm.regs:
+            txt2.append( '"{:s}": {:f}'.format(r.name,vals[r.name]) )
+        txt+= (  ('params={'+',\n'.join(txt2) +'\n}\n').ljust(3399)+'\n' ).encode('ascii')
+        return txt
+
+    def run(self,sink,timeout=0,killer=None):
+        """
+        Samples until timeout seconds (0 means infinite) or killer.kill_now
+        """
+        with dm:
+            dm.start_clk()
+            m0    = monotonic()
+            mt0   = m0 - (time()-self.t0)   # monotonic time for self.t0
+            k     = 0
+            n     = 0
+            tsend = m0
+            while True:
+                deadline = m0 + k*self.period
+                now = monotonic()
+                if deadline>now:
+                    sleep(deadline-now)
+                    now = monotonic()
+                lag = now-deadline
+                if lag>self.period:
+                    skip = int(lag/self.period)
+                    self.missed += skip
+                    k   += skip
+                    lag -= skip*self.period
+                self.lag_sum  += lag
+                self.lag_sum2 += lag*lag
+                self.lag_max   = max(self.lag_max,lag)
+                if self.ticks:
+                    vals = self.plan.read()
+                    tick = (vals[0] & 0xFFFFFFFF) | (vals[1] & 0xFFFFFFFF)<<32
+                    self.ss.pack_into(self.buff, n*self.ss.size, tick, int((now-mt0)*1e6), *vals[2:])
+                else:
+                    self.ss.pack_into(self.buff, n*self.ss.size, now-mt0, *self.plan.read())
+                if n==0:
+                    tsend = now
+                n += 1
+                k += 1
+                self.count += 1
+                if n==self.batch or now-tsend>self.flush_time:
+                    sink(memoryview(self.buff)[:n*self.ss.size])
+                    n = 0
+                if timeout>0 and now-m0>timeout:
+                    break
+                if killer is not None and killer.kill_now:
+                    break
+            if n>0:
+                sink(memoryview(self.buff)[:n*self.ss.size])
+            self.elapsed = monotonic()-m0
+
+    def stats(self):
+        """Returns achieved rate, mean and std of sampling lag, max lag and missed deadlines"""
+        n    = max(1,self.count)
+        mean = self.lag_sum/n
+        std  = math.sqrt(max(0.0, self.lag_sum2/n - mean**2))
+        return { 'samples' : self.count,
+                 'rate'    : self.count/self.elapsed if self.elapsed>0 else 0.0,
+                 'lag_mean': mean,
+                 'lag_std' : std,
+                 'lag_max' : self.lag_max,
+                 'missed'  : self.missed }
+
+
+class ring_recorder():
+    """
+    Records sampler output into a ring of preallocated, memory mapped segment
+    files, so long runs do not depend on a network listener.
+
+    Each segment file is seg_NNN.bin with the usual 100+3400 bytes header
+    (params read when the segment is started) followed by room for
+    `seg_records` records. When a segment is full the next slot is started
+    and, after `segments` slots, the oldest one is overwritten.
+
+    index.txt keeps one line per live segment:
+        seq,slot,records,t_first,t_last
+    and, after close(stats), a '# stats ...' line with the sampler stats.
+    where seq is the segment sequence number since the start of the run and
+    times are unix timestamps (host time) of the first and last record. It is
+    rewritten on each rotation and every `index_time` seconds, so a crash
+    loses at most the record count of the last seconds of the active segment.
+
+    Usage:
+        rec = ring_recorder('/tmp/rec', smp.header, smp.ss.size, smp.t0, ticks=smp.ticks)
+        smp.run(rec.write)
+        rec.close()
+    """
+    head_size = 3500
+
+    def __init__(self,dirname,header_fun,record_size,t0,seg_records=100000,segments=16,index_time=5,ticks=True):
+        self.dirname     = dirname
+        self.header_fun  = header_fun
+        self.record_size = record_size
+        self.t0          = t0
+        self.seg_records = seg_records
+        self.segments    = segments
+        self.index_time  = index_time
+        self.seg_size    = self.head_size + record_size*seg_records
+        self.tt          = struct.Struct('!8xq' if ticks else '!f')
+        self.tscale      = 1e-6 if ticks else 1.0
+        self.index       = []       # [seq,slot,records,t_first,t_last]
+        self.seq         = -1
+        self.mm          = None
+        self.pos         = 0
+        self.tindex      = monotonic()
+        self.stats       = None
+        os.makedirs(dirname, exist_ok=True)
+        self.files = [ self.prealloc(self.seg_name(i)) for i in range(segments) ]
+
+    def seg_name(self,slot):
+        return os.path.join(self.dirname, 'seg_{:03d}.bin'.format(slot))
+
+    def prealloc(self,filename):
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size!=self.seg_size:
+            os.ftruncate(fd, self.seg_size)
+            if hasattr(os,'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, self.seg_size)
+                except OSError:
+                    pass
+        return fd
+
+    def rotate(self):
+        if self.mm is not None:
+            self.mm.flush()
+            self.mm.close()
+        self.seq += 1
+        slot = self.seq % self.segments
+        self.index = [ y for y in self.index if y[1]!=slot ]
+        self.index.append([ self.seq, slot, 0, 0.0, 0.0 ])
+        self.mm  = mmap.mmap(self.files[slot], self.seg_size)
+        head     = self.header_fun()
+        self.mm[0:len(head)] = head
+        self.pos = self.head_size
+        self.save_index()
+
+    def save_index(self):
+        txt  = '# head_size {:d} record_size {:d} seg_records {:d} segments {:d}\n'.format(
+                    self.head_size, self.record_size, self.seg_records, self.segments )
+        if self.stats is not None:
+            txt += '# stats '+' '.join([ '{:s} {:s}'.format(y, repr(self.stats[y])) for y in stat_names ])+'\n'
+        txt += '# seq,slot,records,t_first,t_last\n'
+        for y in self.index:
+            txt += '{:d},{:d},{:d},{:f},{:f}\n'.format(*y)
+        tmp = os.path.join(self.dirname, 'index.tmp')
+        with open(tmp,'w') as f:
+            f.write(txt)
+        os.replace(tmp, os.path.join(self.dirname, 'index.txt'))
+        self.tindex = monotonic()
+
+    def write(self,buff):
+        """Sampler sink. buff holds a whole number of records"""
+        buff = memoryview(buff)
+        while len(buff)>0:
+            if self.mm is None or self.pos>=self.seg_size:
+                self.rotate()
+            n = min(len(buff), self.seg_size-self.pos)
+            self.mm[self.pos:self.pos+n] = buff[:n]
+            seg = self.index[-1]
+            if seg[2]==0:
+                seg[3] = self.t0 + self.tt.unpack_from(buff,0)[0]*self.tscale
+            seg[2] += n//self.record_size
+            seg[4]  = self.t0 + self.tt.unpack_from(buff,n-self.record_size)[0]*self.tscale
+            self.pos += n
+            buff = buff[n:]
+        if monotonic()-self.tindex>self.index_time:
+            self.save_index()
+
+    def close(self,stats=None):
+        """Closes the segments. stats (sampler.stats()) go to index.txt"""
+        self.stats = stats
+        if self.mm is not None:
+            self.mm.flush()
+            self.mm.close()
+            self.mm = None
+        self.save_index()
+        for fd in self.files:
+            os.close(fd)
+        self.files = []
+
+
 parser = argparse.ArgumentParser()
 
 parser.add_argument("-s", "--server", type=str, default="10.0.32.147",
@@ -51,24 +291,28 @@ parser.add_argument("-p", "--port", type=str, default="6000",
                     help="server tcp port")
 parser.add_argument("-t", "--timeout", type=int, dest='timeout', default=0,
                     help="timeout value. 0 means infinite.")
+parser.add_argument("-r", "--rate", type=float, dest='rate', default=500,
+                    help="samples per second")
+parser.add_argument("-b", "--batch", type=int, dest='batch', default=256,
+                    help="max number of records for each network write")
 parser.add_argument('--params', nargs='+')
-
-args = parser.parse_args()
-
-nc_cmd = ['nc '+args.server+' '+args.port]
+parser.add_argument("--float-time", action="store_false", dest='ticks', default=True,
+                    help="old records: float32 host time instead of sample clock ticks")
+parser.add_argument("--record", type=str, dest='record', default='',
+                    help="record into a ring of segment files in this directory instead of streaming")
+parser.add_argument("--seg-records", type=int, dest='seg_records', default=100000,
+                    help="records for each segment file")
+parser.add_argument("--segments", type=int, dest='segments', default=16,
+                    help="number of segment files in the ring")
 
 
 if __name__ == '__main__':
+    args = parser.parse_args()
+
     # Function for nice kill
     killer = GracefulKiller()
 
-    # Memory sectors to send
-    memcodes=[]
-
-    if len(sys.argv)>1:
-        for i in args.params:
-            memcodes.append(li[i].addr)
-    else:
+    if args.params is None or not all([ y in dm.names() for y in args.params ]):
         eprint("Usage: ... ")
         eprint(" ")
         numkeys=[y.ljust(20) for y in dm.names()]
@@ -78,73 +322,45 @@ if __name__ == '__main__':
         eprint("Run in server:")
         eprint("nc -l -p 6000 | pv -b >  $( date +%Y%m%d_%H%M%S ).bin ")
         eprint("")
+        eprint("Or record on the RP and pull the segments later:")
+        eprint("data_dump.py --record /tmp/rec --params ...")
+        eprint("")
         exit()
 
-    # Store first time
-    t0=time()
-
-    struct_str='!f'
-    C=[]
-    for i in args.params:
-        struct_str+='l'
-        C.append(0)
-    ss=struct.Struct(struct_str)
-
-    # NetCat proccess to send data to server
-    process = subprocess.Popen(nc_cmd, shell=True, stdin=subprocess.PIPE,stdout=subprocess.PIPE,preexec_fn = preexec_function)
-
-    txt=(('Columns: '+','.join(args.params)+'\n'+'timestamp {:>20f}\n'.format(t0)).ljust(99)+'\n').encode('ascii')
-
-    process.stdin.write(txt)
-    process.stdin.flush()
-
-    # Open memory
-    with open("/dev/mem", "r+b") as f:
-      mm = mmap.mmap(f.fileno(), 512, offset=0x40600000)
-
-      txt2=[]
-      for i in li:
-          addr=i.addr
-          A=int.from_bytes(mm[addr:addr+4], byteorder='little', signed=True)
-          txt2.append( '"{:s}": {:f}'.format(i.name,A) )
-      process.stdin.write( (  ('params={'+',\n'.join(txt2) +'\n}\n').ljust(3399)+'\n' ).encode('ascii') )
-      process.stdin.flush()
-      dm.start_clk()
-      print(t0)
-      tl=time()
-      if args.timeout <= 0:
-          while True:
-              if (time()-tl>Dtime):
-                  dm.freeze()
-                  for i,addr in enumerate(memcodes):
-                      C[i]=int.from_bytes(mm[addr:addr+4], byteorder='little', signed=True)
-                  #sys.stdout.buffer.write( ss.pack(time()-t0, *C )  )
-                  dm.unfreeze()
-                  process.stdin.write( ss.pack(time()-t0, *C ) )
-                  process.stdin.flush()
-              sleep(Dtime2)
-              if killer.kill_now:
-                  break
-      else:
-          while True:
-              if (time()-tl>Dtime):
-                  dm.freeze()
-                  for i,addr in enumerate(memcodes):
-                      C[i]=int.from_bytes(mm[addr:addr+4], byteorder='little', signed=True)
-                  #sys.stdout.buffer.write( ss.pack(time()-t0, *C )  )
-                  dm.unfreeze()
-                  process.stdin.write( ss.pack(time()-t0, *C ) )
-                  process.stdin.flush()
-              sleep(Dtime2)
-              if (time()-tl>args.timeout):
-                  break
-              if killer.kill_now:
-                  break
+    smp = sampler(args.params, rate=args.rate, batch=args.batch, ticks=args.ticks)
+
+    if len(args.record)>0:
+        rec = ring_recorder(args.record, smp.header, smp.ss.size, smp.t0,
+                            seg_records=args.seg_records, segments=args.segments, ticks=args.ticks)
+        print(smp.t0)
+        try:
+            smp.run(rec.write, timeout=args.timeout, killer=killer)
+        finally:
+            rec.close(smp.stats())
+    else:
+        # Connection to the server
+        sock = socket.create_connection((args.server, int(args.port)))
+
+        with dm:
+            sock.sendall( smp.header() )
+            print(smp.t0)
+            smp.run(sock.sendall, timeout=args.timeout, killer=killer)
+            if args.ticks:
+                sock.sendall( stats_trailer(smp.stats(), smp.ss) )
+
+        sock.shutdown(socket.SHUT_WR)
+        sock.close()
     # End code
 
     print("Program finished")
     print('')
-    print("pack string: '{:s}'".format(struct_str))
+    print("pack string: '{:s}'".format(smp.ss.format))
+    st=smp.stats()
+    print("samples    : {:d}".format(st['samples']))
+    print("rate       : {:.1f} samples/s".format(st['rate']))
+    print("jitter     : mean={:.1f} us, std={:.1f} us, max={:.1f} us".format(
+            st['lag_mean']*1e6, st['lag_std']*1e6, st['lag_max']*1e6 ))
+    print("missed     : {:d}".format(st['missed']))
 
 
 
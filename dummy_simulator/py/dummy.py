@@ -22,18 +22,19 @@ from hugo import osc,dm
 if __name__ == '__main__':
     # Memory sectors to send
 
-    if len(sys.argv)<2:
-        dm.show()
-    elif len(sys.argv)==2:
-        if sys.argv[1] in dm.names():
-            dm.show(sys.argv[1])
+    with dm:
+        if len(sys.argv)<2:
+            dm.show()
+        elif len(sys.argv)==2:
+            if sys.argv[1] in dm.names():
+                dm.show(sys.argv[1])
+            else:
+                print('reg not found')
+        elif len(sys.argv)==3:
+            if sys.argv[1] in dm.names() and is_int(sys.argv[2]):
+                dm[sys.argv[1]].val(int(sys.argv[2]))
+                dm.show(sys.argv[1])
         else:
-            print('reg not found')
-    elif len(sys.argv)==3:
-        if sys.argv[1] in dm.names() and is_int(sys.argv[2]):
-            dm[sys.argv[1]].val(int(sys.argv[2]))
-            dm.show(sys.argv[1])
-    else:
-        for i in sys.argv[1:]:
-            if i in dm.names():
-                dm.show(i)
+            for i in sys.argv[1:]:
+                if i in dm.names():
+                    dm.show(i)
@@ -4,15 +4,23 @@
 Module for Oscilloscope and Dummy control
 """
 
-from time import sleep
+from time import sleep,monotonic
 import mmap
+import os
 import sys
 import struct
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 #%%
 
 class fpga_reg():
     """Register for FPGA module"""
+    __slots__ = ('name','rw','ro','nbits','index','addr','base_addr','signed','dev_file','bank','fmt')
+
     def __init__(self, name,index,nbits=32,signed=False,rw=True,base_addr=0x40600000,dev_file="/dev/mem"):
         """Initialize attributes."""
         self.name        = name
@@ -24,6 +32,8 @@ class fpga_reg():
         self.base_addr   = base_addr
         self.signed      = signed
         self.dev_file    = dev_file
+        self.bank        = None
+        self.fmt         = struct.Struct('<l' if signed else '<L')
 
     def __getitem__(self, key): # This lets you use [] for attributes
         return getattr(self,key)
@@ -32,46 +42,214 @@ class fpga_reg():
         return '{:s}(addr:{:d})'.format(self.name,self.addr)
 
     def val(self,value=None):
+        if self.bank is None or self.bank.mem is None:
+            return self.val_nobank(value)
+        if type(value)==int and self.rw:
+            self.fmt.pack_into(self.bank.mem, self.addr, value)
+        return self.fmt.unpack_from(self.bank.mem, self.addr)[0]
+
+    def read(self):
+        if self.bank is None or self.bank.mem is None:
+            return self.read_nobank()
+        return self.fmt.unpack_from(self.bank.mem, self.addr)[0]
+
+    def val_nobank(self,value=None):
+        """Access through a temporary mapping, used when the bank is not open"""
         with open(self.dev_file, "r+b") as dev:
             mem = mmap.mmap(dev.fileno(), 512, offset=self.base_addr)
             if type(value)==int and self.rw:
                 mem[self.addr:self.addr+4]=( value ).to_bytes(4, byteorder='little' , signed=self.signed )
             return int.from_bytes(mem[self.addr:self.addr+4], byteorder='little', signed=self.signed )
 
-    def read(self):
+    def read_nobank(self):
         with open(self.dev_file, "rb") as dev:
-            mem = mmap.mmap(dev.fileno(), 512, offset=self.base_addr)
+            mem = mmap.mmap(dev.fileno(), 512, offset=self.base_addr, prot=mmap.PROT_READ)
             return int.from_bytes(mem[self.addr:self.addr+4], byteorder='little', signed=self.signed)
 
 
+class fpga_mem():
+    """
+    Memory window of an FPGA module (e.g. the peak table of fun_pico): depth
+    words of nbits, one for each 32 bits address from offset.
+
+    write() sends the values with one burst over the bank mapping and reads
+    them back to verify. Inside a `with bank:` block the mapping is shared
+    with the other accesses:
+
+        dm.mems['pico'].write(table)          # list of up to depth ints
+        vals = dm.mems['pico'].read()
+    """
+    __slots__ = ('name','offset','depth','nbits','signed','bank')
+
+    def __init__(self,name,offset,depth,nbits=32,signed=False):
+        """Initialize attributes."""
+        self.name        = name
+        self.offset      = offset
+        self.depth       = depth
+        self.nbits       = nbits
+        self.signed      = signed
+        self.bank        = None
+
+    def __str__(self):
+        return '{:s}(offset:0x{:X},depth:{:d})'.format(self.name,self.offset,self.depth)
+
+    def limits(self):
+        if self.signed:
+            return -(1<<(self.nbits-1)), (1<<(self.nbits-1))-1
+        return 0, (1<<self.nbits)-1
+
+    def decode(self,words):
+        """Bus words (unsigned) to values of nbits"""
+        mask = (1<<self.nbits)-1
+        half = 1<<(self.nbits-1)
+        if self.signed:
+            return [ ((w & mask) ^ half) - half for w in words ]
+        return [ w & mask for w in words ]
+
+    def write(self,values,start=0,verify=True):
+        """
+        Writes values from the word start. With verify, reads them back and
+        raises RuntimeError if any word differs. Returns the number of words.
+        """
+        values = [ int(y) for y in values ]
+        n      = len(values)
+        if start<0 or start+n>self.depth:
+            raise ValueError('{:s}: {:d} words from {:d} do not fit in {:d}'.format(self.name,n,start,self.depth))
+        lo,hi = self.limits()
+        if n>0 and ( min(values)<lo or max(values)>hi ):
+            raise ValueError('{:s}: values out of [{:d},{:d}]'.format(self.name,lo,hi))
+        data = struct.pack('<{:d}{:s}'.format(n, 'l' if self.signed else 'L'), *values)
+        pos  = self.offset + 4*start
+        with self.bank:
+            self.bank.mem[pos:pos+4*n] = data
+            back = self.bank.mem[pos:pos+4*n] if verify else None
+        if verify:
+            got = self.decode(struct.unpack('<{:d}L'.format(n), back))
+            bad = [ i for i in range(n) if got[i]!=values[i] ]
+            if len(bad)>0:
+                raise RuntimeError('{:s}: {:d} of {:d} words differ after write, first at {:d}'.format(
+                                   self.name, len(bad), n, start+bad[0]))
+        return n
+
+    def read(self,start=0,num=None):
+        """Reads num words (all from start by default). Returns a list of ints"""
+        num = self.depth-start if num is None else num
+        pos = self.offset + 4*start
+        with self.bank:
+            raw = self.bank.mem[pos:pos+4*num]
+        return self.decode(struct.unpack('<{:d}L'.format(num), raw))
+
+
 class fpga_regs():
-    """Register for FPGA module"""
+    """
+    Bank of registers for one FPGA module.
+
+    By default each register access maps the device memory on its own. Using
+    the bank as a context manager keeps one mapping open for all the registers
+    of the bank, which is much faster for repeated accesses:
+
+        with dm:
+            dm['peak_pos'].val(100)
+            vals = dm.read_all()
+
+    Nested `with` blocks share the same mapping.
+    """
     def __init__(self, base_addr=0x40600000,dev_file="/dev/mem"):
         """Initialize attributes."""
         self.base_addr   = base_addr
         self.dev_file    = dev_file
         self.regs        = []
+        self.lookup      = {}
+        self.size        = mmap.PAGESIZE
+        self.dev         = None
+        self.mem         = None
+        self.opened      = 0
+        self.bulk        = None
+        self.mems        = {}
 
     def add(self,reg):
-        if reg.name in [y.name for y in self.regs ]:
+        if reg.name in self.lookup:
             print('name already exist')
         else:
             reg.base_addr = self.base_addr
             reg.dev_file  = self.dev_file
+            reg.bank      = self
             self.regs.append(reg)
+            self.lookup[reg.name] = reg
+            self.bulk     = None
         self.N        = len(self.regs)
         self.max_name = max([len(y.name) for y in self.regs ])
 
+    def add_mem(self,mem):
+        """Adds a memory window. The bank mapping grows to include it"""
+        if self.opened>0:
+            raise RuntimeError('can not add memories while the bank is open')
+        mem.bank = self
+        self.mems[mem.name] = mem
+        end = mem.offset + mem.depth*4
+        self.size = max(self.size, -(-end//mmap.PAGESIZE)*mmap.PAGESIZE)
+
     def __getitem__(self, key):
         if type(key)==int:
             return self.regs[key]
         if type(key)==str:
-            return self.regs[ [y.name for y in self.regs ].index(key) ]
+            return self.lookup[key]
         if type(key)==slice:
             return self.regs[key]
 
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """Map the bank memory. Keeps a counter so nested calls share the mapping."""
+        if self.opened==0:
+            self.dev = open(self.dev_file, "r+b")
+            try:
+                self.mem = mmap.mmap(self.dev.fileno(), self.size, offset=self.base_addr)
+            except OSError:
+                self.dev.close()
+                self.dev = None
+                raise
+        self.opened += 1
+        return self
+
+    def close(self):
+        """Release the bank memory mapping when the last user closes it."""
+        if self.opened==0:
+            return
+        self.opened -= 1
+        if self.opened==0:
+            self.mem.close()
+            self.dev.close()
+            self.mem = None
+            self.dev = None
+
+    def set_dev_file(self,dev_file):
+        """Change the memory device (or file) used by the bank and all its registers"""
+        if self.opened>0:
+            raise RuntimeError('can not change dev_file while the bank is open')
+        self.dev_file = dev_file
+        for r in self.regs:
+            r.dev_file = dev_file
+
     def names(self):
-        return [y.name for y in self.regs ]
+        return list(self.lookup)
+
+    def plan(self,names,signed=None,freeze=None):
+        """Returns a snapshot_plan to read the registers `names` of this bank"""
+        return snapshot_plan(self,names,signed=signed,freeze=freeze)
+
+    def read_all(self):
+        """
+        Reads all the registers of the bank with one struct.unpack_from call.
+        Returns a Dict with names as keys.
+        """
+        if self.bulk is None:
+            self.bulk = self.plan(self.names())
+        return dict(zip( self.bulk.names , self.bulk.read() ))
 
     def show(self,key=None):
         ss='{:<'+str(self.max_name)+'s}: {:>10d}'
@@ -79,10 +257,123 @@ class fpga_regs():
             r=self[key]
             print(ss.format( r.name , r.val() ))
         else:
+            vals=self.read_all()
             for r in self.regs:
-                print(ss.format( r.name , r.val() ))
-
+                print(ss.format( r.name , vals[r.name] ))
+
+
+
+
+class snapshot_plan():
+    """
+    Compiled coherent read of a list of registers of one bank.
+
+    Adjacent register indexes are merged into contiguous ranges and the whole
+    read is done with one precompiled struct (pad bytes between ranges), so a
+    snapshot is a single struct.unpack_from on the bank mapping.
+    For banks with freeze() (fpga_dummy) the read is done between
+    freeze()/unfreeze() on the same mapping.
+
+    Usage:
+        p = dm.plan(['peak_pos','oscA','oscB'])
+        p.read()            # tuple of values in the requested order
+        p.read_into(row)    # writes values into a preallocated list or numpy row
+
+    Params:
+        signed : None uses the signedness of each register. True/False forces it
+                 for all the registers (e.g. data_dump streams everything as signed).
+        freeze : None freezes only if the bank has a freeze() method.
+    """
+    def __init__(self,bank,names,signed=None,freeze=None):
+        self.bank   = bank
+        self.names  = list(names)
+        self.freeze = hasattr(bank,'freeze') if freeze is None else freeze
+        regs   = [ bank[y] for y in self.names ]
+        uniq   = {}
+        for r in sorted(regs, key=lambda x: x.index):
+            uniq[r.index] = r
+        index  = list(uniq)
+        self.ranges = []
+        for i in index:
+            if len(self.ranges)>0 and sum(self.ranges[-1])==i:
+                self.ranges[-1][1] += 1
+            else:
+                self.ranges.append([i,1])
+        fmt = '<'
+        pos = index[0]
+        for start,num in self.ranges:
+            if start>pos:
+                fmt += '{:d}x'.format(4*(start-pos))
+            for i in range(start,start+num):
+                sg   = uniq[i].signed if signed is None else signed
+                fmt += 'l' if sg else 'L'
+            pos = start+num
+        self.ss     = struct.Struct(fmt)
+        self.offset = index[0]*4
+        order       = [ index.index(r.index) for r in regs ]
+        self.order  = None if order==list(range(len(index))) else order
+
+    def __len__(self):
+        return len(self.names)
 
+    def read(self):
+        bank = self.bank
+        with bank:
+            if self.freeze:
+                was = bank.freeze()
+                vals = self.ss.unpack_from(bank.mem, self.offset)
+                if not was & 1:
+                    bank.unfreeze()
+            else:
+                vals = self.ss.unpack_from(bank.mem, self.offset)
+        if self.order is None:
+            return vals
+        return tuple( vals[i] for i in self.order )
+
+    def read_into(self,row):
+        row[:] = self.read()
+        return row
+
+
+def frame_bin(chA,chB):
+    """
+    Interleaves chA and chB as big-endian int16 pairs, the same bytes that
+    packing each sample with struct '!hh' gives. Returns a memoryview.
+    """
+    if np is None:
+        n   = len(chA)
+        out = [0]*(2*n)
+        out[0::2] = chA
+        out[1::2] = chB
+        return memoryview( struct.pack('!{:d}h'.format(2*n), *out) )
+    out = np.empty( (len(chA),2) , dtype='>i2')
+    out[:,0] = chA
+    out[:,1] = chB
+    return memoryview(out).cast('B')
+
+
+# Header of each frame in multi-shot streams: shot number, TrgWpt, CurWpt, timestamp
+frame_head = struct.Struct('!LHHd')
+
+
+_csv_fmt = {}
+
+def frame_csv(chA,chB):
+    """
+    Text frame with one 'index,chA,chB' line for each sample ('{:05d},{:5d},{:5d}'),
+    built with a single preformatted template.
+    """
+    n = len(chA)
+    if not n in _csv_fmt:
+        _csv_fmt[n] = '%05d,%5d,%5d\n'*n
+    if np is None:
+        vals = [0]*(3*n)
+        vals[0::3] = range(n)
+        vals[1::3] = chA
+        vals[2::3] = chB
+    else:
+        vals = np.column_stack(( np.arange(n) , chA , chB )).ravel().tolist()
+    return _csv_fmt[n] % tuple(vals)
 
 
 #Trigger source:
@@ -99,8 +390,10 @@ class fpga_regs():
 
 class fpga_osc(fpga_regs):
     def __init__(self, base_addr=0x40100000,dev_file="/dev/mem"):
-        fpga_regs.__init__(self, base_addr)
+        fpga_regs.__init__(self, base_addr, dev_file)
         self.type  = 'oscilloscoe'
+        self.ch_addr = (0x40110000,0x40120000)
+        self.ch_len  = 16*1024
         self.trigVal = 0
         self.trigTh  = 0
         self.chA     = [0]*16*1024
@@ -139,39 +432,53 @@ class fpga_osc(fpga_regs):
         self.trigVal=6
 
     def get_chs(self):
-        self.ptr     = self['CurWpt'].val()+1
-        self.trg_ptr = self['TrgWpt'].val()
-        with open("/dev/mem", "r+b") as ff:
-            # Get ChA
-            mem = mmap.mmap(ff.fileno(), mmap.PAGESIZE*1024*32, offset=0x40110000)
-            for i in range(2**14):
-                C=int.from_bytes(mem.read(4), byteorder='little', signed=False)
-                self.chA[i]= ( -1 * ( (C^16383) +1 )  ) if (C & 0x2000 ) else C
+        """
+        Reads both oscilloscope channels and rotates them so the oldest sample
+        comes first. Only the two 64 KiB buffers are mapped.
+
+        With numpy, chA and chB are int16 arrays decoded with vectorized
+        operations; otherwise they are lists of ints.
+        Returns (chA, chB).
+        """
+        with self:
+            self.ptr     = self['CurWpt'].val()+1
+            self.trg_ptr = self['TrgWpt'].val()
+        ptr = self.ptr % self.ch_len
+        with open(self.dev_file, "r+b") as ff:
+            self.chA = self.read_ch(ff, self.ch_addr[0], ptr)
+            self.chB = self.read_ch(ff, self.ch_addr[1], ptr)
+        return self.chA, self.chB
+
+    def read_ch(self,ff,addr,ptr):
+        """Decodes one channel buffer of 14 bits signed samples starting at position ptr"""
+        n   = self.ch_len
+        mem = mmap.mmap(ff.fileno(), n*4, offset=addr)
+        try:
+            if np is None:
+                ch = [ ((C & 0x3FFF) ^ 0x2000) - 0x2000 for C in struct.unpack_from('<{:d}L'.format(n), mem) ]
+                return ch[ptr:] + ch[:ptr]
+            raw = np.frombuffer(mem, dtype='<u4', count=n)
+            ch  = np.empty(n, dtype=np.int16)
+            ch[:n-ptr] = raw[ptr:]
+            ch[n-ptr:] = raw[:ptr]
+            del raw
+        finally:
             mem.close()
-            # Get ChB
-            mem = mmap.mmap(ff.fileno(), mmap.PAGESIZE*1024*32, offset=0x40120000)
-            for i in range(2**14):
-                C=int.from_bytes(mem.read(4), byteorder='little', signed=False)
-                self.chB[i]= ( -1 * ( (C^16383) +1 )  ) if (C & 0x2000 ) else C
-            mem.close()
-            self.chA = self.chA[self.ptr:16384] + self.chA[0:self.ptr]
-            self.chB = self.chB[self.ptr:16384] + self.chB[0:self.ptr]
-        return True
+        ch &= 0x3FFF
+        ch ^= 0x2000
+        ch -= 0x2000
+        return ch
 
     def get_curves(self,binary=False):
+        """
+        Reads the channels and returns them encoded as a frame.
+        binary=True : memoryview of big-endian int16 pairs (chA,chB) for each sample
+        binary=False: text lines 'index,chA,chB'
+        """
         self.get_chs()
-        out=[]
         if binary:
-            out=b''
-            for i in range(16*1024):
-                ss=struct.Struct('!hh')
-                out+=ss.pack(self.chA[i],self.chB[i])
-        else:
-            for i in range(16*1024):
-                out.append("{:05d},{:5d},{:5d}".format(i,self.chA[i],self.chB[i]))
-            out.append('')
-            out='\n'.join(out)
-        return out
+            return frame_bin(self.chA,self.chB)
+        return frame_csv(self.chA,self.chB)
 
     def reset(self):
         self['conf'].val( 2 )
@@ -179,6 +486,45 @@ class fpga_osc(fpga_regs):
     def start_trigger(self):
         self['TrgSrc'].val(self.trigVal)
 
+    def wait_for(self,cond,timeout=10,latency=0.01,spin=1e-3,cancel=None):
+        """
+        Polls cond() until it returns True (returns True) or timeout seconds
+        pass or cancel() returns True (returns False).
+        During the first `spin` seconds it polls without sleeping. After that
+        the sleep between polls doubles up to `latency` seconds.
+        """
+        t0 = monotonic()
+        dt = 1e-4
+        while not cond():
+            tt = monotonic()-t0
+            if tt > timeout or ( cancel is not None and cancel() ):
+                return False
+            if tt > spin:
+                sleep(dt)
+                dt = min(2*dt, latency)
+        return True
+
+    def arm(self,timeout=10,latency=0.01,cancel=None):
+        """
+        Starts the trigger with self.trigVal and, once the pre-trigger buffer
+        is filled, enables the acquisition. Returns False on timeout or when
+        cancel() returns True.
+        """
+        with self:
+            self.start_trigger()
+            if not self.wait_for(lambda: (self['conf'].val() & 4)==4, timeout, latency, cancel=cancel):
+                return False
+            self['conf'].val( self['conf'].val() | 1 )
+        return True
+
+    def wait_done(self,timeout=10,latency=0.01,cancel=None):
+        """
+        Waits for the trigger event and the end of the acquisition. Returns
+        False on timeout or when cancel() returns True.
+        """
+        with self:
+            return self.wait_for(lambda: self['TrgSrc'].val()==0, timeout, latency, cancel=cancel)
+
     def set_dec(self,dec):
         if int(dec) in [0,1,8,64,1024,8192,65536]:
             self['Dec'].val(int(dec))
@@ -216,23 +562,38 @@ osc.add( fpga_reg(name='ChBEqFil4',index=19,rw=True,nbits=25,signed=False) )
 
 class fpga_dummy(fpga_regs):
     def __init__(self, base_addr=0x40600000,dev_file="/dev/mem"):
-        fpga_regs.__init__(self, base_addr)
+        fpga_regs.__init__(self, base_addr, dev_file)
         self.type  = 'dummy'
+        self.ctrl_shadow = None
     def read(self):
         return self.type
 
+    def close(self):
+        fpga_regs.close(self)
+        if self.opened==0:
+            self.ctrl_shadow = None
+
+    def ctrl(self,set_bits=0,keep_bits=7):
+        """
+        Read-modify-write of read_ctrl. While the bank is open the value is kept
+        in a shadow copy, so only the write goes to the bus. Returns the previous value.
+        """
+        reg = self['read_ctrl']
+        if self.ctrl_shadow is None or self.opened==0:
+            self.ctrl_shadow = reg.val()
+        prev = self.ctrl_shadow
+        self.ctrl_shadow = ( prev & keep_bits ) | set_bits
+        reg.val( self.ctrl_shadow )
+        return prev
+
     def freeze(self):
-        val  = self['read_ctrl'].val()
-        self['read_ctrl'].val(  val | 1 )
+        return self.ctrl( set_bits=1 )
     def unfreeze(self):
-        val  = self['read_ctrl'].val()
-        self['read_ctrl'].val(  val & 6 )
+        return self.ctrl( keep_bits=6 )
     def start_clk(self):
-        val  = self['read_ctrl'].val()
-        self['read_ctrl'].val(  val | 2  )
+        return self.ctrl( set_bits=2 )
     def stop_clk(self):
-        val  = self['read_ctrl'].val()
-        self['read_ctrl'].val(  val & 5  )
+        return self.ctrl( keep_bits=5 )
 
 
 # The following code can be printed from config_tool.py
@@ -277,9 +638,40 @@ dm.add( fpga_reg(name='drift_time'         , index= 32, rw=True , nbits= 4,signe
 dm.add( fpga_reg(name='val_fun'            , index= 33, rw=False, nbits=14,signed=True ) )
 dm.add( fpga_reg(name='noise_std'          , index= 34, rw=False, nbits=14,signed=True ) )
 dm.add( fpga_reg(name='read_ctrl'          , index= 35, rw=True , nbits= 3,signed=False) )
+dm.add( fpga_reg(name='cnt_clk'            , index= 36, rw=False, nbits=32,signed=False) )
+dm.add( fpga_reg(name='cnt_clk2'           , index= 37, rw=False, nbits=32,signed=False) )
+dm.add_mem( fpga_mem(name='pico'           , offset=0x02000, depth= 2048, nbits=14,signed=True ) )
 # [REGSET DOCK END]
 
 
+banks = { 'osc': osc , 'dummy': dm }
+
+
+def make_dev_file(filename):
+    """
+    Creates a sparse regular file with the same layout as /dev/mem for the
+    oscilloscope and dummy memory regions. Used to run the tools off-device.
+    """
+    size = max( dm.base_addr+dm.size , osc.ch_addr[1]+osc.ch_len*4 )
+    with open(filename,'ab') as f:
+        if f.tell()<size:
+            f.truncate(size)
+
+
+def use_dev_file(filename="/dev/mem"):
+    """Sets the memory device (or stand-in file) for all the banks"""
+    if filename!="/dev/mem":
+        make_dev_file(filename)
+    for b in banks.values():
+        b.set_dev_file(filename)
+
+
+# A simulated device (resources/dummy_model/sim_dev.py) publishes its memory
+# file here, so every tool can run against it without changes.
+if len(os.environ.get('HUGO_DEV_FILE',''))>0:
+    use_dev_file(os.environ['HUGO_DEV_FILE'])
+
+
 
 
 
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Resident register server.
+
+Keeps the oscilloscope and dummy register banks mapped and answers requests
+over TCP or a Unix socket with a compact framed binary protocol, so each
+operation does not need a new SSH session and a new python process.
+
+There is no authentication: by default it listens on 127.0.0.1 only, and
+the host reaches it through an ssh tunnel, so access still needs an ssh
+login. Listening on every interface (-a 0.0.0.0) lets anyone on the network
+set registers and read the scope.
+
+Run on the Red Pitaya:
+    nohup /opt/redpitaya/www/apps/dummy_simulator/py/hugo_server.py -p 6001 &
+
+and on the host:
+    ssh -N -L 6001:127.0.0.1:6001 root@rp-f01d89.local &
+
+Run off-device, with a regular file standing in for /dev/mem:
+    ./hugo_server.py --dev-file /tmp/fake_mem -u /tmp/hugo.sock
+
+Protocol. Every request and every answer is one frame:
+    head  '!BL'  : code, payload length
+    payload
+
+Request codes:
+    OP_LIST     : no payload. Answers text lines 'bank,index,name,signed,rw'
+    OP_GET      : N x '!BB' (bank, index)         . Answers N x '!q' values
+    OP_SET      : N x '!BBq' (bank, index, value) . Answers N x '!q' read-back values
+    OP_SNAPSHOT : '!B' bank                       . Answers '!q' for each reg of the bank
+    OP_SCOPE    : '!Bd' trigger source, timeout   . If trigger source > 0 it arms and
+                                                    waits first. Answers '!HH' TrgWpt,
+                                                    CurWpt and 16384 x '!hh' chA,chB
+
+Answer code is ST_OK or ST_ERR (payload is the error text).
+The host side client is resources/remote_control/hugo_client.py
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import struct
+import socket
+import socketserver
+import threading
+import argparse
+
+
+from hugo import osc,dm,banks,use_dev_file,frame_bin
+
+
+OP_LIST, OP_GET, OP_SET, OP_SNAPSHOT, OP_SCOPE = range(5)
+ST_OK, ST_ERR = 0, 1
+
+head     = struct.Struct('!BL')
+bank_ids = [ 'osc' , 'dummy' ]
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def recv_exact(sock,size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos<size:
+        n = sock.recv_into(view[pos:])
+        if n==0:
+            return None
+        pos+=n
+    return buf
+
+
+def reg_list():
+    txt=[]
+    for b,bname in enumerate(bank_ids):
+        for r in banks[bname].regs:
+            txt.append('{:d},{:d},{:s},{:d},{:d}'.format(b,r.index,r.name,int(r.signed),int(r.rw)))
+    return ('\n'.join(txt)+'\n').encode('ascii')
+
+
+class regs_index():
+    """Registers by (bank, index) to avoid name lookups on each request"""
+    def __init__(self):
+        self.regs = {}
+        for b,bname in enumerate(bank_ids):
+            for r in banks[bname].regs:
+                self.regs[(b,r.index)] = r
+
+    def __getitem__(self, key):
+        return self.regs[key]
+
+
+lock = threading.Lock()
+
+
+def process(op,payload,idx):
+    """Executes one request and returns the answer payload"""
+    if op==OP_LIST:
+        return reg_list()
+    if op==OP_GET:
+        keys = struct.unpack('!{:d}B'.format(len(payload)), payload)
+        with lock:
+            vals = [ idx[(keys[i],keys[i+1])].read() for i in range(0,len(keys),2) ]
+        return struct.pack('!{:d}q'.format(len(vals)), *vals)
+    if op==OP_SET:
+        items = list(struct.iter_unpack('!BBq', payload))
+        with lock:
+            vals = [ idx[(b,i)].val(int(v)) for b,i,v in items ]
+        return struct.pack('!{:d}q'.format(len(vals)), *vals)
+    if op==OP_SNAPSHOT:
+        bank = banks[bank_ids[payload[0]]]
+        with lock:
+            vals = bank.read_all()
+        return struct.pack('!{:d}q'.format(len(vals)), *[ vals[r.name] for r in bank.regs ])
+    if op==OP_SCOPE:
+        trig,timeout = struct.unpack('!Bd', payload)
+        with lock:
+            if trig>0:
+                osc.reset()
+                osc.trigVal=trig
+                if not ( osc.arm(timeout) and osc.wait_done(timeout) ):
+                    raise RuntimeError('timeout')
+            osc.get_chs()
+            return struct.pack('!HH', osc.trg_ptr, (osc.ptr-1) % osc.ch_len ) + bytes(frame_bin(osc.chA,osc.chB))
+    raise ValueError('unknown code {:d}'.format(op))
+
+
+class handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        idx  = self.server.idx
+        sock = self.request
+        if sock.family!=getattr(socket,'AF_UNIX',None):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            hh = recv_exact(sock, head.size)
+            if hh is None:
+                break
+            op,size = head.unpack(hh)
+            payload = recv_exact(sock, size) if size>0 else b''
+            if payload is None:
+                break
+            try:
+                out = process(op,payload,idx)
+                st  = ST_OK
+            except Exception as e:
+                out = repr(e).encode()
+                st  = ST_ERR
+            sock.sendall( head.pack(st,len(out)) + out )
+
+
+class tcp_server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class unix_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-a", "--address", type=str, default="127.0.0.1",
+                    help="address to listen on. 0.0.0.0 opens it, without authentication, to the network")
+parser.add_argument("-p", "--port", type=int, default=6001,
+                    help="tcp port")
+parser.add_argument("-u", "--unix", type=str, default='',
+                    help="listen on this Unix socket path instead of TCP")
+parser.add_argument("--dev-file", type=str, dest='dev_file', default='/dev/mem',
+                    help="memory device. A regular file is created if it does not exist")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    use_dev_file(args.dev_file)
+
+    if len(args.unix)>0:
+        if os.path.exists(args.unix):
+            os.remove(args.unix)
+        server = unix_server(args.unix, handler)
+        eprint('listening on '+args.unix)
+    else:
+        server = tcp_server((args.address,args.port), handler)
+        eprint('listening on {:s}:{:d}'.format(args.address,args.port))
+
+    server.idx = regs_index()
+
+    with osc, dm:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if len(args.unix)>0 and os.path.exists(args.unix):
+                os.remove(args.unix)
@@ -23,18 +23,19 @@ from hugo import osc,dm
 if __name__ == '__main__':
     # Memory sectors to send
 
-    if len(sys.argv)<2:
-        osc.show()
-    elif len(sys.argv)==2:
-        if sys.argv[1] in osc.names():
-            osc.show(sys.argv[1])
+    with osc:
+        if len(sys.argv)<2:
+            osc.show()
+        elif len(sys.argv)==2:
+            if sys.argv[1] in osc.names():
+                osc.show(sys.argv[1])
+            else:
+                print('reg not found')
+        elif len(sys.argv)==3:
+            if sys.argv[1] in osc.names() and is_int(sys.argv[2]):
+                osc[sys.argv[1]].val(int(sys.argv[2]))
+                osc.show(sys.argv[1])
         else:
-            print('reg not found')
-    elif len(sys.argv)==3:
-        if sys.argv[1] in osc.names() and is_int(sys.argv[2]):
-            osc[sys.argv[1]].val(int(sys.argv[2]))
-            osc.show(sys.argv[1])
-    else:
-        for i in sys.argv[1:]:
-            if i in osc.names():
-                osc.show(i)
+            for i in sys.argv[1:]:
+                if i in osc.names():
+                    osc.show(i)
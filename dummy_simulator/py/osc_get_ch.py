@@ -36,7 +36,6 @@ args = parser.parse_args()
 
 
 if __name__ == '__main__':
-    osc.get_chs()
     outbuff=osc.get_curves(binary=args.binary)
     if args.binary:
         sys.stdout.buffer.write(outbuff)
@@ -24,7 +24,7 @@ def preexec_function():
     signal.signal(signal.SIGINT, signal.SIG_IGN)
 
 
-from hugo import osc,dm
+from hugo import osc,dm,frame_bin,frame_head
 
 
 # Function to handle nice close with CTRL+C
@@ -67,14 +67,28 @@ parser.add_argument("--hyst", type=int, dest='hyst', default=-1,
 
 parser.add_argument("-d", "--decimation", type=int, dest='dec', action='store', choices=[0,1,8,64,1024,8192,65536], default=0, help='decimation value')
 
+parser.add_argument("-n", "--shots", type=int, dest='shots', default=0,
+                    help="multi-shot mode: arm, wait, read and re-arm SHOTS times (0 means infinite with --stream) "
+                         "and write the frames as a binary stream to stdout")
+parser.add_argument("--stream", dest='stream', action="store_true",
+                    help="force the binary stream output, also for one shot")
+parser.add_argument("-l", "--latency", type=float, dest='latency', default=0.01,
+                    help="max time in seconds between polls while waiting the trigger")
+
 # threshold
 
 args = parser.parse_args()
 
+# Multi-shot stream format, for each frame:
+#   frame_head ('!LHHd'): shot number, TrgWpt, CurWpt, timestamp [s]
+#   16384 x '!hh'       : chA, chB samples (same as osc_get_ch.py -b)
+stream = args.stream or args.shots>1
+
 
 if __name__ == '__main__':
     # Function for nice kill
     killer = GracefulKiller()
+    cancel = lambda: killer.kill_now
 
     osc.reset()
     if args.dec>0:
@@ -95,37 +109,36 @@ if __name__ == '__main__':
     if args.trig_pos>=0:
         osc['TrgDelay'].val(args.trig_pos)
 
-    osc.start_trigger()
-    tbuff=time.time()
-
-    while True:
-        sleep(0.1)
-
-        if time.time()-tbuff > args.timeout:
-            success=False
-            break
-        if (osc['conf'].val() & 4 ) == 4:
-            success=True
-            break
+    if stream:
+        with osc:
+            out = sys.stdout.buffer
+            n   = 0
+            while args.shots<=0 or n<args.shots:
+                if killer.kill_now:
+                    break
+                osc.reset()
+                if not osc.arm(args.timeout, args.latency, cancel=cancel):
+                    if not killer.kill_now:
+                        eprint('timeout')
+                    break
+                if not osc.wait_done(args.timeout, args.latency, cancel=cancel):
+                    if not killer.kill_now:
+                        eprint('timeout')
+                    break
+                tt=time.time()
+                osc.get_chs()
+                out.write( frame_head.pack( n , osc.trg_ptr , (osc.ptr-1) % osc.ch_len , tt ) )
+                out.write( frame_bin(osc.chA,osc.chB) )
+                out.flush()
+                n+=1
+        eprint('shots: {:d}'.format(n))
+        exit()
 
-    if not success:
+    if not osc.arm(args.timeout, args.latency, cancel=cancel):
         print('timeout')
         exit()
 
-    new_conf=int( osc['conf'].val() | 1 )
-    osc['conf'].val(new_conf)
-
-    tbuff=time.time()
-    while True:
-        sleep(0.1)
-        if time.time()-tbuff > args.timeout:
-            success=False
-            break
-        if osc['TrgSrc'].val() == 0:
-            success=True
-            break
-
-    if success:
+    if osc.wait_done(args.timeout, args.latency, cancel=cancel):
         print('success')
     else:
         print('memory read error')
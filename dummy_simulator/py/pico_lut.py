@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""
+Peak table (fun_pico) upload and download, through the pico memory window.
+
+    pico_lut.py                       # prints min, max and first values of the table
+    pico_lut.py -l table.dat          # uploads a $readmemb file (14 bits words) and verifies it
+    cat table.dat | pico_lut.py -l -  # same, from stdin (e.g. over ssh from the host)
+    pico_lut.py -o table.dat          # saves the current table as $readmemb
+
+resources/code_helpers/lut_synth.py makes tables in this format.
+"""
+
+from __future__ import print_function
+
+import sys
+from time import monotonic
+
+import argparse
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+from hugo import dm
+
+
+def read_readmemb(f,nbits=14):
+    """Signed values of a $readmemb text (one binary word for each line)"""
+    half = 1 << (nbits-1)
+    vals = [ int(y.strip(),2) for y in f if len(y.strip())>0 ]
+    return [ ((y + half) & ((1<<nbits)-1)) - half for y in vals ]
+
+
+def to_readmemb(vals,nbits=14):
+    mask = (1<<nbits)-1
+    return ''.join([ '{:0{:d}b}\n'.format(y & mask, nbits) for y in vals ])
+
+
+parser = argparse.ArgumentParser(description='Upload/download the peak table of fun_pico')
+
+parser.add_argument("-l", "--load", type=str, dest='load', default=None,
+                    help="$readmemb file to upload ('-' for stdin)")
+parser.add_argument("-o", "--out", type=str, dest='out', default=None,
+                    help="file to save the current table ('-' for stdout)")
+parser.add_argument("--no-verify", action="store_false", dest='verify', default=True,
+                    help="do not read back the uploaded table")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    mem  = dm.mems['pico']
+
+    with dm:
+        if args.load is not None:
+            if args.load=='-':
+                vals = read_readmemb(sys.stdin, mem.nbits)
+            else:
+                with open(args.load,'r') as f:
+                    vals = read_readmemb(f, mem.nbits)
+            if len(vals)!=mem.depth:
+                eprint('pico_lut.py: {:d} values, the table has {:d}'.format(len(vals), mem.depth))
+                sys.exit(1)
+            t0 = monotonic()
+            try:
+                mem.write(vals, verify=args.verify)
+            except (RuntimeError,ValueError) as e:
+                eprint('pico_lut.py: '+str(e))
+                sys.exit(1)
+            eprint('{:d} words written{:s} in {:.2f} ms'.format(
+                   mem.depth, ' and verified' if args.verify else '', (monotonic()-t0)*1e3))
+
+        if args.out is not None:
+            txt = to_readmemb(mem.read(), mem.nbits)
+            if args.out=='-':
+                sys.stdout.write(txt)
+            else:
+                with open(args.out,'w') as f:
+                    f.write(txt)
+
+        if args.load is None and args.out is None:
+            vals = mem.read()
+            print('pico: {:d} words, min {:d}, max {:d}'.format(len(vals), min(vals), max(vals)))
+            print(' '.join([ str(y) for y in vals[:16] ])+' ...')
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark for register access throughput.
+
+Compares the access through a temporary mapping for each operation (old
+behaviour, bank closed) against the persistent bank mapping (`with dm:`).
+Writes put back the value just read, so it is safe to run on a working device.
+
+Off-device it can run against a regular file:
+    ./regs_bench.py --dev-file /tmp/fake_mem
+"""
+
+from __future__ import print_function
+
+import time
+import argparse
+
+
+from hugo import dm,use_dev_file
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-n", "--number", type=int, dest='num', default=2000,
+                    help="number of operations for each test")
+parser.add_argument("-r", "--reg", type=str, dest='reg', default='peak_pos',
+                    help="register used for the test")
+parser.add_argument("--dev-file", type=str, dest='dev_file', default='/dev/mem',
+                    help="memory device. A regular file is created if it does not exist")
+
+args = parser.parse_args()
+
+
+def rate(fun,num):
+    tbuff=time.perf_counter()
+    for i in range(num):
+        fun()
+    return num/(time.perf_counter()-tbuff)
+
+
+def run_tests(num):
+    reg = dm[args.reg]
+    val = reg.val()
+    rr  = rate( reg.val                     , num )
+    ww  = rate( lambda: reg.val(val)        , num )
+    bb  = rate( dm.read_all                 , max(1,int(num/10)) )
+    return rr,ww,bb
+
+
+if __name__ == '__main__':
+    if not args.reg in dm.names():
+        print('reg not found')
+        exit(1)
+
+    use_dev_file(args.dev_file)
+
+    ss='{:<20s}: {:>12.0f} reads/s  {:>12.0f} writes/s  {:>10.0f} bank reads/s'
+
+    before = run_tests(args.num)
+    with dm:
+        after = run_tests(args.num)
+
+    print(ss.format('temporary mapping' , *before ))
+    print(ss.format('persistent mapping', *after  ))
+    print('speedup             : {:>12.1f}x reads   {:>12.1f}x writes'.format(
+            after[0]/before[0], after[1]/before[1] ))
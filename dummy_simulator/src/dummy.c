@@ -128,6 +128,8 @@ int dummy_update(rp_app_params_t *params)
   //g_dummy_reg->val_fun                   = (int)params[DUMMY_VAL_FUN                 ].value;
   //g_dummy_reg->noise_std                 = (int)params[DUMMY_NOISE_STD               ].value;
     g_dummy_reg->read_ctrl                 = (int)params[DUMMY_READ_CTRL               ].value;
+  //g_dummy_reg->cnt_clk                   = (int)params[DUMMY_CNT_CLK                 ].value;
+  //g_dummy_reg->cnt_clk2                  = (int)params[DUMMY_CNT_CLK2                ].value;
   // [FPGAUPDATE DOCK END]
 
     return 0;
@@ -203,6 +205,8 @@ int dummy_update_main(rp_app_params_t *params)
     params[117].value = (float)g_dummy_reg->val_fun              ; // dummy_val_fun
     params[118].value = (float)g_dummy_reg->noise_std            ; // dummy_noise_std
     params[119].value = (float)g_dummy_reg->read_ctrl            ; // dummy_read_ctrl
+    params[120].value = (float)g_dummy_reg->cnt_clk              ; // dummy_cnt_clk
+    params[121].value = (float)g_dummy_reg->cnt_clk2             ; // dummy_cnt_clk2
     // [PARAMSUPDATE DOCK END]
 
     return 0;
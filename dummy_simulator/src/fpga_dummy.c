@@ -113,6 +113,8 @@ void reset_locks(void)
         g_dummy_reg->val_fun              =      0;
         g_dummy_reg->noise_std            =      0;
         g_dummy_reg->read_ctrl            =      0;
+        g_dummy_reg->cnt_clk              =      0;
+        g_dummy_reg->cnt_clk2             =      0;
     }
 }
 // [FPGARESET DOCK END]
@@ -321,6 +321,20 @@ typedef struct dummy_reg_t {
       */
     uint32_t read_ctrl;
     
+    /** @brief Offset 20'h00090 - cnt_clk
+      *  Clock count, low 32 bits
+      *
+      *  bits [31: 0] - Data
+      */
+    uint32_t cnt_clk;
+    
+    /** @brief Offset 20'h00094 - cnt_clk2
+      *  Clock count, high 32 bits
+      *
+      *  bits [31: 0] - Data
+      */
+    uint32_t cnt_clk2;
+    
 
 } dummy_reg_t;
 // [FPGAREG DOCK END]
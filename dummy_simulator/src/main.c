@@ -340,6 +340,8 @@ static rp_app_params_t rp_main_params[PARAMS_NUM+1] = {
     { "dummy_val_fun"                 ,      0, 0, 1,        -8192,         8191 }, /** Added automatically by script **/
     { "dummy_noise_std"               ,      0, 0, 1,        -8192,         8191 }, /** Added automatically by script **/
     { "dummy_read_ctrl"               ,      0, 1, 0,            0,            7 }, /** [unused,start_clk,Freeze] **/
+    { "dummy_cnt_clk"                 ,      0, 0, 1,            0,   0xffffffff }, /** Clock count, low 32 bits **/
+    { "dummy_cnt_clk2"                ,      0, 0, 1,            0,   0xffffffff }, /** Clock count, high 32 bits **/
     
     // [MAINDEF DOCK END]
 
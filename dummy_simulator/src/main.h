@@ -49,7 +49,7 @@ typedef struct rp_osc_meas_res_s {
 /* Parameters indexes - these defines should be in the same order as
  * rp_app_params_t structure defined in main.c */
 //define PARAMS_NUM        81
-#define PARAMS_NUM        120
+#define PARAMS_NUM        122
 #define MIN_GUI_PARAM     0
 #define MAX_GUI_PARAM     1
 #define TRIG_MODE_PARAM   2
@@ -175,6 +175,8 @@ typedef struct rp_osc_meas_res_s {
 #define DUMMY_VAL_FUN                   117
 #define DUMMY_NOISE_STD                 118
 #define DUMMY_READ_CTRL                 119
+#define DUMMY_CNT_CLK                   120
+#define DUMMY_CNT_CLK2                  121
 
 // [MAINDEFH DOCK END]
 
@@ -0,0 +1,355 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Synthesis of the lookup tables of the dummy core.
+
+    pico_data.dat : fun_pico.v, 2048 words. Line shape vs |pico_in|
+    icdf_data.dat : fun_icdf.v, 1024 words. |quantile| of the noise
+                    distribution; fun_icdf.v adds the sign
+
+Tables are computed vectorized, quantized to 14 bits (rounding, or error
+diffusion to keep the running sum), cached on disk keyed by their
+parameters, and written in $readmemb format (one binary word per line) in
+one go.
+
+Usage:
+    y = pico_table('voigt', sigma=36, gamma=124)
+    y = pico_table('multi', centers=[0,600], widths=[80,50], weights=[1,0.4])
+    y = pico_table('multi', centers=[0,600], peak_shape='voigt',
+                   widths=[{'sigma':20,'gamma':80}, {'sigma':20,'gamma':50}])
+    y = icdf_table('normal', scale=1024)
+    write_readmemb('pico_data.dat', y)
+    verify()                              # checks against the rtl tables
+
+    python3 lut_synth.py pico --shape lorentzian --gamma 140 -o pico_data.dat
+    python3 lut_synth.py pico --shape multi --peak-shape voigt --sigma 20 --centers 0 600 --widths 80 50
+    python3 lut_synth.py icdf --dist laplace --scale 700 -o icdf_data.dat
+    python3 lut_synth.py verify
+
+@author: lolo
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import math
+import hashlib
+import argparse
+
+import numpy as np
+
+
+rtl_dir   = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..','..','dummy_simulator','fpga','rtl','dummy')
+cache_dir = os.path.join(os.path.expanduser('~'),'.cache','hugo_luts')
+
+PICO_LEN = 2048
+ICDF_LEN = 1024
+NBITS    = 14
+VMAX     = (1<<(NBITS-1))-1
+
+# Parameters that best reproduce the tables in the rtl dir (see verify())
+pico_default = {'shape':'voigt', 'sigma':28.7, 'gamma':128.9, 'shift':True}
+icdf_default = {'dist':'normal', 'scale':1024.0}
+
+
+#%% $readmemb files
+
+def read_readmemb(filename,nbits=NBITS):
+    """Reads a $readmemb file. Returns an int array of signed values"""
+    with open(filename,'rb') as f:
+        words = f.read().split()
+    b = np.frombuffer(b''.join(words), dtype=np.uint8).reshape(len(words),-1) - ord('0')
+    v = b.astype(np.int64).dot(1 << np.arange(b.shape[1]-1,-1,-1))
+    return np.where(v >= 1<<(nbits-1), v - (1<<nbits), v)
+
+
+def to_readmemb(values,nbits=NBITS,final_newline=True):
+    """$readmemb text (bytes) for the values, two's complement of nbits"""
+    v = np.asarray(values, dtype=np.int64) & ((1<<nbits)-1)
+    txt = np.empty((len(v),nbits+1), dtype=np.uint8)
+    txt[:,:nbits] = ((v[:,None] >> np.arange(nbits-1,-1,-1)) & 1) + ord('0')
+    txt[:,nbits]  = ord('\n')
+    out = txt.tobytes()
+    return out if final_newline else out[:-1]
+
+
+def write_readmemb(filename,values,nbits=NBITS,final_newline=True):
+    v = np.asarray(values)
+    if v.min() < -(1<<(nbits-1)) or v.max() > (1<<(nbits-1))-1:
+        raise ValueError('values out of the {:d} bits range'.format(nbits))
+    with open(filename,'wb') as f:
+        f.write(to_readmemb(v, nbits, final_newline))
+
+
+#%% Line shapes, normalized to 1 at x=0
+
+def lorentzian(x,gamma):
+    return 1/(1+(x/gamma)**2)
+
+
+def gaussian(x,sigma):
+    return np.exp(-0.5*(x/sigma)**2)
+
+
+def voigt(x,sigma,gamma,order=80):
+    """Gaussian (sigma) convolved with a Lorentzian (gamma), by Gauss-Hermite quadrature"""
+    t,w = np.polynomial.hermite.hermgauss(order)
+    y = ( lorentzian(x[:,None]-np.sqrt(2)*sigma*t[None,:], gamma) * w ).sum(axis=1)
+    y0 = ( lorentzian(np.sqrt(2)*sigma*t, gamma) * w ).sum()
+    return y/y0
+
+
+def dispersive(x,gamma):
+    """Dispersive Lorentzian 2*(x/gamma)/(1+(x/gamma)**2), max 1 at x=gamma"""
+    return 2*(x/gamma)/(1+(x/gamma)**2)
+
+
+def multi(x,centers,widths,weights=None,peak_shape='lorentzian'):
+    """
+    Sum of peaks. As fun_pico.v uses |pico_in|, each peak shows at +-center.
+    widths: for each peak, its shape parameter (gamma or sigma) or a Dict of
+            shape parameters ({'sigma':..,'gamma':..} for voigt)
+    """
+    weights = np.ones(len(centers)) if weights is None else weights
+    f = shapes[peak_shape]
+    out = 0
+    for c,w,a in zip(centers,widths,weights):
+        if not isinstance(w,dict):
+            if len(shape_params[peak_shape])!=1:
+                raise ValueError('multi: {:s} peaks need a Dict of {:s} for each width'.format(
+                                 peak_shape, '/'.join(shape_params[peak_shape])))
+            w = { shape_params[peak_shape][0]: w }
+        out = out + a*(f(x-c,**w)+f(x+c,**w))/2
+    return out
+
+
+shapes = { 'lorentzian':lorentzian, 'gaussian':gaussian, 'voigt':voigt, 'dispersive':dispersive }
+shape_params = { 'lorentzian':('gamma',), 'gaussian':('sigma',), 'voigt':('sigma','gamma'), 'dispersive':('gamma',) }
+
+
+#%% Symmetric noise distributions: quantile of 0.5+q/2, for q in [0,1)
+
+def norm_quantile(q):
+    """|Phi^-1(0.5+q/2)|, Newton iterations on erf"""
+    erf = np.vectorize(math.erf)
+    p = 0.5 + 0.5*np.asarray(q, dtype=np.float64)
+    x = np.sqrt(-2*np.log(2*(1-p))) * (p>0.5)      # tail approximation as start
+    for i in range(50):
+        dx = (0.5*(1+erf(x/np.sqrt(2))) - p) / (np.exp(-x*x/2)/np.sqrt(2*np.pi))
+        x  = x - dx
+        if np.abs(dx).max() < 1e-13:
+            break
+    return x
+
+
+quantiles = {
+    'normal'   : norm_quantile,
+    'uniform'  : lambda q: q,
+    'laplace'  : lambda q: -np.log1p(-q),
+    'logistic' : lambda q: np.log((1+q)/(1-q)),
+    'cauchy'   : lambda q: np.tan(np.pi*q/2),
+}
+
+
+#%% Quantization
+
+def quantize(y,mode='round'):
+    """
+    14 bits values of y (already scaled).
+        round   : nearest value, error <= 0.5 on each entry
+        diffuse : error diffusion, the running sum of the error stays within
+                  +-0.5, so areas and moments of the line are kept
+    Values are saturated to the signed 14 bits range.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    if mode=='round':
+        q = np.round(y)
+    elif mode=='floor':
+        q = np.floor(y)
+    elif mode=='diffuse':
+        q = np.diff(np.round(np.concatenate(([0.0], np.cumsum(y)))))
+    else:
+        raise ValueError('unknown quantization mode: '+mode)
+    return np.clip(q, -VMAX-1, VMAX).astype(np.int64)
+
+
+def quant_error(q,y):
+    """Dict with max, rms and running sum errors of the quantized values q"""
+    e = np.asarray(q)-np.asarray(y)
+    return { 'max': float(np.abs(e).max()), 'rms': float(np.sqrt(np.mean(e**2))),
+             'sum': float(np.abs(np.cumsum(e)).max()) }
+
+
+#%% Cache
+
+_mem_cache = {}
+
+
+def cached(kind,params,fun):
+    """Returns fun() cached in memory and in cache_dir, keyed by kind and params"""
+    key = json.dumps([kind,params], sort_keys=True, default=lambda y: np.asarray(y).tolist())
+    key = hashlib.sha1(key.encode()).hexdigest()[:16]
+    if key in _mem_cache:
+        return _mem_cache[key].copy()
+    fn = os.path.join(cache_dir, '{:s}_{:s}.npy'.format(kind,key))
+    if os.path.isfile(fn):
+        v = np.load(fn)
+    else:
+        v = fun()
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(fn, v)
+        except OSError:
+            pass
+    _mem_cache[key] = v
+    return v.copy()
+
+
+#%% Tables
+
+def pico_table(shape='voigt',amp=VMAX,shift=False,quant='round',n=PICO_LEN,**params):
+    """
+    fun_pico.v table: amp*shape(x) for x=0..n-1.
+    shift: subtract the value at the end, so the table goes to 0 (and
+           rescale, so it still starts at amp)
+    params: shape parameters (gamma, sigma, or centers/widths/weights/peak_shape
+            for 'multi', see multi())
+    """
+    p = dict(shape=shape, amp=amp, shift=shift, quant=quant, n=n, **params)
+    def fun():
+        x = np.arange(n, dtype=np.float64)
+        y = multi(x,**params) if shape=='multi' else shapes[shape](x,**params)
+        if shift:
+            y = (y-y[-1])/(np.abs(y).max()-y[-1])
+        return quantize(amp*y/np.abs(y).max(), quant)
+    return cached('pico', p, fun)
+
+
+def icdf_table(dist='normal',scale=1024.0,quant='round',n=ICDF_LEN,match_std=False):
+    """
+    fun_icdf.v table: scale*quantile(0.5 + i/(2n)) for i=0..n-1.
+    match_std: tune the scale so the quantized table has the rms of the
+               continuous one (scale*std of the distribution over the table)
+    """
+    p = dict(dist=dist, scale=scale, quant=quant, n=n, match_std=match_std)
+    def fun():
+        z = quantiles[dist](np.arange(n)/n)
+        q = quantize(scale*z, quant)
+        if match_std:
+            target = scale*np.sqrt(np.mean(z**2))
+            lo, hi = 0.9*scale, 1.1*scale
+            for i in range(60):
+                s = (lo+hi)/2
+                q = quantize(s*z, quant)
+                if np.sqrt(np.mean(q.astype(float)**2)) < target:
+                    lo = s
+                else:
+                    hi = s
+        return q
+    return cached('icdf', p, fun)
+
+
+#%% Checks
+
+def fit_pico(table,shape='voigt',shift=True,ranges=None,steps=4,points=9):
+    """
+    Shape parameters that best reproduce `table` (max abs error), by grid
+    refinement. ranges: Dict param -> (lo,hi). Returns (params, error)
+    """
+    ranges = ranges or ( {'sigma':(5,200),'gamma':(20,300)} if shape=='voigt' else
+                         {'sigma':(10,500)} if shape=='gaussian' else {'gamma':(10,500)} )
+    table = np.asarray(table)
+    x = np.arange(len(table), dtype=np.float64)
+    names = list(ranges)
+    best  = (np.inf, None)
+    for k in range(steps):
+        grids = np.meshgrid(*[ np.linspace(lo,hi,points) for lo,hi in ranges.values() ], indexing='ij')
+        for vals in zip(*[ g.ravel() for g in grids ]):
+            par = dict(zip(names,vals))
+            y = shapes[shape](x,**par)
+            if shift:
+                y = (y-y[-1])/(y.max()-y[-1])
+            e = np.abs(np.round(table.max()*y/y.max())-table).max()
+            if e<best[0]:
+                best = (e, par)
+        ranges = { y:( best[1][y]-(hi-lo)/(points-1), best[1][y]+(hi-lo)/(points-1) )
+                   for y,(lo,hi) in ranges.items() }
+    return best[1], best[0]
+
+
+def verify(directory=rtl_dir,verbose=True):
+    """
+    Checks, for pico_data.dat and icdf_data.dat in directory:
+      - read + write gives back the same file
+      - the tables made with pico_default / icdf_default match them
+    Returns a Dict filename -> Dict of results.
+    """
+    out = {}
+    for fn,make in (('pico_data.dat', lambda: pico_table(**pico_default)),
+                    ('icdf_data.dat', lambda: icdf_table(**icdf_default))):
+        path = os.path.join(directory,fn)
+        with open(path,'rb') as f:
+            raw = f.read()
+        v = read_readmemb(path)
+        res = { 'roundtrip': to_readmemb(v, final_newline=raw.endswith(b'\n'))==raw }
+        res.update(quant_error(make(), v))
+        out[fn] = res
+        if verbose:
+            print('{:s}: roundtrip {:s}, synthesis error max {:.0f} rms {:.2f}'.format(
+                    fn, 'ok' if res['roundtrip'] else 'FAILED', res['max'], res['rms']))
+    return out
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("kind", choices=['pico','icdf','verify'],
+                    help="table to make, or verify the rtl tables")
+parser.add_argument("--shape", type=str, default=pico_default['shape'], choices=list(shapes)+['multi'])
+parser.add_argument("--gamma", type=float, default=None, help="Lorentzian half width. Default: pico_default")
+parser.add_argument("--sigma", type=float, default=None, help="Gaussian sigma. Default: pico_default")
+parser.add_argument("--peak-shape", type=str, dest='peak_shape', default='lorentzian', choices=list(shapes),
+                    help="shape of each peak for multi")
+parser.add_argument("--centers", type=float, nargs='+', default=None, help="peak centers for multi")
+parser.add_argument("--widths", type=float, nargs='+', default=None,
+                    help="peak widths for multi (gamma, or sigma for gaussian). The other shape "
+                         "parameters are --gamma/--sigma or pico_default")
+parser.add_argument("--weights", type=float, nargs='+', default=None, help="peak weights for multi")
+parser.add_argument("--shift", action='store_true', help="shift the line to end at 0")
+parser.add_argument("--dist", type=str, default=icdf_default['dist'], choices=list(quantiles))
+parser.add_argument("--scale", type=float, default=icdf_default['scale'], help="icdf scale (1 sigma for normal)")
+parser.add_argument("--match-std", action='store_true', dest='match_std', help="keep the rms after quantization")
+parser.add_argument("--quant", type=str, default='round', choices=['round','floor','diffuse'])
+parser.add_argument("-o", "--out", type=str, default='', help="output $readmemb file")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.kind=='verify':
+        res = verify()
+        sys.exit(0 if all( y['roundtrip'] for y in res.values() ) else 1)
+    if args.kind=='pico':
+        if args.shape=='multi':
+            if args.centers is None or args.widths is None or len(args.centers)!=len(args.widths):
+                parser.error('--shape multi needs --centers and --widths, one width for each center')
+            if args.weights is not None and len(args.weights)!=len(args.centers):
+                parser.error('--weights needs one weight for each center')
+            # widths give the last shape parameter, the others are common to the peaks
+            names  = shape_params[args.peak_shape]
+            common = { y:getattr(args,y) if getattr(args,y) is not None else pico_default[y] for y in names[:-1] }
+            par = dict(centers=args.centers, weights=args.weights, peak_shape=args.peak_shape,
+                       widths=[ dict(common, **{names[-1]:w}) for w in args.widths ])
+        else:
+            # parameters not given are the ones of the rtl table
+            par = { y:getattr(args,y) if getattr(args,y) is not None else pico_default[y]
+                    for y in shape_params[args.shape] }
+        y = pico_table(args.shape, shift=args.shift, quant=args.quant, **par)
+    else:
+        y = icdf_table(args.dist, args.scale, quant=args.quant, match_std=args.match_std)
+    if args.out:
+        write_readmemb(args.out, y)
+        print('saved '+args.out)
+    else:
+        sys.stdout.write(to_readmemb(y).decode())
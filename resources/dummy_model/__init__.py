@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Software models of the dummy core (dummy_simulator/fpga/rtl/dummy.v) and a
+simulated device to run the on-device tools off the board.
+
+    ref_model : clock by clock reference model of dummy.v
+    core      : vectorized (numpy) model, bit exact with ref_model
+    noise     : xorshift128 + fun_icdf noise source with jump ahead
+    filters   : exact blocked kernels for the LPF/HPF recursions
+    drift     : closed form of the drift generator
+    sweep     : parallel parameter sweeps of the peak response
+    sim_dev   : simulated /dev/mem with an engine that reacts to writes
+    farm      : many simulated devices served over tcp, for load tests
+    gen_dump  : synthetic data_dump.py files of any size, with the truth
+    lock_sim  : closed loop PID + dummy core, many PID settings at once
+
+@author: lolo
+"""
+
+from .ref_model import dummy_ref, load_table, rtl_dir
+from .core import dummy_core
+from .filters import iir_block, iir_parallel, lpf_block, hpf_block
+from .sweep import run_sweep, grid_design, random_design, peak_metrics
+from .drift import drift_at, drift_state
+from .noise import xorshift128, rand_norm, noise_at, icdf_table
+from .sim_dev import sim_device, triangle_scan
+from .farm import farm_device
+from .gen_dump import dump_generator, write_dump
+from .lock_sim import lock_lanes, run_lock
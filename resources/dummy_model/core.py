@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized model of the dummy.v datapath.
+
+dummy_core reproduces dummy_ref (and the Verilog) sample for sample, but
+works on blocks of clocks with numpy arrays. The state (registers, filters
+accumulators, random generator and counters) is carried across calls, so a
+long record can be processed in pieces.
+
+@author: lolo
+"""
+
+import numpy as np
+
+try:
+    from .ref_model import load_table, regs_default, oscA_sel, oscB_sel, out_sel, rand_seed
+    from .noise import xorshift128, rand_norm, icdf_table
+    from .filters import iir_block, hpf_input
+    from .drift import drift_state, drift_signal, cnt_at
+except (ImportError, ValueError):
+    from ref_model import load_table, regs_default, oscA_sel, oscB_sel, out_sel, rand_seed
+    from noise import xorshift128, rand_norm, icdf_table
+    from filters import iir_block, hpf_input
+    from drift import drift_state, drift_signal, cnt_at
+
+
+def wrap(x,nbits):
+    """Keeps the nbits LSB of the int array x as signed values"""
+    half = 1 << (nbits-1)
+    return ((x + half) & ((1<<nbits)-1)) - half
+
+
+def sat(x,nbits=14):
+    """Signed saturation to nbits"""
+    half = 1 << (nbits-1)
+    return np.clip(x, -half, half-1)
+
+
+class dummy_core():
+    """
+    Vectorized model of dummy.v, with the same interface as dummy_ref.
+
+    Usage:
+        m = dummy_core()
+        m.set(peak_pos=100, sg_amp=4000, sg_width=2000, lpf_on=1, lpf_val=3)
+        out = m.run(10**7, in1=control, in2=0, signals=['salida','oscA'])
+
+    Params of run():
+        n       : number of clocks (8 ns each)
+        in1,in2 : ints or int arrays of length n (ADC inputs)
+        signals : names of the signals to return (ref_model.signal_names)
+
+    run() returns a Dict with an int32 array of length n for each requested
+    signal. Long runs are processed in blocks of `block` clocks.
+    The register values are the ones of hugo.dm / config_tool.py, and can be
+    changed between calls with set().
+    """
+    lpf_offset = 4
+    hpf_offset = 0
+    block      = 1<<20
+
+    def __init__(self,pico=None,icdf=None):
+        self.pico = np.array(load_table('pico_data.dat') if pico is None else pico, dtype=np.int32)
+        self.icdf = icdf_table() if icdf is None else np.array(icdf, dtype=np.int32)
+        self.regs = dict(regs_default)
+        self.reset()
+
+    def reset(self):
+        self.clk        = 0
+        self.signal_in  = 0
+        self.lpf_sum    = 0
+        self.hpf_sum    = 0
+        self.hpf_last   = 0
+        self.pico_out   = 0
+        self.simul_out  = 0
+        self.rand       = list(rand_seed)
+        self.icdf_reg   = 0
+        self.ramp       = 0
+        self.drift_o    = 0
+        self.drift_way  = 1
+        self.cnt        = 0
+        self.oscA       = 0
+        self.oscB       = 0
+
+    def set(self,values=None,**kwargs):
+        """Sets register values. Unknown names are ignored"""
+        for k,v in dict(values or {}, **kwargs).items():
+            if k in self.regs:
+                self.regs[k] = int(v)
+
+    def run(self,n,in1=0,in2=0,signals=('salida',)):
+        out  = { y:np.empty(n, dtype=np.int32) for y in signals }
+        seq1 = np.ndim(in1)>0
+        seq2 = np.ndim(in2)>0
+        for i in range(0,n,self.block):
+            m   = min(self.block, n-i)
+            res = self.run_block(m, in1[i:i+m] if seq1 else in1, in2[i:i+m] if seq2 else in2, signals)
+            for y in signals:
+                out[y][i:i+m] = res[y]
+        return out
+
+    def registered(self,first,nxt):
+        """Output of a register: first value is the current state, then nxt delayed one clock"""
+        r = np.empty(len(nxt), dtype=np.int32)
+        r[0]  = first
+        r[1:] = nxt[:-1]
+        return r
+
+    def drift_block(self,n):
+        """drift signal for the next n clocks. Updates the drift counters state"""
+        r = self.regs
+        t = np.arange(n+1, dtype=np.int64)
+        if not r['drift_enable']:
+            self.cnt = int(cnt_at(n, r['drift_time'], self.cnt))
+            self.drift_o, self.drift_way = 0, 1
+            return np.zeros(n, dtype=np.int32)
+        cnt, d, way = drift_state(t, r['drift_time'], self.cnt, self.drift_o, self.drift_way)
+        self.cnt, self.drift_o, self.drift_way = int(cnt[n]), int(d[n]), int(way[n])
+        return drift_signal(d[:n]).astype(np.int32)
+
+    def noise_block(self,n):
+        """rand_norm for the next n clocks. Updates the generator and fun_icdf state"""
+        if self.regs['noise_enable']:
+            g  = xorshift128(self.rand)
+            ww = g.ww(n)
+            self.rand = list(g.state)
+        else:                                # generator stopped
+            ww = np.full(n, self.rand[3], dtype=np.uint32)
+        rn, self.icdf_reg = rand_norm(ww, self.icdf_reg, self.icdf)
+        return rn
+
+    def run_block(self,n,in1,in2,signals):
+        r  = self.regs
+        v  = {}
+        a  = np.broadcast_to(np.asarray(in1, dtype=np.int32), (n,))
+        b  = np.broadcast_to(np.asarray(in2, dtype=np.int32), (n,))
+        v['in1'], v['in2'] = a, b
+
+        # input muxer (registered)
+        e = r['entrada']
+        mux = a if e==0 else b if e==1 else sat(a+b) if e==2 else sat(a-b) if e==3 else np.zeros(n,dtype=np.int32)
+        signal_in = self.registered(self.signal_in, mux)
+        self.signal_in = int(mux[-1])
+
+        # filters
+        sh = self.lpf_offset + r['lpf_val']
+        div, self.lpf_sum = iir_block(self.lpf_sum, signal_in, sh)
+        signal_lpf = wrap(div,14).astype(np.int32) if r['lpf_on'] else signal_in
+
+        sh = self.hpf_offset + r['hpf_val']
+        div, self.hpf_sum = iir_block(self.hpf_sum, hpf_input(signal_lpf, sh, self.hpf_last), sh)
+        self.hpf_last = int(signal_lpf[-1])
+        signal_hpf = wrap(div,14).astype(np.int32) if r['hpf_on'] else signal_lpf
+
+        # drift, ramp and noise
+        drift = self.drift_block(n)
+        ramp  = wrap(self.ramp + np.arange(n, dtype=np.int32), 14)
+        self.ramp = (self.ramp+n) % 16384
+        rand_norm = self.noise_block(n)
+        if r['noise_enable']:
+            noise = wrap((rand_norm*r['noise_amp'])>>13, 14)
+        else:
+            noise = np.zeros(n, dtype=np.int32)
+
+        # peak
+        pico_in  = sat(wrap(r['peak_pos'] + wrap((signal_hpf*r['sg_width'])>>13,14) + drift, 15))
+        pico_nxt = self.pico[np.minimum(np.abs(pico_in),2047)]
+        pico_out = self.registered(self.pico_out, pico_nxt)
+        self.pico_out = int(pico_nxt[-1])
+        val_fun  = wrap((pico_out*r['sg_amp'])>>13, 14)
+        base     = wrap((signal_in*r['sg_base'])>>14, 14)
+        salida   = sat(val_fun + noise + base)
+
+        # simulated scan with the ramp
+        simul_in  = sat(wrap(r['peak_pos'] + wrap((ramp*r['sg_width'])>>13,14) + drift, 15))
+        simul_nxt = self.pico[np.minimum(np.abs(simul_in),2047)]
+        simul_out = self.registered(self.simul_out, simul_nxt)
+        self.simul_out = int(simul_nxt[-1])
+        simul = sat( wrap((simul_out*r['sg_amp'])>>13,14) + noise + wrap((ramp*r['sg_base'])>>14,14) )
+
+        v.update(signal_in=signal_in, signal_lpf=signal_lpf, signal_hpf=signal_hpf,
+                 pico_in=pico_in, pico_out=pico_out, rand_norm=rand_norm, noise=noise,
+                 val_fun=val_fun, base=base, salida=salida, ramp=ramp, drift=drift,
+                 simul=simul, zero=np.zeros(n, dtype=np.int32))
+        v['out1'] = v[out_sel[r['out1_sw']]] if r['out1_sw']<len(out_sel) else v['zero']
+        v['out2'] = v[out_sel[r['out2_sw']]] if r['out2_sw']<len(out_sel) else v['zero']
+
+        # scope muxers (registered)
+        for name,sel in (('oscA',oscA_sel),('oscB',oscB_sel)):
+            sw  = r[name+'_sw']
+            src = v[sel[sw]] if sw<len(sel) else v['zero']
+            v[name] = self.registered(getattr(self,name), src)
+            setattr(self, name, int(src[-1]))
+
+        self.clk += n
+        return { y:v[y] for y in signals }
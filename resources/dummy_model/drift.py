@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Closed form of the drift generator of dummy.v.
+
+cnt counts 0..cnt_max (cnt_max = 2**drift_time) and drift_o moves one step
+each time cnt is 0, bouncing between 0 and 16383. So drift_o is a triangle
+of period 32766 steps over the phase
+
+    p = (p0 + number of zeros of cnt) % 32766,   drift_o = p or 32766-p
+
+and the drift signal is (drift_o>>1)-4095. The number of zeros of cnt in t
+clocks is an integer division, so any clock is evaluated in O(1), with no
+stepping.
+
+Usage:
+    d = drift_at(clk, drift_time=13)                  # enabled since reset
+    d = drift_at(clk, drift_time=13, enable_clk=10**9)
+    cnt, drift_o, drift_way = drift_state(t, drift_time=5, cnt0=17, drift_o=300)
+
+@author: lolo
+"""
+
+import numpy as np
+
+
+PERIOD = 32766      # steps of a full up and down cycle of drift_o
+TOP    = 16383
+
+
+def cnt_period(drift_time):
+    """Clocks between zeros of cnt (cnt_max+1, or the 16 bits wrap)"""
+    return np.minimum((1 << np.asarray(drift_time, dtype=np.int64)) + 1, 1<<16)
+
+
+def first_zero(cnt0,drift_time):
+    """Clocks until cnt is 0, starting with the value cnt0 (0 if it is 0 now)"""
+    c = np.asarray(cnt0, dtype=np.int64)
+    P = cnt_period(drift_time)
+    return np.where(c<P, (P-c) % P, 65536-c)     # above cnt_max it counts up to the wrap first
+
+
+def cnt_at(t,drift_time,cnt0=0):
+    """Value of cnt t clocks after it was cnt0"""
+    t  = np.asarray(t, dtype=np.int64)
+    P  = cnt_period(drift_time)
+    k0 = first_zero(cnt0, drift_time)
+    return np.where(t<k0, np.asarray(cnt0, dtype=np.int64)+t, (t-k0) % P)
+
+
+def steps_in(t,drift_time,cnt0=0):
+    """Number of clocks with cnt==0 among the first t clocks, starting with cnt0"""
+    t  = np.asarray(t, dtype=np.int64)
+    k0 = first_zero(cnt0, drift_time)
+    return np.where(t>k0, (t-k0-1)//cnt_period(drift_time) + 1, 0)
+
+
+def to_phase(drift_o,drift_way):
+    """Phase (0..32765) of a drift_o / drift_way state"""
+    d  = np.asarray(drift_o, dtype=np.int64)
+    up = (d==0) | ( (np.asarray(drift_way)!=0) & (d!=TOP) )
+    return np.where(up, d, PERIOD-d)
+
+
+def from_phase(p):
+    """(drift_o, drift_way) of the phase p"""
+    p = np.asarray(p, dtype=np.int64) % PERIOD
+    d = np.where(p<=TOP, p, PERIOD-p)
+    return d, np.where(d==TOP, 0, np.where(d==0, 1, (p<TOP).astype(np.int64)))
+
+
+def drift_signal(drift_o):
+    """drift output of dummy.v for the drift_o value"""
+    d = (np.asarray(drift_o, dtype=np.int64)>>1) - 4095
+    return ((d + 8192) & 0x3FFF) - 8192
+
+
+def drift_state(t,drift_time,cnt0=0,drift_o=0,drift_way=1):
+    """
+    (cnt, drift_o, drift_way) t clocks after the state (cnt0, drift_o,
+    drift_way), with drift_enable on. Every argument can be an array.
+    """
+    p = to_phase(drift_o, drift_way) + steps_in(t, drift_time, cnt0)
+    return (cnt_at(t, drift_time, cnt0),) + from_phase(p)
+
+
+def drift_at(clk,drift_time=13,drift_enable=1,enable_clk=0,cnt_enable=None):
+    """
+    drift signal at the clocks clk (counted from reset) for a drift enabled
+    at enable_clk. Before that (or with drift_enable off) it is 0.
+
+    Params:
+        clk          : int or int array of clock indexes
+        drift_time   : register value (int or array, broadcast with clk)
+        drift_enable : register value (int or array)
+        enable_clk   : clock where drift_enable was set
+        cnt_enable   : cnt at enable_clk. By default the value it has when
+                       drift_time did not change since reset
+
+    Returns an int64 array (or scalar) with the drift signal.
+    """
+    clk = np.asarray(clk, dtype=np.int64)
+    c0  = cnt_at(enable_clk, drift_time) if cnt_enable is None else cnt_enable
+    t   = clk - enable_clk
+    d,_ = from_phase( steps_in(np.maximum(t,0), drift_time, c0) )
+    return np.where( (t>=0) & (np.asarray(drift_enable)!=0), drift_signal(d), 0 )
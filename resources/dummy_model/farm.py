@@ -0,0 +1,702 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Farm of simulated Red Pitayas, to load-test the host control software.
+
+Each device is a sim_device (its own memory file and dummy_core model)
+served on its own tcp port. It answers the same command lines the host
+tools run over ssh:
+
+    osc.py / dummy.py [reg [val]]   : show / set registers (same output)
+    osc_get_ch.py [-b]              : scope channels, text or binary frame
+    osc_trig.py [options]           : trigger, single shot or multi-shot stream
+    data_dump.py -s ip -p port ...  : connects back to ip:port and streams the
+                                      header, '!Qq'+'l'*N records and the stats
+                                      trailer ('!f'+'l'*N with --float-time)
+    uname, echo $SSH_CONNECTION, ps ax, kill PID, rw
+
+Every device of the farm runs in one asyncio event loop (or in a few worker
+processes, --procs), and the model work is done in a thread pool so the
+loop keeps answering. A latency (plus gaussian jitter) is added before each
+answer and each stream write.
+
+Protocol. Request and answer are one frame each, like hugo_server.py:
+    head  '!BL' : code, payload length
+    payload
+The request code is OP_EXEC and the payload the command line. The answer
+code is the exit status and the payload is stdout (stderr if status != 0).
+A command that streams (osc_trig.py multi-shot) sends its stdout as it is
+made, in OUT_PART frames before the answer.
+The host side client is resources/remote_control/farm_client.py
+
+data_dump.py records are `stride` model clocks apart, not the 125e6/rate
+clocks of the board, so the model keeps up with many devices. Their sample
+clock ticks are those of the board (exactly 125e6/rate apart).
+
+Usage:
+    python3 farm.py -n 50 --port 7000 --latency 2e-3 --jitter 1e-3
+    python3 farm.py -n 50 --procs 4 --bench 30      # farm + load test
+
+@author: lolo
+"""
+
+from __future__ import print_function
+
+import os
+import io
+import sys
+import shlex
+import signal
+import socket
+import struct
+import asyncio
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from time import time,monotonic,perf_counter
+
+import numpy as np
+
+
+py_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..','dummy_simulator','py')
+if py_dir not in sys.path:
+    sys.path.append(py_dir)
+
+from hugo import osc,dm,frame_bin,frame_csv,frame_head
+from data_dump import stats_trailer
+
+try:
+    from .sim_dev import sim_device, triangle_scan, CLK
+except (ImportError, ValueError):
+    from sim_dev import sim_device, triangle_scan, CLK
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def is_int(s):
+    try:
+        int(s)
+        return True
+    except ValueError:
+        return False
+
+
+OP_EXEC    = 0
+OUT_PART   = 255     # answer code of a partial stdout frame, the answer follows
+head       = struct.Struct('!BL')
+stat_names = ('requests','errors','bytes','records','busy')
+
+sig_val = {'now':1,'chAup':2,'chAdown':3,'chBup':4,'chBdown':5, 'ext':6}
+
+
+# Same options as dummy_simulator/py/osc_trig.py and data_dump.py
+trig_parser = argparse.ArgumentParser(prog='osc_trig.py')
+trig_parser.add_argument("-t", "--timeout", type=int, dest='timeout', default=10)
+trig_parser.add_argument("-p", "--time-before-trigger", dest='trig_pos', type=int, default=-1)
+trig_parser.add_argument('-s','--signal', dest='signal', choices=list(sig_val.keys()), default='now')
+trig_parser.add_argument("-v", "--value", type=int, dest='threshold', default=100001)
+trig_parser.add_argument("--hyst", type=int, dest='hyst', default=-1)
+trig_parser.add_argument("-d", "--decimation", type=int, dest='dec', choices=[0,1,8,64,1024,8192,65536], default=0)
+trig_parser.add_argument("-n", "--shots", type=int, dest='shots', default=0)
+trig_parser.add_argument("--stream", dest='stream', action="store_true")
+trig_parser.add_argument("-l", "--latency", type=float, dest='latency', default=0.01)
+
+dump_parser = argparse.ArgumentParser(prog='data_dump.py')
+dump_parser.add_argument("-s", "--server", type=str, default="10.0.32.147")
+dump_parser.add_argument("-p", "--port", type=str, default="6000")
+dump_parser.add_argument("-t", "--timeout", type=int, dest='timeout', default=0)
+dump_parser.add_argument("-r", "--rate", type=float, dest='rate', default=500)
+dump_parser.add_argument("-b", "--batch", type=int, dest='batch', default=256)
+dump_parser.add_argument('--params', nargs='+')
+dump_parser.add_argument("--float-time", action="store_false", dest='ticks', default=True)
+dump_parser.add_argument("--record", type=str, dest='record', default='')
+
+
+def parse(parser,argv):
+    """parse_args without exiting. Returns (args, None) or (None, (status, message))"""
+    err = io.StringIO()
+    with contextlib.redirect_stderr(err):
+        try:
+            return parser.parse_args(argv), None
+        except SystemExit as e:
+            return None, (e.code or 0, err.getvalue())
+
+
+class farm_device():
+    """
+    One simulated Red Pitaya: a sim_device on its own memory file, served on
+    its own tcp port.
+
+    Usage:
+        d = farm_device(0, '/dev/shm/hugo_farm/dev_000', 7000)
+        await d.start()
+        rc,out = await d.execute('/root/py/dummy.py peak_pos 100')
+        await d.stop()
+
+    Params:
+        index    : device number, used in the host name
+        dev_file : memory file of the sim_device
+        port     : tcp port. host: address to listen on
+        latency  : seconds added before each answer and each stream write
+        jitter   : std of a gaussian added to latency, in seconds
+        stride   : model clocks between data_dump.py records
+        stats    : row of a (devices x stat_names) float array for the counters
+        sim_kw   : other sim_device params (inputs, max_clocks, ...)
+    """
+    def __init__(self,index,dev_file,port,host='127.0.0.1',latency=0.0,jitter=0.0,stride=64,
+                 stats=None,seed=None,**sim_kw):
+        self.index    = index
+        self.dev_file = dev_file
+        self.port     = port
+        self.host     = host
+        self.latency  = latency
+        self.jitter   = jitter
+        self.stride   = stride
+        self.stats    = np.zeros(len(stat_names)) if stats is None else stats
+        self.rng      = np.random.default_rng(index if seed is None else seed)
+        self.sim      = sim_device(dev_file, **sim_kw)
+        self.lock     = asyncio.Lock()
+        self.jobs     = {}       # pid -> (command line, task)
+        self.writers  = set()    # open connections
+        self.pid      = 1000
+        self.server   = None
+        self.cmds     = { 'osc.py'       : lambda argv,conn: self.call(self.regs_cmd, osc, argv),
+                          'dummy.py'     : lambda argv,conn: self.call(self.regs_cmd, dm, argv),
+                          'osc_get_ch.py': lambda argv,conn: self.call(self.get_ch_cmd, argv),
+                          'osc_trig.py'  : lambda argv,conn: self.trig_cmd(argv,conn),
+                          'data_dump.py' : lambda argv,conn: self.dump_cmd(argv),
+                          'uname'        : self.uname_cmd,
+                          'echo'         : self.echo_cmd,
+                          'ps'           : self.ps_cmd,
+                          'kill'         : self.kill_cmd,
+                          'rw'           : self.nop_cmd }
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        return self
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            for w in list(self.writers):
+                w.close()
+            await self.server.wait_closed()
+            self.server = None
+        for cmd,task in list(self.jobs.values()):
+            task.cancel()
+        async with self.lock:
+            self.sim.close()
+
+    async def call(self,fun,*args):
+        """Runs fun(*args) on the simulation in the thread pool, one at a time"""
+        async with self.lock:
+            return await asyncio.get_running_loop().run_in_executor(None, fun, *args)
+
+    async def delay(self):
+        dt = self.latency + self.jitter*self.rng.standard_normal() if self.jitter>0 else self.latency
+        if dt>0:
+            await asyncio.sleep(dt)
+
+    async def handle(self,reader,writer):
+        async def send(data):
+            await self.delay()
+            writer.write(head.pack(OUT_PART, len(data)) + data)
+            await writer.drain()
+            self.stats[2] += head.size+len(data)
+        conn = ( writer.get_extra_info('peername'), writer.get_extra_info('sockname'), send )
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.writers.add(writer)
+        try:
+            while True:
+                op,size = head.unpack(await reader.readexactly(head.size))
+                cmd     = (await reader.readexactly(size)).decode('utf-8','replace')
+                t0      = perf_counter()
+                if op==OP_EXEC:
+                    rc,out = await self.execute(cmd, conn)
+                else:
+                    rc,out = 1, 'unknown code {:d}\n'.format(op).encode()
+                self.stats[:] += (1, rc!=0, head.size+len(out), 0, perf_counter()-t0)
+                await self.delay()
+                writer.write(head.pack(rc, len(out)) + out)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:      # farm stopping
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def execute(self,cmd,conn=None):
+        """
+        Runs a command line. Returns (exit status, output bytes).
+        conn: (peer address, local address, send) of the connection, where
+              send(bytes) writes a part of stdout before the answer
+        """
+        try:
+            argv = shlex.split(cmd)
+        except ValueError as e:
+            return 2, 'sh: {:s}\n'.format(str(e)).encode()
+        if len(argv)>1 and os.path.basename(argv[0]).startswith('python'):
+            argv = argv[1:]
+        if len(argv)==0:
+            return 0, b''
+        name = os.path.basename(argv[0])
+        if name not in self.cmds:
+            return 127, 'sh: {:s}: not found\n'.format(argv[0]).encode()
+        self.pid += 1
+        pid  = self.pid
+        task = asyncio.ensure_future(self.cmds[name](argv[1:], conn))
+        self.jobs[pid] = (cmd, task)
+        try:
+            rc,out = await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            rc,out = 143, b''
+        except Exception as e:
+            rc,out = 1, '{:s}: {:s}\n'.format(type(e).__name__, str(e)).encode()
+        finally:
+            del self.jobs[pid]
+        return rc, out if type(out)==bytes else out.encode()
+
+    #%% Register and scope commands (run in the thread pool)
+
+    def regs_cmd(self,bank,argv):
+        """osc.py / dummy.py"""
+        sim   = self.sim
+        mem   = sim.dm if bank is dm else sim.osc
+        names = bank.names()
+        ss    = '{:<'+str(bank.max_name)+'s}: {:>10d}'
+        show  = lambda y: ss.format(y, sim.reg_read(bank,y))
+        sim.poll()
+        if len(argv)==0:
+            lines = [ show(y) for y in names ]
+        elif len(argv)==1:
+            lines = [ show(argv[0]) ] if argv[0] in names else [ 'reg not found' ]
+        elif len(argv)==2:
+            lines = []
+            if argv[0] in names and is_int(argv[1]):
+                r = bank[argv[0]]
+                if r.rw:
+                    r.fmt.pack_into(mem, r.index*4, int(argv[1]))
+                sim.poll()
+                lines = [ show(argv[0]) ]
+        else:
+            lines = [ show(y) for y in argv if y in names ]
+        return 0, ''.join( y+'\n' for y in lines )
+
+    def read_chs(self):
+        """Scope channels, oldest sample first. Returns (chA, chB, TrgWpt, CurWpt)"""
+        sim = self.sim
+        cur = sim.reg_read(osc,'CurWpt')
+        ptr = (cur+1) % osc.ch_len
+        chs = []
+        for m in sim.chs:
+            raw = np.frombuffer(m, dtype='<u4')
+            chs.append( (((np.roll(raw,-ptr) & 0x3FFF) ^ 0x2000) - 0x2000).astype(np.int16) )
+            del raw
+        return chs[0], chs[1], sim.reg_read(osc,'TrgWpt'), cur
+
+    def get_ch_cmd(self,argv):
+        """osc_get_ch.py"""
+        self.sim.poll()
+        chA,chB,trg,cur = self.read_chs()
+        if '-b' in argv:
+            return 0, bytes(frame_bin(chA,chB))
+        return 0, frame_csv(chA,chB)+'\n'
+
+    def trig_setup(self,args):
+        w = self.sim.reg_write
+        w(osc, 'conf', 2)
+        if args.dec>0:
+            w(osc, 'Dec', args.dec)
+        src = sig_val[args.signal]
+        if src in [2,3] and abs(args.threshold)<8192:
+            w(osc, 'ChAth', args.threshold)
+        if src in [4,5] and abs(args.threshold)<8192:
+            w(osc, 'ChBth', args.threshold)
+        if args.hyst>0:
+            w(osc, 'ChAHys', args.hyst)
+            w(osc, 'ChBHys', args.hyst)
+        if args.trig_pos>=0:
+            w(osc, 'TrgDelay', args.trig_pos)
+
+    def trig_poll(self,src=0):
+        """Arms the trigger with src (reset first) if src>0, polls and returns True when done"""
+        if src>0:
+            self.sim.reg_write(osc, 'conf', 2)
+            self.sim.reg_write(osc, 'TrgSrc', src)
+        self.sim.poll()
+        return self.sim.reg_read(osc,'TrgSrc')==0
+
+    async def shot(self,src,timeout,latency):
+        t0   = monotonic()
+        done = await self.call(self.trig_poll, src)
+        while not done and monotonic()-t0<timeout:
+            await asyncio.sleep(latency)
+            done = await self.call(self.trig_poll)
+        return done
+
+    async def trig_cmd(self,argv,conn=None):
+        """
+        osc_trig.py. In multi-shot mode each frame is sent to the connection
+        when it is read, as osc_trig.py writes it to stdout. Without a
+        connection (execute() called directly) the frames are the answer, so
+        an endless stream is refused.
+        """
+        args,err = parse(trig_parser, argv)
+        if err is not None:
+            return err
+        send = conn[2] if conn is not None and len(conn)>2 else None
+        if send is None and args.shots<=0 and args.stream:
+            return 1, 'osc_trig.py: an endless stream needs a connection\n'
+        await self.call(self.trig_setup, args)
+        src = sig_val[args.signal]
+        if not ( args.stream or args.shots>1 ):
+            ok = await self.shot(src, args.timeout, args.latency)
+            return 0, 'success\n' if ok else 'memory read error\n'
+        frames = []
+        n      = 0
+        try:
+            while args.shots<=0 or n<args.shots:
+                if not await self.shot(src, args.timeout, args.latency):
+                    break
+                chA,chB,trg,cur = await self.call(self.read_chs)
+                frame = frame_head.pack(n, trg, cur, time()) + bytes(frame_bin(chA,chB))
+                n += 1
+                if send is None:
+                    frames.append(frame)
+                else:
+                    await send(frame)
+        except asyncio.CancelledError:      # killed, as osc_trig.py on SIGTERM
+            pass
+        return 0, b''.join(frames)
+
+    #%% data_dump.py
+
+    def dump_header(self,params,t0,ticks=True):
+        """Same 100+3400 bytes header as data_dump.py sampler.header()"""
+        txt='Columns: '+','.join(params)+'\n'+'timestamp {:>20f}\n'.format(t0)
+        if ticks:
+            txt+='clock {:d}\n'.format(int(CLK))
+        txt=(txt.ljust(99)+'\n').encode('ascii')
+        txt2=[ '"{:s}": {:f}'.format(r.name, self.sim.reg_read(dm,r.name)) for r in dm.regs ]
+        txt+= (  ('params={'+',\n'.join(txt2) +'\n}\n').ljust(3399)+'\n' ).encode('ascii')
+        return txt
+
+    def dump_records(self,params,t,ticks=True):
+        """Records for the times t: taps from the model, other regs as they are"""
+        sim  = self.sim
+        n    = len(t)
+        head = [('tick','>u8'),('host','>i8')] if ticks else [('t','>f4')]
+        rec  = np.empty(n, dtype=head+[ ('c{:d}'.format(i),'>i4') for i in range(len(params)) ])
+        taps = [ y for y in set(params) if y in sim.tap_signals ]
+        sim.load_regs()
+        res  = sim.simulate(n*self.stride, taps) if len(taps)>0 else {}
+        for y in taps:
+            sim.reg_write(dm, y, int(res[y][-1]))
+        if ticks:
+            rec['tick'] = np.round(t*CLK)
+            rec['host'] = np.round(t*1e6)
+        else:
+            rec['t'] = t
+        for i,y in enumerate(params):
+            if y in res:
+                rec['c{:d}'.format(i)] = res[y][self.stride-1::self.stride]
+            else:
+                rec['c{:d}'.format(i)] = struct.unpack_from('<l', sim.dm, dm[y].index*4)[0]
+        return rec.tobytes()
+
+    async def dump_cmd(self,argv):
+        """data_dump.py, streaming to the host"""
+        args,err = parse(dump_parser, argv)
+        if err is not None:
+            return err
+        if args.params is None or not all([ y in dm.names() for y in args.params ]):
+            numkeys=[y.ljust(20) for y in dm.names()]
+            return 0, ''.join( ', '.join(numkeys[i*5:(i+1)*5])+'\n' for i in range(int(len(numkeys)/5+1)) )
+        if len(args.record)>0:
+            return 1, 'data_dump.py: --record is not simulated\n'
+        params = args.params
+        reader,writer = await asyncio.open_connection(args.server, int(args.port))
+        t0     = time()
+        m0     = monotonic()
+        period = 1.0/args.rate
+        flush  = min(args.batch*period, 0.2)
+        count  = 0
+        try:
+            writer.write(await self.call(self.dump_header, params, t0, args.ticks))
+            while True:
+                await asyncio.sleep(flush)
+                now = monotonic()
+                end = now-m0 if args.timeout<=0 else min(now-m0, args.timeout)
+                due = int(end/period)+1-count
+                if due>0:
+                    t   = (count+np.arange(due))*period
+                    buf = await self.call(self.dump_records, params, t, args.ticks)
+                    await self.delay()
+                    writer.write(buf)
+                    await writer.drain()
+                    count += due
+                    self.stats[3] += due
+                if args.timeout>0 and now-m0>args.timeout:
+                    break
+        except asyncio.CancelledError:      # killed, as data_dump.py on SIGTERM
+            pass
+        except ConnectionError:
+            pass
+        finally:
+            elapsed = monotonic()-m0
+            st = { 'samples':count, 'rate':count/elapsed if elapsed>0 else 0.0,
+                   'lag_mean':0.0, 'lag_std':0.0, 'lag_max':0.0, 'missed':0 }
+            if args.ticks and not writer.is_closing():
+                writer.write(stats_trailer(st, struct.Struct('!Qq'+'l'*len(params))))
+            writer.close()
+        txt  = '{:s}\n'.format(repr(t0))
+        txt += 'Program finished\n\n'
+        txt += "pack string: '{:s}'\n".format(('!Qq' if args.ticks else '!f')+'l'*len(params))
+        txt += "samples    : {:d}\n".format(count)
+        txt += "rate       : {:.1f} samples/s\n".format(st['rate'])
+        txt += "jitter     : mean=0.0 us, std=0.0 us, max=0.0 us\n"
+        txt += "missed     : 0\n"
+        return 0, txt
+
+    #%% Shell commands
+
+    async def uname_cmd(self,argv,conn):
+        return 0, 'Linux rp-sim{:03d} 4.9.0-xilinx #1 SMP PREEMPT armv7l GNU/Linux\n'.format(self.index)
+
+    async def echo_cmd(self,argv,conn):
+        env = {}
+        if conn is not None and conn[0] is not None:
+            env['$SSH_CONNECTION'] = '{:s} {:d} {:s} {:d}'.format(conn[0][0], conn[0][1], conn[1][0], conn[1][1])
+        return 0, ' '.join( env.get(y,y) for y in argv )+'\n'
+
+    async def ps_cmd(self,argv,conn):
+        txt = '  PID TTY      STAT   TIME COMMAND\n    1 ?        Ss     0:01 /sbin/init\n'
+        for pid,(cmd,task) in self.jobs.items():
+            txt += '{:5d} ?        S      0:00 {:s}\n'.format(pid, cmd)
+        return 0, txt
+
+    async def kill_cmd(self,argv,conn):
+        rc,txt = 0,''
+        for y in argv:
+            if not is_int(y) or int(y)<0:
+                continue
+            if int(y) in self.jobs:
+                self.jobs[int(y)][1].cancel()
+            else:
+                rc   = 1
+                txt += 'kill: ({:s}) - No such process\n'.format(y)
+        return rc, txt
+
+    async def nop_cmd(self,argv,conn):
+        return 0, ''
+
+
+#%% Farm
+
+def stats_array(n,raw=None):
+    """(n x stat_names) float64 counters, on the shared `raw` buffer if given"""
+    if raw is None:
+        return np.zeros((n,len(stat_names)))
+    return np.frombuffer(raw, dtype=np.float64).reshape(n,len(stat_names))
+
+
+async def serve(indexes,opts,stats,stop):
+    """Serves the devices `indexes` until the coroutine stop() returns"""
+    devs = []
+    try:
+        for i in indexes:
+            d = farm_device(i, os.path.join(opts['dev_dir'],'dev_{:03d}'.format(i)), opts['port']+i,
+                            host=opts['host'], latency=opts['latency'], jitter=opts['jitter'],
+                            stride=opts['stride'], stats=stats[i],
+                            inputs=triangle_scan(opts['scan_amp'],opts['scan_period']),
+                            max_clocks=opts['max_clocks'])
+            devs.append(await d.start())
+        await stop()
+    finally:
+        for d in devs:
+            await d.stop()
+            if opts['remove'] and os.path.exists(d.dev_file):
+                os.remove(d.dev_file)
+
+
+def worker(indexes,opts,raw,event):
+    """Worker process: serves its share of the devices until event is set"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    async def stop():
+        while not event.is_set():
+            await asyncio.sleep(0.2)
+    asyncio.run(serve(indexes, opts, stats_array(opts['devices'],raw), stop))
+
+
+class stats_report():
+    """Aggregate throughput of the farm between calls of line()"""
+    def __init__(self,stats):
+        self.stats = stats
+        self.last  = stats.sum(axis=0)
+        self.t     = monotonic()
+
+    def line(self):
+        tot = self.stats.sum(axis=0)
+        now = monotonic()
+        dt  = max(now-self.t, 1e-9)
+        d   = dict(zip(stat_names, (tot-self.last)/dt))
+        self.last, self.t = tot, now
+        return ('{:d} devices: {:8.1f} req/s {:8.3f} MB/s {:9.1f} records/s, '
+                'service {:6.2f} ms/req, {:d} errors').format(
+                    len(self.stats), d['requests'], d['bytes']/1e6, d['records'],
+                    1e3*d['busy']/d['requests'] if d['requests']>0 else 0.0, int(tot[1]) )
+
+
+#%% Load test client
+
+async def remote(reader,writer,cmd):
+    """One command on an open farm connection. Returns (exit status, output)"""
+    b = cmd.encode()
+    writer.write(head.pack(OP_EXEC,len(b)) + b)
+    await writer.drain()
+    out = b''
+    while True:
+        rc,size = head.unpack(await reader.readexactly(head.size))
+        out    += await reader.readexactly(size)
+        if rc!=OUT_PART:
+            return rc, out
+
+
+bench_mix = ( 'dummy.py peak_pos {v:d}', 'dummy.py', 'osc.py Dec',
+              'osc_trig.py -s now', 'osc_get_ch.py -b' )
+
+
+async def bench_device(host,port,duration,mix=bench_mix):
+    """Runs the commands of mix in turn for duration seconds. Returns Dict cmd -> latencies"""
+    reader,writer = await asyncio.open_connection(host,port)
+    lat = { y:[] for y in mix }
+    t0  = monotonic()
+    k   = 0
+    try:
+        while monotonic()-t0<duration:
+            cmd = mix[k % len(mix)]
+            t1  = perf_counter()
+            rc,out = await remote(reader, writer, cmd.format(v=k % 2000 - 1000))
+            lat[cmd].append(perf_counter()-t1)
+            k += 1
+    finally:
+        writer.close()
+    return lat
+
+
+async def bench(host,ports,duration,mix=bench_mix):
+    """
+    One client for each port running bench_mix for duration seconds.
+    Returns a Dict cmd -> (count, p50, p95, p99 latency in s) plus 'all'
+    """
+    t0  = monotonic()
+    res = await asyncio.gather(*[ bench_device(host, p, duration, mix) for p in ports ])
+    dt  = monotonic()-t0
+    out = {}
+    for cmd in list(mix)+['all']:
+        v = np.concatenate([ y[cmd] if cmd!='all' else np.concatenate([ y[c] for c in mix ]) for y in res ])
+        out[cmd] = ( len(v), ) + ( tuple(np.percentile(v,[50,95,99])) if len(v)>0 else (np.nan,)*3 )
+    out['rate'] = out['all'][0]/dt
+    return out
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-n", "--devices", type=int, dest='devices', default=10,
+                    help="number of simulated devices")
+parser.add_argument("-p", "--port", type=int, dest='port', default=7000,
+                    help="tcp port of the first device. Device i uses port+i")
+parser.add_argument("-a", "--address", type=str, dest='host', default='127.0.0.1',
+                    help="address to listen on")
+parser.add_argument("--procs", type=int, dest='procs', default=0,
+                    help="worker processes. 0 serves every device in this process")
+parser.add_argument("--latency", type=float, dest='latency', default=0.0,
+                    help="seconds added before each answer / stream write")
+parser.add_argument("--jitter", type=float, dest='jitter', default=0.0,
+                    help="std in seconds of a gaussian added to latency")
+parser.add_argument("--stride", type=int, dest='stride', default=64,
+                    help="model clocks between data_dump.py records")
+parser.add_argument("--dev-dir", type=str, dest='dev_dir',
+                    default='/dev/shm/hugo_farm' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(),'hugo_farm'),
+                    help="directory for the memory files of the devices")
+parser.add_argument("--keep", action='store_true',
+                    help="keep the memory files at exit")
+parser.add_argument("--scan-amp", type=int, dest='scan_amp', default=8000,
+                    help="amplitude of the triangle scan on in1")
+parser.add_argument("--scan-period", type=int, dest='scan_period', default=2**17,
+                    help="period of the triangle scan on in1, in clocks")
+parser.add_argument("--max-clocks", type=int, dest='max_clocks', default=2**20,
+                    help="max clocks simulated for each acquisition")
+parser.add_argument("--report", type=float, dest='report', default=5.0,
+                    help="seconds between throughput reports. 0: no reports")
+parser.add_argument("--bench", type=float, dest='bench', default=0.0,
+                    help="run a load test of this many seconds against the farm and exit")
+
+
+async def main(args):
+    loop = asyncio.get_running_loop()
+    done = asyncio.Event()
+    for s in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(s, done.set)
+    os.makedirs(args.dev_dir, exist_ok=True)
+    opts  = dict(vars(args), remove=not args.keep)
+    n     = args.devices
+    procs = []
+    if args.procs>0:
+        ctx   = multiprocessing.get_context()
+        raw   = ctx.RawArray('d', n*len(stat_names))
+        stats = stats_array(n, raw)
+        event = ctx.Event()
+        for k in range(args.procs):
+            p = ctx.Process(target=worker, args=(list(range(k,n,args.procs)), opts, raw, event))
+            p.start()
+            procs.append(p)
+        farm = None
+    else:
+        stats = stats_array(n)
+        farm  = asyncio.ensure_future(serve(range(n), opts, stats, done.wait))
+    eprint('{:d} devices on {:s}:{:d}-{:d}'.format(n, args.host, args.port, args.port+n-1))
+
+    async def report():
+        rep = stats_report(stats)
+        while True:
+            await asyncio.sleep(args.report)
+            eprint(rep.line())
+    rtask = asyncio.ensure_future(report()) if args.report>0 else None
+
+    try:
+        if args.bench>0:
+            await asyncio.sleep(1.0 if args.procs>0 else 0.1)
+            res = await bench(args.host, range(args.port,args.port+n), args.bench)
+            print('{:<26s} {:>8s} {:>9s} {:>9s} {:>9s}'.format('command','count','p50 ms','p95 ms','p99 ms'))
+            for cmd in list(bench_mix)+['all']:
+                c,p50,p95,p99 = res[cmd]
+                print('{:<26s} {:>8d} {:>9.2f} {:>9.2f} {:>9.2f}'.format(cmd, c, 1e3*p50, 1e3*p95, 1e3*p99))
+            print('{:d} devices: {:.1f} commands/s'.format(n, res['rate']))
+            done.set()
+        else:
+            await done.wait()
+    finally:
+        done.set()
+        if rtask is not None:
+            rtask.cancel()
+        if farm is not None:
+            await farm
+        if len(procs)>0:
+            event.set()
+            for p in procs:
+                p.join()
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    asyncio.run(main(args))
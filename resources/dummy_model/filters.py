@@ -0,0 +1,457 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Exact kernels for the first order filters of the dummy core
+(filtro_pasabajos.v and filtro_pasaaltos.v).
+
+Both filters run the same recursion on a 58 bits accumulator:
+
+    div[t] = wrap31( s[t] >>> sh )
+    s[t+1] = sat58( s[t] - div[t] + u[t] )
+
+with sh = 4+lpf_val and u = signal_in for the LPF, and sh = hpf_val and
+u = wrap31(indiff<<sh) - indiff for the HPF (indiff = x[t]-x[t-1]).
+The output of the filter is wrap14(div).
+
+The floor makes the recursion non linear, so it can not be written as an
+associative scan. It is contracting, though: two runs from different start
+states end up in the same state after a few time constants, and from there
+on they are identical. The blocked kernel uses that:
+
+  - the start state of each block is guessed with a prefix scan of the
+    linear part of the recursion (one closed form per block)
+  - all blocks are run side by side, each one a little past its end
+    (overlap of 16 time constants), with vector operations
+  - block b+1 is exact from the first sample where its state equals the
+    state of block b; the samples before are taken from block b overlap.
+    If the states never meet, block b+1 is computed again from the exact
+    state (this happens with very quiet inputs).
+
+As the kernel runs the real recursion, saturation and wrap are exact. When
+they can not happen (the usual case) the cheaper update without them is
+used. The same scheme is used across processes for very long records
+(iir_parallel).
+
+Usage:
+    y, st = lpf_block(0, x, lpf_val)            # st: accumulator
+    y, st = hpf_block((0,0), x, hpf_val)        # st: (accumulator, last input)
+    div, s_end = iir_block(s0, u, sh)           # raw recursion
+    div, s_end = iir_parallel(u, sh, s0, workers=4)
+
+Benchmark:
+    python3 filters.py --samples 4194304
+
+@author: lolo
+"""
+
+from __future__ import print_function
+
+import sys
+import argparse
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+try:
+    from .ref_model import S
+except (ImportError, ValueError):
+    from ref_model import S
+
+
+SMAX = (1<<(S-1))-1
+SMIN = -(1<<(S-1))
+M31  = (1<<31)-1
+
+
+def wrap(x,nbits):
+    """Keeps the nbits LSB of the int array x as signed values"""
+    half = 1 << (nbits-1)
+    return ((x + half) & ((1<<nbits)-1)) - half
+
+
+def ref_states(u,sh,s0):
+    """Clock by clock recursion. Returns (div, s) with the n+1 states"""
+    div = np.empty(len(u), dtype=np.int64)
+    s   = np.empty(len(u)+1, dtype=np.int64)
+    x   = int(s0)
+    s[0] = x
+    for i,v in enumerate(np.asarray(u).tolist()):
+        d = ((x >> sh) + (1<<30)) % (1<<31) - (1<<30)
+        div[i] = d
+        x = x - d + v
+        x = SMAX if x>SMAX else SMIN if x<SMIN else x
+        s[i+1] = x
+    return div, s
+
+
+def linear_guess(u,sh,s0):
+    """
+    Real valued solution of s[t+1] = s[t]*(1-2**-sh) + u[t] + 0.5, the
+    linear part of the filter recursion plus the mean of the floor error.
+    Blocks of 16*2**sh samples are solved in closed form; the block starts
+    only depend on the last few blocks, as the decay in one block is e**-16.
+    """
+    n  = len(u)
+    a  = 1.0 - 2.0**-sh
+    B  = int(min(n, 16<<sh))
+    nb = -(-n//B)
+    uu = np.zeros(nb*B)
+    uu[:n] = u
+    uu += 0.5
+    uu  = uu.reshape(nb,B)
+    p   = a**np.arange(B+1)
+    c   = np.cumsum(uu/p[1:], axis=1)
+    s   = np.empty((nb,B))
+    s[:,0]  = 0
+    s[:,1:] = c[:,:-1]*p[1:B]
+    end = c[:,-1]*p[B]
+    st  = np.zeros(nb)
+    st[0] = s0
+    if nb>1:
+        A = p[B]
+        f = 1.0
+        for j in range(nb-1):
+            st[1+j:] += f*end[:nb-1-j]
+            f *= A
+            if f<1e-12:
+                break
+        st[1:] += s0*A**np.arange(1,nb)
+    s += st[:,None]*p[None,:B]
+    return s.ravel()[:n]
+
+
+def scan_states(u,sh,s0):
+    """
+    Exact recursion by correction of a guess. Given the outputs q, the state
+    is just s0 + cumsum(u-q). The outputs are guessed from linear_guess()
+    and corrected where floor(s/2**sh) disagrees, scanning forward: each
+    correction shifts the rest of the state by a constant, so a whole window
+    is checked with one vector operation. The cost depends on the number of
+    corrections. Falls back to ref_states() when wrap31/sat58 would act.
+    Returns (div, s) with the n+1 states.
+    """
+    u = np.asarray(u, dtype=np.int64)
+    n = len(u)
+    s0 = int(s0)
+    lim = min(1<<(30+sh), 1<<(S-2))
+    if n==0:
+        return np.zeros(0,dtype=np.int64), np.array([s0],dtype=np.int64)
+    if abs(s0)>=lim:
+        return ref_states(u,sh,s0)
+    if sh==0:
+        s = np.empty(n+1, dtype=np.int64)
+        s[0]  = s0
+        s[1:] = u
+        if np.abs(u).max()>=lim:
+            return ref_states(u,sh,s0)
+        return s[:-1].copy(), s
+
+    q0 = np.floor(linear_guess(u,sh,s0) / 2.0**sh).astype(np.int64)
+    sg = np.empty(n, dtype=np.int64)
+    sg[0] = s0
+    np.cumsum(u[:-1]-q0[:-1], out=sg[1:])
+    sg[1:] += s0
+
+    q   = q0.copy()
+    d   = 0
+    pos = 0
+    W   = 64
+    while pos<n:
+        e = ((sg[pos:pos+W]-d) >> sh) - q0[pos:pos+W]
+        i = int(e.astype(bool).argmax())
+        if e[i]==0:
+            pos += W
+            W    = min(4*W, 1<<16)
+            continue
+        q[pos+i] += e[i]
+        d        += int(e[i])
+        pos      += i+1
+        W         = 64
+
+    # true state: sg minus the accumulated corrections before each sample
+    s = np.empty(n+1, dtype=np.int64)
+    s[:n]  = sg
+    s[1:n] -= np.cumsum(q[:-1]-q0[:-1])
+    s[n]   = s[n-1] - q[-1] + u[-1]
+    if np.abs(s).max()>=lim:
+        return ref_states(u,sh,s0)
+    return q, s
+
+
+def guess_starts(u,sh,s0,B,L):
+    """
+    Guess of the state at the start of the first L blocks of B samples.
+    Prefix scan of the linear recursion s[t+1] = a*s[t] + u[t] + 0.5 at block
+    level: end = a**B*start + C, with C a weighted sum of the block inputs.
+    """
+    a = 1.0 - 2.0**-sh
+    w = a**np.arange(B-1,-1,-1)
+    C = np.asarray(u[:L*B], dtype=np.float64).reshape(L,B).dot(w) + 0.5*w.sum()
+    A = a**B
+    st = np.empty(L)
+    st[0]  = s0
+    st[1:] = C[:-1]
+    if A>1e-12:        # short blocks: the previous start still counts
+        for b in range(1,L):
+            st[b] += A*st[b-1]
+    else:
+        st[1:] += A*st[:-1]
+    return np.clip(np.rint(st), SMIN, SMAX).astype(np.int64)
+
+
+def lockstep(U,sh,s):
+    """
+    Runs the recursion on the columns of U (T,L) at the same time, starting
+    at the states s (L,). Returns (div (T,L), states (T+1,L))
+    """
+    T,L = U.shape
+    div = np.empty((T,L), dtype=np.int64)
+    st  = np.empty((T+1,L), dtype=np.int64)
+    s   = np.array(s, dtype=np.int64)
+    st[0] = s
+    # |s| <= 2**sh*(max|u|+1) is kept by the recursion. Inside it, if sum_div
+    # fits in 31 bits, neither the wrap nor the saturation act
+    R = (int(np.abs(U).max())+1) << sh
+    if int(np.abs(s).max())<=R and R < (1<<(30+sh)) and R < (1<<(S-2)):
+        for t in range(T):
+            d = div[t]
+            np.right_shift(s, sh, out=d)
+            s -= d
+            s += U[t]
+            st[t+1] = s
+        return div, st
+    for t in range(T):
+        d = div[t]
+        np.right_shift(s, sh, out=d)
+        d += 1<<30
+        d &= M31
+        d -= 1<<30
+        s -= d
+        s += U[t]
+        np.clip(s, SMIN, SMAX, out=s)
+        st[t+1] = s
+    return div, st
+
+
+def merge_points(tail,head):
+    """
+    First row where the states of two runs are equal, for each column.
+    tail: states of the exact runs, head: states of the next runs at the same
+    samples. -1 where they do not meet.
+    """
+    eq = tail==head
+    m  = eq.argmax(axis=0)
+    m[~eq.any(axis=0)] = -1
+    return m
+
+
+def transposed(a,tile=64):
+    """Contiguous copy of a.T, by tiles of rows (much faster than a.T.copy())"""
+    out = np.empty(a.shape[::-1], dtype=a.dtype)
+    for j in range(0,a.shape[0],tile):
+        out[:,j:j+tile] = a[j:j+tile].T
+    return out
+
+
+def lanes_states(u,sh,s0,V,at):
+    """
+    Blocked kernel: blocks of B=4*V samples run side by side with lockstep(),
+    each one V samples past its end, and are stitched where they meet.
+    Needs len(u) >= B+V. Returns (div, states at the offsets `at`).
+    """
+    n = len(u)
+    B = 4*V
+    L = (n-V)//B
+    u = np.ascontiguousarray(u, dtype=np.int64)
+    U = transposed(as_strided(u, shape=(L,B+V), strides=(B*8,8)))
+    div, st = lockstep(U, sh, guess_starts(u, sh, s0, B, L))
+
+    m   = merge_points(st[B:B+V+1,:-1], st[:V+1,1:])    # boundary b-1|b at m[b-1]
+    bad = np.flatnonzero(m<0)
+    while len(bad)>0:
+        b = bad[0]+1
+        d, s = scan_states(U[:,b], sh, st[B,b-1])
+        div[:,b], st[:,b] = d, s
+        m[b-1] = 0
+        if b<L-1:
+            m[b] = merge_points(st[B:B+V+1,b:b+1], st[:V+1,b+1:b+2])[0]
+        bad = np.flatnonzero(m[b:]<0)+b
+
+    # before the meeting point, the exact values are the ones of the previous block
+    fix = np.arange(V+1)[:,None] < m[None,:]
+    div[:V,1:][fix[:V]] = div[B:B+V,:-1][fix[:V]]
+    st[:V+1,1:][fix]    = st[B:B+V+1,:-1][fix]
+
+    d, s = scan_states(u[L*B:], sh, st[B,L-1])
+    out = np.empty(n, dtype=np.int64)
+    out[:L*B] = transposed(div[:B]).ravel()
+    out[L*B:] = d
+    at   = np.asarray(at)
+    s_at = np.empty(len(at), dtype=np.int64)
+    k    = at < L*B
+    s_at[k]  = st[at[k] % B, at[k]//B]
+    s_at[~k] = s[at[~k]-L*B]
+    return out, s_at
+
+
+def overlap(sh):
+    """Samples that blocks run past their end, 16 time constants"""
+    return 16 << sh
+
+
+def iir_states(u,sh,s0,at=None,min_lanes=32):
+    """
+    Picks the kernel for the length and time constant.
+    Returns (div, states at the offsets `at`); by default only the end state.
+    """
+    u  = np.asarray(u, dtype=np.int64)
+    at = [len(u)] if at is None else at
+    V  = overlap(sh)
+    if sh>0 and (len(u)-V)//(4*V)>=min_lanes:
+        return lanes_states(u,sh,s0,V,at)
+    div, s = scan_states(u,sh,s0)
+    return div, s[at]
+
+
+def iir_block(state_in,x_block,sh):
+    """
+    Filter recursion for one block.
+    Returns (div_block, state_out), bit exact with the Verilog.
+    """
+    div, s = iir_states(x_block, sh, state_in)
+    return div, int(s[0])
+
+
+def iir_ref(u,sh,s0):
+    """Clock by clock version of iir_block(). Returns (div, s_end)"""
+    div, s = ref_states(u,sh,s0)
+    return div, int(s[-1])
+
+
+def iir_scan(u,sh,s0):
+    """iir_block() with the guess correction kernel only. Returns (div, s_end)"""
+    div, s = scan_states(u,sh,s0)
+    return div, int(s[-1])
+
+
+def hpf_input(x,sh,last=0):
+    """Input of the HPF recursion: wrap31(indiff<<sh) - indiff"""
+    x = np.asarray(x, dtype=np.int64)
+    indiff = np.empty(len(x), dtype=np.int64)
+    indiff[0]  = x[0] - last
+    indiff[1:] = np.diff(x)
+    return wrap(indiff << sh, 31) - indiff
+
+
+def lpf_block(state_in,x_block,lpf_val,offset=4):
+    """
+    filtro_pasabajos.v for one block of signal_in.
+    Returns (signal_lpf, accumulator at the end).
+    """
+    div, st = iir_block(state_in, x_block, offset+lpf_val)
+    return wrap(div,14).astype(np.int32), st
+
+
+def hpf_block(state_in,x_block,hpf_val,offset=0):
+    """
+    filtro_pasaaltos.v for one block of its input.
+    state_in and the returned state are (accumulator, last input).
+    Returns (signal_hpf, state).
+    """
+    sh  = offset+hpf_val
+    div, st = iir_block(state_in[0], hpf_input(x_block, sh, state_in[1]), sh)
+    return wrap(div,14).astype(np.int32), (st, int(x_block[-1]))
+
+
+def chunk_states(args):
+    """Worker of iir_parallel(): a chunk from a guessed start. Returns (div, head, tail)"""
+    u, sh, s0, C, V = args
+    div, s = iir_states(u, sh, s0, np.r_[0:V+1,C:C+V+1])
+    return div, s[:V+1], s[V+1:]
+
+
+def iir_parallel(u,sh,s0=0,chunk=2**22,workers=None,executor=None):
+    """
+    iir_block() for very long records. The record is cut in chunks that run in
+    a pool (a ProcessPoolExecutor with `workers` processes, or `executor`),
+    each one from a guessed start, and stitched as in lanes_states().
+    Returns (div, s_end).
+    """
+    u = np.asarray(u, dtype=np.int64)
+    n = len(u)
+    V = overlap(sh)
+    C = max(int(chunk), 8*V)
+    L = (n-V)//C
+    if L<2:
+        return iir_block(s0, u, sh)
+    starts = guess_starts(u, sh, s0, C, L)
+    starts[0] = s0
+    tasks  = [ (u[b*C:(b+1)*C+V], sh, int(starts[b]), C, V) for b in range(L) ]
+    if executor is None:
+        with ProcessPoolExecutor(workers) as ex:
+            res = list(ex.map(chunk_states, tasks))
+    else:
+        res = list(executor.map(chunk_states, tasks))
+
+    div = np.empty(n, dtype=np.int64)
+    for b in range(L):
+        d, head, tail = res[b]
+        if b>0:
+            prev_d, prev_tail = res[b-1][0], res[b-1][2]
+            m = merge_points(prev_tail[:,None], head[:,None])[0]
+            if m<0:
+                res[b] = chunk_states(tasks[b][:2] + (prev_tail[0],) + tasks[b][3:])
+                d = res[b][0]
+                m = 0
+            d = d.copy()
+            d[:m] = prev_d[C:C+m]
+        div[b*C:(b+1)*C] = d[:C]
+    d, s = iir_block(res[L-1][2][0], u[L*C:], sh)
+    div[L*C:] = d
+    return div, s
+
+
+def benchmark(n=2**22,vals=range(16),check=2**16,seed=0):
+    """
+    Throughput of lpf_block() and hpf_block() for each lpf_val/hpf_val, with a
+    slow scan plus noise as input. The first `check` samples are compared
+    with the clock by clock recursion.
+    Returns a list of (filter, val, Msps).
+    """
+    rng = np.random.default_rng(seed)
+    t   = np.arange(n)
+    x   = (6000*np.sin(2*np.pi*t/2**20) + rng.normal(0,50,n)).astype(np.int64)
+    out = []
+    for name in ('lpf','hpf'):
+        for v in vals:
+            t0 = perf_counter()
+            if name=='lpf':
+                y,_ = lpf_block(0, x, v)
+            else:
+                y,_ = hpf_block((0,0), x, v)
+            dt = perf_counter()-t0
+            if check>0:
+                sh = 4+v if name=='lpf' else v
+                u  = x[:check] if name=='lpf' else hpf_input(x[:check], sh)
+                d,_ = ref_states(u, sh, 0)
+                if not np.array_equal(wrap(d,14), y[:check]):
+                    raise ValueError('{:s} {:d}: mismatch with the reference'.format(name,v))
+            out.append((name, v, n/dt/1e6))
+            print('{:s}_val {:2d}: {:7.1f} Msps'.format(name, v, n/dt/1e6))
+    return out
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-n", "--samples", type=int, dest='samples', default=2**22,
+                    help="samples for each filter setting")
+parser.add_argument("--check", type=int, dest='check', default=2**16,
+                    help="samples checked against the clock by clock recursion")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    print('benchmark: {:d} samples'.format(args.samples), file=sys.stderr)
+    benchmark(args.samples, check=args.check)
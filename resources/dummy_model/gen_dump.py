@@ -0,0 +1,402 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic data_dump.py streams (.bin files) for read_dump tests and benchmarks.
+
+The file has the same layout as a dump received from data_dump.py: 100 bytes
+column header, 3400 bytes params header and '!Qq'+'l'*N records (sample clock
+tick, host time in us), or '!f'+'l'*N with ticks=False. Records are
+built in blocks with numpy structured arrays and written by a separate
+thread, so large files are written at disk speed.
+
+The signals come from the dummy.v datapath evaluated once per record, at the
+clock of the record time: the drift is the exact drift generator state
+(drift.py), the noise has the fun_icdf distribution, and the peak, base and
+outputs use the same integer arithmetic as dummy_core. The filters are taken
+in steady state (LPF passes the slow control signal, HPF blocks it).
+
+An external controller drives in1 (ctrl). It alternates lock episodes, where
+ctrl follows the left half maximum of the drifting peak with some noise, and
+unlock episodes, where it scans. Two extra columns can be streamed:
+    error : salida - setpoint (value of the response at the lock point)
+    ctrl  : controller output (= in1). Aliases: ctrl_A, ctrl_B
+Any other dm register streams its value.
+
+Timestamps follow the data_dump.py sampler: k/rate plus a lag (exponential,
+mean `jitter`), and records inside dropout intervals are missing. The tick is
+the exact time of the sample, the host time is truncated to microseconds.
+
+The lock episodes and dropouts are saved in a <name>_truth.npz file.
+
+Usage:
+    python3 gen_dump.py -o test.bin --size 4G
+    python3 gen_dump.py -o test.bin --duration 3600 --params error ctrl_A out1 --dropouts 10
+
+    g = dump_generator(params=['error','ctrl'], rate=500, seed=1)
+    rec = g.block(0)                # structured array, first block_len deadlines
+    write_dump('test.bin', g, size=2**30)
+
+@author: lolo
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import queue
+import argparse
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from time import time,perf_counter
+
+import numpy as np
+
+try:
+    from .ref_model import load_table, regs_default, oscA_sel, oscB_sel, out_sel
+    from .core import wrap, sat
+    from .noise import icdf_table
+    from .drift import drift_at
+except (ImportError, ValueError):
+    from ref_model import load_table, regs_default, oscA_sel, oscB_sel, out_sel
+    from core import wrap, sat
+    from noise import icdf_table
+    from drift import drift_at
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+CLK = 125e6
+
+# dm registers in hugo.py order, with the values of the generated dumps
+dump_regs = [ 'oscA_sw','oscB_sw','osc_ctrl','trig_sw','out1_sw','out2_sw',
+              'slow_out1_sw','slow_out2_sw','slow_out3_sw','slow_out4_sw',
+              'in1','in2','out1','out2','slow_out1','slow_out2','slow_out3','slow_out4',
+              'oscA','oscB','entrada','lpf_on','lpf_val','hpf_on','hpf_val',
+              'peak_pos','sg_amp','sg_width','sg_base','noise_enable','noise_amp',
+              'drift_enable','drift_time','val_fun','noise_std','read_ctrl' ]
+
+gen_default = dict(regs_default, sg_amp=6000, sg_width=8000, noise_enable=1, noise_amp=300,
+                   drift_enable=1, drift_time=15, out1_sw=1, out2_sw=2, oscA_sw=2, oscB_sw=7)
+
+aliases = { 'ctrl_A':'ctrl', 'ctrl_B':'ctrl' }
+
+
+def parse_size(txt):
+    """'4G', '500M', '1e9' -> bytes"""
+    mult = { 'K':2**10, 'M':2**20, 'G':2**30, 'T':2**40 }
+    txt  = str(txt).strip().upper().rstrip('B')
+    if txt and txt[-1] in mult:
+        return int(float(txt[:-1])*mult[txt[-1]])
+    return int(float(txt))
+
+
+class dump_generator():
+    """
+    Record generator. Each call of block() continues the same stream.
+
+    Params:
+        params       : streamed signal names (columns)
+        rate         : samples per second of the sampler
+        regs         : dummy register values (gen_default is used for the rest)
+        lock_mean    : mean length of lock episodes, seconds (exponential)
+        unlock_mean  : mean length of unlock episodes, seconds. 0: always locked
+        lock_noise   : std of ctrl around the lock point, in ctrl units
+        scan_amp     : amplitude of the ctrl scan while unlocked
+        scan_period  : period of that scan, seconds
+        jitter       : mean sampling lag, seconds
+        dropouts     : dropouts per hour (0: none)
+        dropout_mean : mean dropout length, seconds
+        t0           : unix time of the start. Now by default
+        block_len    : sampler deadlines of each block
+        ticks        : '!Qq' records with sample clock ticks. False: old '!f' records
+    """
+    def __init__(self,params=('error','ctrl','out1'),rate=500,regs=None,seed=0,
+                 lock_mean=60.0,unlock_mean=5.0,lock_noise=2.0,scan_amp=4000,scan_period=0.05,
+                 jitter=50e-6,dropouts=0.0,dropout_mean=1.0,t0=None,block_len=2**20,ticks=True):
+        self.params      = [ aliases.get(y,y) for y in params ]
+        self.names       = list(params)
+        self.rate        = rate
+        self.period      = 1.0/rate
+        self.regs        = dict(gen_default, **(regs or {}))
+        self.lock_mean   = lock_mean
+        self.unlock_mean = unlock_mean
+        self.lock_noise  = lock_noise
+        self.scan_amp    = scan_amp
+        self.scan_period = scan_period
+        self.jitter      = jitter
+        self.dropouts    = dropouts
+        self.drop_mean   = dropout_mean
+        self.t0          = time() if t0 is None else t0
+        self.seed        = seed
+        self.rng         = np.random.default_rng([seed, 0])     # episodes. Blocks have their own
+        self.block_len   = block_len
+        self.ticks       = ticks
+        self.pico        = np.array(load_table('pico_data.dat'), dtype=np.int64)
+        self.icdf        = icdf_table().astype(np.int64)
+        head             = [('tick','>u8'),('host','>i8')] if ticks else [('t','>f4')]
+        self.dtype       = np.dtype(head+[ ('c{:d}'.format(i),'>i4') for i in range(len(params)) ])
+        self.count       = 0            # records written by write_dump()
+        self.lock_edges  = [0.0]        # times where the lock state toggles (unlocked first)
+        self.drops       = [[],[]]      # dropout starts, ends
+        self.t_drop      = 0.0
+        # lock point: left half maximum of the line
+        self.x_half      = int(np.flatnonzero(self.pico <= self.pico[0]//2)[0])
+        self.setpoint    = int(wrap((self.pico[self.x_half]*self.regs['sg_amp'])>>13, 14))
+        if unlock_mean<=0:
+            self.lock_edges = [0.0, 0.0]
+
+    @property
+    def record_size(self):
+        return self.dtype.itemsize
+
+    def header(self):
+        """100 bytes column header + 3400 bytes params header, as data_dump.py"""
+        txt='Columns: '+','.join(self.names)+'\n'+'timestamp {:>20f}\n'.format(self.t0)
+        if self.ticks:
+            txt+='clock {:d}\n'.format(int(CLK))
+        txt=(txt.ljust(99)+'\n').encode('ascii')
+        txt2=[ '"{:s}": {:f}'.format(y, float(self.regs.get(y,0))) for y in dump_regs ]
+        txt+= (  ('params={'+',\n'.join(txt2) +'\n}\n').ljust(3399)+'\n' ).encode('ascii')
+        return txt
+
+    def times(self,rec):
+        """Times of the records rec, in seconds"""
+        return rec['tick']/CLK if self.ticks else rec['t']
+
+    def episodes(self,t_end):
+        """Extends the lock edges and dropout intervals up to t_end"""
+        while self.unlock_mean>0 and self.lock_edges[-1]<=t_end:
+            locked = len(self.lock_edges)%2==0
+            self.lock_edges.append( self.lock_edges[-1] +
+                                    self.rng.exponential(self.unlock_mean if not locked else self.lock_mean) )
+        while self.dropouts>0 and self.t_drop<=t_end:
+            self.t_drop += self.rng.exponential(3600.0/self.dropouts)
+            self.drops[0].append(self.t_drop)
+            self.t_drop += self.rng.exponential(self.drop_mean)
+            self.drops[1].append(self.t_drop)
+
+    def locked(self,t):
+        edges = np.asarray(self.lock_edges)
+        return np.searchsorted(edges, t, side='right') % 2 == 0 if self.unlock_mean>0 else np.ones(len(t),bool)
+
+    def dropped(self,t):
+        if self.dropouts<=0:
+            return np.zeros(len(t), dtype=bool)
+        starts, ends = np.asarray(self.drops[0]), np.asarray(self.drops[1])
+        i = np.searchsorted(starts, t, side='right')-1
+        return (i>=0) & (t < ends[np.maximum(i,0)])
+
+    def signals(self,t,locked,rng,names):
+        """
+        Datapath values at the times t, for the signals `names`. Each signal
+        is computed only if it is needed. Returns a Dict of int64 arrays.
+        """
+        r   = self.regs
+        n   = len(t)
+        def ctrl(v):
+            scan  = np.abs( (t/self.scan_period) % 1.0 * 4 - 2 ) - 1
+            c_lck = (-self.x_half - r['peak_pos'] - v['drift'])*8192.0/max(r['sg_width'],1)
+            c_lck = c_lck + self.lock_noise*rng.standard_normal(n, dtype=np.float32)
+            return sat(np.round(np.where(locked, c_lck, self.scan_amp*scan)).astype(np.int64))
+        def rand_norm(v):                 # fun_icdf distribution
+            rn = self.icdf[rng.integers(0, 1024, n)]
+            return np.where(rng.integers(0, 2, n, dtype=np.int8)==1, wrap(-rn,14), rn)
+        def signal_in(v):
+            e,a,b = r['entrada'], v['in1'], v['in2']
+            return a if e==0 else b if e==1 else sat(a+b) if e==2 else sat(a-b) if e==3 else 0*a
+        def peak(x,v):
+            p_in = sat(wrap(r['peak_pos'] + wrap((x*r['sg_width'])>>13,14) + v['drift'], 15))
+            return wrap((self.pico[np.minimum(np.abs(p_in),2047)]*r['sg_amp'])>>13, 14)
+        f = {
+            'clk'        : lambda v: (t*CLK).astype(np.int64),
+            'drift'      : lambda v: drift_at(v['clk'], r['drift_time'], r['drift_enable']),
+            'ctrl'       : ctrl,
+            'in1'        : lambda v: v['ctrl'],
+            'in2'        : lambda v: v['zero'],
+            'zero'       : lambda v: np.zeros(n, dtype=np.int64),
+            'rand_norm'  : rand_norm,
+            'noise'      : lambda v: wrap((v['rand_norm']*r['noise_amp'])>>13, 14) if r['noise_enable'] else v['zero'],
+            'signal_in'  : signal_in,
+            'signal_lpf' : lambda v: v['signal_in'],
+            'signal_hpf' : lambda v: v['zero'] if r['hpf_on'] else v['signal_lpf'],
+            'val_fun'    : lambda v: peak(v['signal_hpf'],v),
+            'base'       : lambda v: wrap((v['signal_in']*r['sg_base'])>>14, 14),
+            'salida'     : lambda v: sat(v['val_fun'] + v['noise'] + v['base']),
+            'error'      : lambda v: v['salida'] - self.setpoint,
+            'ramp'       : lambda v: wrap(v['clk'] % 16384, 14),
+            'simul'      : lambda v: sat( peak(v['ramp'],v) + v['noise'] + wrap((v['ramp']*r['sg_base'])>>14,14) ),
+        }
+        for y,sel in (('out1',out_sel),('out2',out_sel),('oscA',oscA_sel),('oscB',oscB_sel)):
+            sw   = r[y+'_sw']
+            f[y] = (lambda v,s=sel[sw]: v[s]) if sw<len(sel) else f['zero']
+        v = lazy(f)
+        return { y:v[y] for y in names if y in f }
+
+    def prepare(self,i):
+        """Episodes needed by block i. Call it in order before handing blocks to workers"""
+        self.episodes( (i+1)*self.block_len*self.period + 1.0 )
+
+    def block(self,i):
+        """
+        Records for the sampler deadlines of block i (block_len deadlines,
+        fewer records if some are dropped). Blocks have their own random
+        stream, so they can be made in any order and in other processes.
+        """
+        self.prepare(i)
+        rng = np.random.default_rng([self.seed, 1, i])
+        td  = (i*self.block_len + np.arange(self.block_len, dtype=np.int64))*self.period
+        td  = td[~self.dropped(td)]
+        t   = td + rng.exponential(self.jitter, len(td)) if self.jitter>0 else td
+        v   = self.signals(t, self.locked(t), rng, set(self.params))
+        rec = np.empty(len(t), dtype=self.dtype)
+        if self.ticks:
+            rec['tick'] = np.round(t*CLK)
+            rec['host'] = np.floor(t*1e6)
+        else:
+            rec['t'] = t
+        for k,y in enumerate(self.params):
+            rec['c{:d}'.format(k)] = v[y] if y in v else int(self.regs.get(y,0))
+        return rec
+
+    def truth(self):
+        """Dict with the lock episodes and dropouts generated so far"""
+        edges = np.asarray(self.lock_edges)
+        return { 'lock_start': edges[1::2], 'lock_end': edges[2::2], 'drop_start': np.asarray(self.drops[0]),
+                 'drop_end': np.asarray(self.drops[1]), 'rate': self.rate, 'records': self.count,
+                 'setpoint': self.setpoint, 'names': np.array(self.names) }
+
+
+class lazy(dict):
+    """Dict that computes missing keys with funs[key](self)"""
+    def __init__(self,funs):
+        dict.__init__(self)
+        self.funs = funs
+
+    def __missing__(self,key):
+        self[key] = self.funs[key](self)
+        return self[key]
+
+
+def _block(gen,i):
+    return gen.block(i)
+
+
+def write_dump(filename,gen,size=None,records=None,duration=None,workers=None,truth=True,verbose=False):
+    """
+    Writes the header and records of gen until the file has `size` bytes,
+    `records` records or `duration` seconds of data (the first given).
+
+    Blocks are made by `workers` processes (one for each cpu by default, 0
+    makes them in this process) while a thread writes the previous ones.
+    Returns (bytes, seconds).
+    """
+    head  = gen.header()
+    limit = ( ( size-len(head) )//gen.record_size if size is not None else
+              records if records is not None else int(duration*gen.rate) )
+    nblk  = None if duration is None else -(-int(duration*gen.rate)//gen.block_len)
+    q     = queue.Queue(maxsize=2)
+    err   = []
+    def writer(f):
+        try:
+            while True:
+                b = q.get()
+                if b is None:
+                    break
+                f.write(b)
+        except Exception as e:
+            err.append(e)
+            while q.get() is not None:
+                pass
+    def blocks(ex):
+        """Blocks in order, with at most 2 per worker in flight"""
+        ahead = 1 if ex is None else 2*workers
+        pend  = []
+        for i in ( itertools.count() if nblk is None else range(nblk) ):
+            gen.prepare(i)
+            pend.append( ex.submit(_block, gen, i) if ex is not None else i )
+            if len(pend)>=ahead:
+                p = pend.pop(0)
+                yield p.result() if ex is not None else gen.block(p)
+        for p in pend:
+            yield p.result() if ex is not None else gen.block(p)
+    t0    = perf_counter()
+    total = 0
+    workers = os.cpu_count() if workers is None else workers
+    ex    = ProcessPoolExecutor(workers) if workers>1 else None
+    with open(filename,'wb',buffering=0) as f:
+        f.write(head)
+        th = threading.Thread(target=writer, args=(f,))
+        th.start()
+        try:
+            for rec in blocks(ex):
+                if duration is not None:
+                    rec = rec[gen.times(rec)<duration]
+                rec = rec[:limit-total]
+                if len(rec)>0:
+                    total += len(rec)
+                    q.put(memoryview(rec).cast('B'))
+                if verbose:
+                    eprint('{:d} records, {:.0f} MB/s'.format(total,
+                           total*gen.record_size/1e6/max(perf_counter()-t0,1e-9)))
+                if total>=limit or len(err)>0:
+                    break
+        finally:
+            q.put(None)
+            th.join()
+            if ex is not None:
+                ex.shutdown(cancel_futures=True)
+    if len(err)>0:
+        raise err[0]
+    gen.count = total
+    if truth:
+        np.savez(os.path.splitext(filename)[0]+'_truth.npz', **gen.truth())
+    return len(head)+total*gen.record_size, perf_counter()-t0
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-o", "--out", type=str, dest='out', default='dump.bin',
+                    help="output .bin file")
+parser.add_argument("--size", type=str, dest='size', default=None,
+                    help="file size (e.g. 500M, 4G)")
+parser.add_argument("--records", type=int, dest='records', default=None,
+                    help="number of records")
+parser.add_argument("--duration", type=float, dest='duration', default=None,
+                    help="seconds of data. Default: 60 if no size or records are given")
+parser.add_argument('--params', nargs='+', default=['error','ctrl_A','out1'],
+                    help="streamed signals")
+parser.add_argument("-r", "--rate", type=float, dest='rate', default=500,
+                    help="samples per second")
+parser.add_argument("--seed", type=int, dest='seed', default=0)
+parser.add_argument("--float-time", action="store_false", dest='ticks', default=True,
+                    help="old '!f' records (float32 time) instead of sample clock ticks")
+parser.add_argument("--set", type=str, nargs='+', dest='regs', default=[],
+                    help="register values, as name=value")
+parser.add_argument("--lock-mean", type=float, dest='lock_mean', default=60.0,
+                    help="mean lock episode length, seconds")
+parser.add_argument("--unlock-mean", type=float, dest='unlock_mean', default=5.0,
+                    help="mean unlock episode length, seconds. 0: always locked")
+parser.add_argument("--jitter", type=float, dest='jitter', default=50e-6,
+                    help="mean sampling lag, seconds")
+parser.add_argument("--dropouts", type=float, dest='dropouts', default=0.0,
+                    help="dropouts per hour")
+parser.add_argument("-w", "--workers", type=int, dest='workers', default=None,
+                    help="processes making the records. Default: one for each cpu")
+parser.add_argument("--dropout-mean", type=float, dest='dropout_mean', default=1.0,
+                    help="mean dropout length, seconds")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    regs = { y.split('=')[0]:int(y.split('=')[1]) for y in args.regs }
+    gen  = dump_generator(args.params, rate=args.rate, regs=regs, seed=args.seed,
+                          lock_mean=args.lock_mean, unlock_mean=args.unlock_mean, jitter=args.jitter,
+                          dropouts=args.dropouts, dropout_mean=args.dropout_mean, ticks=args.ticks)
+    size = parse_size(args.size) if args.size is not None else None
+    dur  = args.duration if args.duration is not None or size is not None or args.records is not None else 60.0
+    nb,dt = write_dump(args.out, gen, size=size, records=args.records, duration=dur, workers=args.workers)
+    eprint('{:s}: {:d} records, {:.1f} MB in {:.1f} s ({:.0f} MB/s)'.format(
+            args.out, gen.count, nb/1e6, dt, nb/1e6/dt))
@@ -0,0 +1,445 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Closed loop lock simulation of many PID settings at once.
+
+Each lane is one loop: the PID of red_pitaya_pid_block.v (bit exact) drives
+in1 of the dummy core, and salida goes back to the PID input:
+
+    pid_out --(delay clocks)--> in1 -> dummy.v (LPF, HPF, peak, noise, drift) -> salida
+       ^                                                                           |
+       +--------------------------- error = pidA_sp - salida <---------------------+
+
+All the lanes advance together, one clock at a time, with numpy vectors of
+length M, so every lane can have its own gains, set point and dummy
+registers. Drift and noise, that do not depend on the loop, are computed for
+blocks of clocks in closed form. The noise is the same for every lane (the
+generator of the core, from reset), so the settings are compared on the
+same realization.
+
+The error of each lane is reduced block by block to:
+
+    acq        : clock where the lock was acquired the first time (-1: never)
+    rms        : rms of the error while locked
+    losses     : number of lock losses
+    first_loss : clock of the first loss (-1: none)
+    locked     : fraction of the clocks in lock
+    ctrl       : mean of pid_out while locked (last value if never locked)
+
+A lane gets locked when |error| <= lock_band during `hold` clocks, and
+loses the lock when |error| > loss_band during `hold` clocks.
+
+Usage:
+    from sweep import grid_design, random_design
+    d   = grid_design(pidA_kp=[0,10,40], pidA_ki=[10,100,1000])
+    d   = random_design(5000, pidA_kp=(0,100), pidA_ki=(10,3000), drift_time=(2,10))
+    res = run_lock(d, 2**17, fixed={'drift_time':8}, workers=4)
+    res['acq'], res['rms'], res['losses']
+
+    python3 lock_sim.py --kp 0,10,40 --ki 10,100,1000 --clocks 131072 -o lock.npz
+
+@author: lolo
+"""
+
+from __future__ import print_function
+
+import sys
+import argparse
+from collections import deque
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .ref_model import dummy_ref, load_table, regs_default, S
+    from .core import wrap, sat
+    from .noise import xorshift128, rand_norm, icdf_table
+    from .drift import drift_at
+    from .sweep import grid_design
+except (ImportError, ValueError):
+    from ref_model import dummy_ref, load_table, regs_default, S
+    from core import wrap, sat
+    from noise import xorshift128, rand_norm, icdf_table
+    from drift import drift_at
+    from sweep import grid_design
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# PID registers, with the names of the lock app (rp.lock). The shifts are
+# the parameters of red_pitaya_pid.v
+pid_default = {
+    'pidA_sp'  : None,      # None: half height of the peak (see half_max)
+    'pidA_kp'  : 0,
+    'pidA_ki'  : 0,
+    'pidA_kd'  : 0,
+    'pidA_PSR' : 12,
+    'pidA_ISR' : 18,
+    'pidA_DSR' : 10,
+}
+
+# Plant used when nothing else is given
+lock_default = dict(regs_default, out1_sw=1, sg_amp=6000, sg_width=8000,
+                    noise_enable=1, noise_amp=300, drift_enable=1, drift_time=8)
+
+result_names = ('acq','rms','losses','first_loss','locked','ctrl')
+
+
+def half_max(regs,pico):
+    """
+    Half height of the static peak response for each lane (Dict of arrays):
+    salida without noise, drift and filters, over the whole in1 range.
+    """
+    c  = np.arange(-8192, 8192, 8, dtype=np.int64)[:,None]
+    pi = sat(wrap(regs['peak_pos'] + wrap((c*regs['sg_width'])>>13,14), 15))
+    y  = wrap((pico[np.minimum(np.abs(pi),2047)]*regs['sg_amp'])>>13, 14)
+    y  = sat(y + wrap((c*regs['sg_base'])>>14, 14))
+    return (y.max(axis=0) + y.min(axis=0)) // 2
+
+
+def lock_events(err,hold,lock_band,loss_band,state):
+    """
+    Lock detector over a block of errors (clocks x lanes), vectorized along
+    the clocks. state has the counters carried between blocks (run_in,
+    run_out, locked) and is updated.
+    Returns (locked mask, acquisition offset or -1, losses, first loss offset or -1).
+    """
+    n,m  = err.shape
+    t    = np.arange(1, n+1)[:,None]
+    a    = np.abs(err)
+    runs = []
+    for inside,run0 in ((a<=lock_band, state['run_in']), (a>loss_band, state['run_out'])):
+        # clocks since the last sample out of the condition, plus the carried run
+        last = np.maximum.accumulate(np.where(inside, 0, t), axis=0)
+        run  = np.where(last==0, run0+t, t-last)
+        runs.append(run)
+    on   = runs[0]==hold
+    off  = runs[1]==hold
+    # the state is the one set by the last event (they never coincide)
+    t_on  = np.maximum.accumulate(np.where(on,  t, 0), axis=0)
+    t_off = np.maximum.accumulate(np.where(off, t, 0), axis=0)
+    locked = np.where(t_on>t_off, True, np.where(t_off>t_on, False, state['locked'][None,:]))
+    prev   = np.vstack([state['locked'][None,:], locked[:-1]])
+    lost   = off & prev
+    acq    = np.where(on.any(axis=0), on.argmax(axis=0), -1)
+    first  = np.where(lost.any(axis=0), lost.argmax(axis=0), -1)
+    state['run_in'], state['run_out'], state['locked'] = runs[0][-1], runs[1][-1], locked[-1]
+    return locked, acq, lost.sum(axis=0), first
+
+
+class lock_lanes():
+    """
+    M closed loops (PID + dummy core), one for each lane.
+
+    Usage:
+        L = lock_lanes({'pidA_kp':[0,500], 'pidA_ki':[100,100]}, fixed={'drift_time':6})
+        L.run(2**16)
+        L.results()           # Dict of arrays, result_names
+
+    Params:
+        design    : Dict of arrays (one value for each lane) of dummy and
+                    PID registers
+        fixed     : values common to every lane (lock_default by default)
+        delay     : clocks from pid_out to in1, besides the registers
+        hold      : clocks that decide a lock or a lock loss
+        lock_band : |error| for a lock
+        loss_band : |error| for a lock loss
+        block     : clocks x lanes of the drift, noise and error blocks
+    """
+
+    def __init__(self,design,fixed=None,delay=0,hold=1000,lock_band=200,loss_band=1000,
+                 block=2**20,pico=None,icdf=None):
+        self.pico  = np.array(load_table('pico_data.dat') if pico is None else pico, dtype=np.int64)
+        self.icdf  = icdf_table() if icdf is None else np.array(icdf, dtype=np.int32)
+        m = len(next(iter(design.values()))) if design else 1
+        r = dict(lock_default, **pid_default)
+        r.update(fixed or {})
+        r.update(design)
+        self.m    = m
+        self.regs = { y:np.broadcast_to(np.asarray(v, dtype=np.int64), (m,)).copy()
+                      for y,v in r.items() if v is not None }
+        if r['pidA_sp'] is None:
+            self.regs['pidA_sp'] = half_max(self.regs, self.pico)
+        self.delay = delay
+        self.hold, self.lock_band, self.loss_band = hold, lock_band, loss_band
+        self.block = max(1, block//m)
+        self.reset()
+
+    def reset(self):
+        m = self.m
+        z = lambda : np.zeros(m, dtype=np.int64)
+        self.clk = 0
+        # dummy core
+        self.signal_in, self.lpf_sum, self.hpf_sum, self.hpf_last, self.pico_out = z(), z(), z(), z(), z()
+        self.rand, self.icdf_reg = xorshift128(), 0
+        # pid
+        self.error, self.kp_reg, self.ki_mult, self.int_reg = z(), z(), z(), z()
+        self.kd_reg, self.kd_reg_r, self.kd_reg_s, self.pid_out = z(), z(), z(), z()
+        self.dac = deque([ z() for i in range(self.delay) ])
+        # results
+        self.det   = { 'run_in':z(), 'run_out':z(), 'locked':np.zeros(m, dtype=bool) }
+        self.acq, self.first_loss = z()-1, z()-1
+        self.losses, self.nlock   = z(), z()
+        self.sq, self.ctrl_sum    = np.zeros(m), np.zeros(m)
+
+    def external(self,n):
+        """drift and noise for the next n clocks (clocks x lanes)"""
+        r   = self.regs
+        clk = self.clk + np.arange(n, dtype=np.int64)[:,None]
+        drift = drift_at(clk, r['drift_time'], r['drift_enable'])
+        rn, self.icdf_reg = rand_norm(self.rand.ww(n), self.icdf_reg, self.icdf)
+        noise = wrap((rn.astype(np.int64)[:,None]*r['noise_amp'])>>13, 14) * (r['noise_enable']!=0)
+        return drift, noise
+
+    def run(self,n):
+        for i in range(0,n,self.block):
+            self.run_block(min(self.block, n-i))
+        return self
+
+    def run_block(self,n):
+        r = self.regs
+        smax, smin = (1<<(S-1))-1, -(1<<(S-1))
+        peak_pos, sg_width, sg_amp, sg_base = r['peak_pos'], r['sg_width'], r['sg_amp'], r['sg_base']
+        lpf_sh, hpf_sh = 4 + r['lpf_val'], r['hpf_val']
+        lpf_on, hpf_on = r['lpf_on']!=0, r['hpf_on']!=0
+        any_lpf, any_hpf = lpf_on.any(), hpf_on.any()
+        sp, kp, ki, kd = r['pidA_sp'], r['pidA_kp'], r['pidA_ki'], r['pidA_kd']
+        psr, isr, dsr  = r['pidA_PSR'], r['pidA_ISR'], r['pidA_DSR']
+        pico = self.pico
+        drift, noise = self.external(n)
+        err  = np.empty((n,self.m), dtype=np.int64)
+        ctrl = np.empty((n,self.m), dtype=np.int64)
+        sig_in, lpf_sum, hpf_sum, hpf_last, pico_out = self.signal_in, self.lpf_sum, self.hpf_sum, self.hpf_last, self.pico_out
+        error, kp_reg, ki_mult, int_reg = self.error, self.kp_reg, self.ki_mult, self.int_reg
+        kd_reg, kd_reg_r, kd_reg_s, pid_out = self.kd_reg, self.kd_reg_r, self.kd_reg_s, self.pid_out
+        dac = self.dac
+
+        for t in range(n):
+            # dummy core (ref_model.dummy_ref, entrada=0)
+            signal_lpf = sig_in
+            if any_lpf:
+                lpf_div    = wrap(lpf_sum >> lpf_sh, 31)
+                signal_lpf = np.where(lpf_on, wrap(lpf_div,14), sig_in)
+                lpf_sum    = np.clip(sig_in - lpf_div + lpf_sum, smin, smax)
+            signal_hpf = signal_lpf
+            if any_hpf:
+                indiff     = signal_lpf - hpf_last
+                hpf_div    = wrap(hpf_sum >> hpf_sh, 31)
+                signal_hpf = np.where(hpf_on, wrap(hpf_div,14), signal_lpf)
+                hpf_sum    = np.clip(hpf_sum - hpf_div + wrap(indiff<<hpf_sh,31) - indiff, smin, smax)
+                hpf_last   = signal_lpf
+            pico_in = sat(wrap(peak_pos + wrap((signal_hpf*sg_width)>>13,14) + drift[t], 15))
+            salida  = sat(wrap((pico_out*sg_amp)>>13,14) + noise[t] + wrap((sg_base*sig_in)>>14,14))
+            pico_out = pico[np.minimum(np.abs(pico_in),2047)]
+            if dac:
+                dac.append(pid_out)
+                sig_in = dac.popleft()
+            else:
+                sig_in = pid_out
+            ctrl[t] = sig_in
+            # pid (red_pitaya_pid_block.v), input salida
+            pid_out  = sat(kp_reg + (int_reg >> isr) + kd_reg_s)
+            kd_reg_s = kd_reg - kd_reg_r
+            kd_reg_r = kd_reg
+            kd_reg   = (error*kd) >> dsr
+            int_reg  = np.clip(ki_mult + int_reg, -(1<<31), (1<<31)-1)
+            ki_mult  = error*ki
+            kp_reg   = (error*kp) >> psr
+            error    = sp - salida
+            err[t]   = error
+
+        self.signal_in, self.lpf_sum, self.hpf_sum, self.hpf_last, self.pico_out = sig_in, lpf_sum, hpf_sum, hpf_last, pico_out
+        self.error, self.kp_reg, self.ki_mult, self.int_reg = error, kp_reg, ki_mult, int_reg
+        self.kd_reg, self.kd_reg_r, self.kd_reg_s, self.pid_out = kd_reg, kd_reg_r, kd_reg_s, pid_out
+        self.reduce(err, ctrl)
+        self.clk += n
+
+    def reduce(self,err,ctrl):
+        locked, acq, losses, first = lock_events(err, self.hold, self.lock_band, self.loss_band, self.det)
+        self.acq        = np.where((self.acq<0) & (acq>=0), self.clk + acq - self.hold + 1, self.acq)
+        self.first_loss = np.where((self.first_loss<0) & (first>=0), self.clk + first, self.first_loss)
+        self.losses    += losses
+        self.nlock     += locked.sum(axis=0)
+        self.sq        += np.where(locked, err*err, 0).sum(axis=0)
+        self.ctrl_sum  += np.where(locked, ctrl, 0).sum(axis=0)
+        self.last_ctrl  = ctrl[-1]
+
+    def results(self):
+        n = np.maximum(self.nlock, 1)
+        return { 'acq'        : self.acq.copy(),
+                 'rms'        : np.where(self.nlock>0, np.sqrt(self.sq/n), np.nan),
+                 'losses'     : self.losses.copy(),
+                 'first_loss' : self.first_loss.copy(),
+                 'locked'     : self.nlock/max(self.clk,1),
+                 'ctrl'       : np.where(self.nlock>0, self.ctrl_sum/n, self.last_ctrl),
+                 'pidA_sp'    : self.regs['pidA_sp'].copy() }
+
+
+def run_lanes(design,n,kwargs):
+    return lock_lanes(design, **kwargs).run(n).results()
+
+
+def run_lock(design,n,fixed=None,workers=None,chunk=1024,verbose=False,**kwargs):
+    """
+    Runs n clocks of the closed loop for every point of design (Dict of
+    arrays of dummy and PID registers, as grid_design / random_design).
+
+    Params:
+        fixed   : register values common to all the points
+        workers : processes. 0 runs in this process
+        chunk   : lanes for each task
+        kwargs  : lock_lanes params (delay, hold, lock_band, loss_band, block)
+
+    Returns a Dict with an array for each result (result_names), the set
+    point used in each lane ('pidA_sp') and the design. The results do not
+    depend on chunk or workers.
+    """
+    names   = list(design)
+    npoints = len(design[names[0]]) if names else 1
+    kwargs  = dict(kwargs, fixed=fixed)
+    tasks   = [ { y:np.asarray(design[y])[i:i+chunk] for y in names } for i in range(0,npoints,chunk) ]
+    t0   = perf_counter()
+    done = 0
+    out  = []
+    if workers==0:
+        res = map(run_lanes, tasks, [n]*len(tasks), [kwargs]*len(tasks))
+        ex  = None
+    else:
+        ex  = ProcessPoolExecutor(workers)
+        res = ex.map(run_lanes, tasks, [n]*len(tasks), [kwargs]*len(tasks))
+    try:
+        for r in res:
+            out.append(r)
+            done += len(r['acq'])
+            if verbose:
+                eprint('{:d}/{:d} loops, {:.1f} s'.format(done, npoints, perf_counter()-t0))
+    finally:
+        if ex is not None:
+            ex.shutdown()
+    res = { y:np.concatenate([ r[y] for r in out ]) for y in result_names+('pidA_sp',) }
+    res['design'] = design
+    return res
+
+
+class pid_ref():
+    """Clock by clock model of red_pitaya_pid_block.v (one loop), to check lock_lanes"""
+
+    def __init__(self,sp=0,kp=0,ki=0,kd=0,PSR=12,ISR=18,DSR=10):
+        self.sp, self.kp, self.ki, self.kd = sp, kp, ki, kd
+        self.PSR, self.ISR, self.DSR = PSR, ISR, DSR
+        self.error = self.kp_reg = self.ki_mult = self.int_reg = 0
+        self.kd_reg = self.kd_reg_r = self.kd_reg_s = self.out = 0
+
+    def step(self,dat_i):
+        """One clock with the input dat_i. Returns dat_o before the clock edge"""
+        o = self.out
+        s = self.kp_reg + (self.int_reg >> self.ISR) + self.kd_reg_s
+        self.out      = 8191 if s>8191 else -8192 if s<-8192 else s
+        self.kd_reg_s = self.kd_reg - self.kd_reg_r
+        self.kd_reg_r = self.kd_reg
+        self.kd_reg   = (self.error*self.kd) >> self.DSR
+        i = self.ki_mult + self.int_reg
+        self.int_reg  = (1<<31)-1 if i>=(1<<31) else -(1<<31) if i<-(1<<31) else i
+        self.ki_mult  = self.error*self.ki
+        self.kp_reg   = (self.error*self.kp) >> self.PSR
+        self.error    = self.sp - dat_i
+        return o
+
+
+def check(n=3000,design=None,fixed=None,delay=0):
+    """
+    Runs the lanes of design for n clocks with lock_lanes and with dummy_ref
+    + pid_ref, clock by clock. Returns the number of lanes that differ.
+    """
+    design = design or { 'pidA_kp':[0,800,-300,4000], 'pidA_ki':[2000,300,1000,0],
+                         'pidA_kd':[0,0,500,2000],    'lpf_on':[0,1,1,0],
+                         'lpf_val':[0,3,1,0],         'hpf_on':[0,0,1,1],
+                         'hpf_val':[0,0,9,12],        'drift_time':[0,2,5,1],
+                         'sg_base':[0,500,-800,0] }
+    fixed = dict(fixed or {}, noise_amp=2000)
+    L  = lock_lanes(design, fixed=fixed, delay=delay, block=n*4)
+    m  = L.m
+    err = np.empty((m,n), dtype=np.int64)
+    L.reduce = lambda e,c: err.__setitem__(slice(None), e.T)
+    L.run(n)
+    bad = 0
+    for k in range(m):
+        regs = { y:int(v[k]) for y,v in L.regs.items() }
+        d = dummy_ref(pico=L.pico.tolist(), icdf=L.icdf.tolist())
+        d.set(regs)
+        p = pid_ref(*[ regs['pidA_'+y] for y in ('sp','kp','ki','kd','PSR','ISR','DSR') ])
+        dac = deque([0]*delay)
+        e   = []
+        for t in range(n):
+            dac.append(p.out)
+            salida = d.run(1, in1=dac.popleft())['salida'][0]
+            p.step(salida)
+            e.append(p.error)
+        if not np.array_equal(np.array(e), err[k]):
+            bad += 1
+    return bad
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--kp", type=str, dest='kp', default='0,10,40,160',
+                    help="pidA_kp values of the grid, comma separated")
+parser.add_argument("--ki", type=str, dest='ki', default='30,100,300,1000,3000',
+                    help="pidA_ki values of the grid")
+parser.add_argument("--kd", type=str, dest='kd', default='0',
+                    help="pidA_kd values of the grid")
+parser.add_argument("--sp", type=str, dest='sp', default=None,
+                    help="pidA_sp values of the grid. Default: half height of the peak")
+parser.add_argument("--set", type=str, dest='fixed', action='append', default=[],
+                    help="plant register common to every loop, name=value (can repeat)")
+parser.add_argument("-n", "--clocks", type=int, dest='clocks', default=2**17,
+                    help="clocks to simulate")
+parser.add_argument("--delay", type=int, dest='delay', default=0,
+                    help="extra clocks from pid_out to in1")
+parser.add_argument("--hold", type=int, dest='hold', default=1000,
+                    help="clocks that decide a lock or a lock loss")
+parser.add_argument("--lock-band", type=int, dest='lock_band', default=200,
+                    help="|error| for a lock")
+parser.add_argument("--loss-band", type=int, dest='loss_band', default=1000,
+                    help="|error| for a lock loss")
+parser.add_argument("-w", "--workers", type=int, dest='workers', default=None,
+                    help="worker processes. Default: one for each cpu")
+parser.add_argument("--chunk", type=int, dest='chunk', default=1024,
+                    help="loops for each task")
+parser.add_argument("--check", action="store_true", dest='check', default=False,
+                    help="check lock_lanes against dummy_ref + pid_ref and exit")
+parser.add_argument("-o", "--out", type=str, dest='out', default=None,
+                    help="output file (numpy npz)")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.check:
+        for delay in (0,3):
+            eprint('delay {:d}: {:d} lanes differ'.format(delay, check(delay=delay)))
+        sys.exit(0)
+    axes = { 'pidA_'+y:[ int(v) for v in getattr(args,y).split(',') ]
+             for y in ('kp','ki','kd','sp') if getattr(args,y) is not None }
+    d     = grid_design(**axes)
+    fixed = { y.split('=')[0]:int(y.split('=')[1]) for y in args.fixed }
+    t0    = perf_counter()
+    res   = run_lock(d, args.clocks, fixed=fixed, workers=args.workers, chunk=args.chunk,
+                     verbose=True, delay=args.delay, hold=args.hold,
+                     lock_band=args.lock_band, loss_band=args.loss_band)
+    dt    = perf_counter()-t0
+    npts  = len(res['acq'])
+    eprint('{:d} loops x {:d} clocks in {:.1f} s ({:.2e} loop clocks/s)'.format(
+           npts, args.clocks, dt, npts*args.clocks/dt))
+    print('{:>6s} {:>6s} {:>6s} {:>6s} {:>10s} {:>8s} {:>6s} {:>7s}'.format(
+          'kp','ki','kd','sp','acq','rms','losses','locked'))
+    for i in np.lexsort((res['rms'], res['acq']<0)):
+        print('{:6d} {:6d} {:6d} {:6d} {:10d} {:8.1f} {:6d} {:7.3f}'.format(
+              d['pidA_kp'][i], d['pidA_ki'][i], d['pidA_kd'][i], res['pidA_sp'][i],
+              res['acq'][i], res['rms'][i], res['losses'][i], res['locked'][i]))
+    if args.out:
+        np.savez(args.out, **{ y:res[y] for y in result_names }, pidA_sp=res['pidA_sp'],
+                 **{ 'reg_'+y:d[y] for y in d })
+        eprint('saved '+args.out)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Noise source of the dummy core: xorshift128 (rand_gen_uni.v) followed by the
+inverse CDF table (fun_icdf.v, icdf_data.dat).
+
+The generator is linear over GF(2), so one clock is a 128x128 bit matrix T
+and k clocks are T**k. That gives jumps to any clock offset, and lets many
+lanes, each one started at a different offset, run side by side with uint32
+vector operations.
+
+Usage:
+    g  = xorshift128()          # seed of rand_gen_uni.v
+    g.jump(10**9)               # state 1e9 clocks after reset
+    ww = g.ww(2**22)            # WW register for the next 2**22 clocks
+    rn, last = rand_norm(ww)    # fun_icdf output for those clocks
+    y  = noise_at(0, 2**20, noise_amp=4000)   # noise signal from reset
+
+@author: lolo
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    from .ref_model import load_table, rand_seed
+except (ImportError, ValueError):
+    from ref_model import load_table, rand_seed
+
+
+M32 = 0xFFFFFFFF
+
+
+@lru_cache(maxsize=None)
+def _table(filename,nbits):
+    t = np.array(load_table(filename,nbits), dtype=np.int32)
+    t.setflags(write=False)
+    return t
+
+
+def icdf_table(filename='icdf_data.dat'):
+    """Decoded fun_icdf table (1024 signed 14 bits values). Read once and cached"""
+    return _table(filename,14)
+
+
+def step(X,Y,Z,W):
+    """One clock of rand_gen_uni.v. Works on ints and on uint32 arrays"""
+    T = X ^ ((X << 11) & M32)
+    return Y, Z, W, (W ^ (W >> 19)) ^ (T ^ (T >> 8))
+
+
+def to_bits(words):
+    """(4,L) uint32 states -> (128,L) bits, X bit 0 first"""
+    w = np.asarray(words, dtype=np.uint32).reshape(4,1,-1)
+    return ((w >> np.arange(32, dtype=np.uint32)[None,:,None]) & 1).reshape(128,-1).astype(np.uint8)
+
+
+def from_bits(bits):
+    """(128,L) bits -> (4,L) uint32 states"""
+    b = np.asarray(bits, dtype=np.uint32).reshape(4,32,-1)
+    return (b << np.arange(32, dtype=np.uint32)[None,:,None]).sum(axis=1, dtype=np.uint32)
+
+
+def gf2_mul(A,B):
+    """Product of bit matrices over GF(2). Float matmul is exact for 128 terms"""
+    return (np.dot(A.astype(np.float64), B.astype(np.float64)) % 2).astype(np.uint8)
+
+
+_T_pows = []     # T**(2**i)
+
+
+def t_pow2(i):
+    if len(_T_pows)==0:
+        cols = step( *[ y for y in from_bits(np.eye(128, dtype=np.uint8)) ] )
+        _T_pows.append( to_bits(np.array(cols)) )
+    while len(_T_pows)<=i:
+        _T_pows.append( gf2_mul(_T_pows[-1],_T_pows[-1]) )
+    return _T_pows[i]
+
+
+@lru_cache(maxsize=64)
+def jump_matrix(k):
+    """Bit matrix that advances the generator k clocks (T**k)"""
+    J = np.eye(128, dtype=np.uint8)
+    for i in range(int(k).bit_length()):
+        if (k >> i) & 1:
+            J = gf2_mul(t_pow2(i), J)
+    J.setflags(write=False)
+    return J
+
+
+def jump(state,k):
+    """State k clocks after `state` (4 ints)"""
+    k = int(k)
+    v = to_bits(np.array(state, dtype=np.uint32).reshape(4,1))
+    for i in range(k.bit_length()):
+        if (k >> i) & 1:
+            v = gf2_mul(t_pow2(i), v)
+    return tuple( int(y) for y in from_bits(v)[:,0] )
+
+
+class xorshift128():
+    """
+    xorshift128 of rand_gen_uni.v, with jump ahead.
+
+    Usage:
+        g = xorshift128()              # or xorshift128(state=(X,Y,Z,W))
+        g.jump(k)                      # advances k clocks
+        ww = g.ww(n)                   # next n values of the WW register
+        g.state                        # (X,Y,Z,W)
+
+    Params:
+        state : initial (X,Y,Z,W). rand_gen_uni.v seed by default
+        lanes : max number of lanes for ww(). Each lane generates a
+                consecutive stretch of the output, started with a jump
+    """
+    seq_len = 2048    # below this, ww() steps the generator with python ints
+
+    def __init__(self,state=rand_seed,lanes=8192):
+        self.state = tuple( int(y) for y in state )
+        self.lanes = lanes
+
+    def jump(self,k):
+        self.state = jump(self.state, k)
+        return self
+
+    def ww(self,n):
+        """WW register for the next n clocks (uint32 array). First value is the current W"""
+        out = np.empty(n, dtype=np.uint32)
+        if n<self.seq_len:
+            X,Y,Z,W = self.state
+            for i in range(n):
+                out[i] = W
+                X,Y,Z,W = step(X,Y,Z,W)
+            self.state = (X,Y,Z,W)
+            return out
+        L = max(1, min(self.lanes, n//256))
+        m = -(-n//L)
+        # lanes start m clocks apart: apply T**(m*2**i) to the first 2**i lanes
+        S = to_bits(np.array(self.state, dtype=np.uint32).reshape(4,1))
+        i = 0
+        while S.shape[1]<L:
+            S = np.concatenate((S, gf2_mul(jump_matrix(m<<i),S)), axis=1)
+            i += 1
+        X,Y,Z,W = from_bits(S[:,:L])
+        # the final state is the one of lane jl at clock tl
+        jl,tl = divmod(n,m)
+        if tl==0:
+            jl,tl = jl-1,m
+        buf = np.empty((m,L), dtype=np.uint32)
+        for t in range(m):
+            buf[t] = W
+            T  = X ^ (X << 11)
+            T ^= T >> 8
+            X,Y,Z,W = Y, Z, W, W ^ (W >> 19) ^ T
+            if t+1==tl:
+                self.state = (int(X[jl]),int(Y[jl]),int(Z[jl]),int(W[jl]))
+        out[:] = buf.T.ravel()[:n]
+        return out
+
+
+def rand_norm(ww,icdf_reg=0,icdf=None):
+    """
+    fun_icdf output for the WW sequence ww. The table value is registered
+    (taken from the previous WW, icdf_reg for the first one) and the sign
+    comes from bit 31 of the current WW.
+    Returns (rand_norm int32 array, icdf_reg for the next clock).
+    """
+    icdf = icdf_table() if icdf is None else icdf
+    reg  = np.empty(len(ww), dtype=np.int32)
+    reg[0]  = icdf_reg
+    reg[1:] = icdf[(ww[:-1] >> 21) & 0x3FF]
+    neg = -reg
+    neg[neg==8192] = -8192      # wrap to 14 bits
+    return np.where(ww >> 31, neg, reg).astype(np.int32), int(icdf[(int(ww[-1]) >> 21) & 0x3FF])
+
+
+def noise_at(clk0,n,noise_amp=None,icdf=None):
+    """
+    rand_norm (or the noise signal, if noise_amp is given) for the clocks
+    clk0 .. clk0+n-1 after reset, with noise_enable always on. Calls with
+    disjoint stretches can run in different workers.
+    """
+    icdf = icdf_table() if icdf is None else icdf
+    if clk0>0:
+        ww  = xorshift128(jump(rand_seed, clk0-1)).ww(n+1)
+        reg = int(icdf[(int(ww[0]) >> 21) & 0x3FF])
+        ww  = ww[1:]
+    else:
+        ww  = xorshift128().ww(n)
+        reg = 0
+    rn,_ = rand_norm(ww, reg, icdf)
+    if noise_amp is None:
+        return rn
+    y = (rn.astype(np.int64)*noise_amp) >> 13
+    return (((y + 8192) & 0x3FFF) - 8192).astype(np.int32)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Clock by clock reference model of the dummy.v datapath.
+
+It follows the Verilog register by register, including the bus widths,
+truncations and saturations, so it can be used to check faster models.
+It is slow (pure python, one loop iteration for each clock).
+
+@author: lolo
+"""
+
+import os
+
+
+rtl_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..','..','dummy_simulator','fpga','rtl','dummy')
+
+
+def load_table(filename,nbits=14):
+    """
+    Reads a $readmemb file (one binary word for each line) and returns a list
+    of signed ints. Relative filenames are looked up in the rtl dir.
+    """
+    if not os.path.isabs(filename):
+        filename = os.path.join(rtl_dir,filename)
+    with open(filename,'r') as f:
+        vals = [ int(y.strip(),2) for y in f if len(y.strip())>0 ]
+    return [ wrap(y,nbits) for y in vals ]
+
+
+def wrap(val,nbits):
+    """Keeps the nbits LSB of val as a signed value"""
+    half = 1 << (nbits-1)
+    return ((val + half) & ((1<<nbits)-1)) - half
+
+
+def sat(val,nbits=14):
+    """Signed saturation to nbits"""
+    half = 1 << (nbits-1)
+    return half-1 if val>=half else -half if val<-half else val
+
+
+# Default register values (same names as hugo.dm regs)
+regs_default = {
+    'oscA_sw'     : 0,  'oscB_sw'     : 0,
+    'out1_sw'     : 0,  'out2_sw'     : 0,
+    'entrada'     : 0,
+    'lpf_on'      : 0,  'lpf_val'     : 0,
+    'hpf_on'      : 0,  'hpf_val'     : 0,
+    'peak_pos'    : 0,  'sg_amp'      : 0,
+    'sg_width'    : 0,  'sg_base'     : 0,
+    'noise_enable': 0,  'noise_amp'   : 0,
+    'drift_enable': 0,  'drift_time'  : 0,
+}
+
+# Signals available to the scope and output multiplexers, in muxer order
+oscA_sel = ['ramp','signal_in','in1','in2','signal_lpf','signal_hpf','val_fun','salida',
+            'rand_norm','noise','ramp','simul','drift','base']
+oscB_sel = ['simul','salida','in1','in2','signal_lpf','signal_hpf','val_fun','salida',
+            'rand_norm','noise','ramp','simul','drift','base']
+out_sel  = ['zero','salida','in1','in2','signal_lpf','signal_hpf','noise','ramp','simul']
+
+signal_names = ['in1','in2','signal_in','signal_lpf','signal_hpf','pico_in','pico_out',
+                'rand_norm','noise','val_fun','base','salida','ramp','drift','simul',
+                'out1','out2','oscA','oscB']
+
+rand_seed = (123456789, 362436069, 521288629, 88675123)
+
+S   = 58     # filters accumulator width
+M32 = 0xFFFFFFFF
+
+
+class dummy_ref():
+    """
+    Clock by clock model of dummy.v
+
+    Usage:
+        m = dummy_ref()
+        m.set(peak_pos=100, sg_amp=4000, sg_width=2000)
+        out = m.run(1000, in1=[...], in2=0, signals=['salida','oscA'])
+
+    run() returns a Dict with a list of values (one for each clock) for each
+    requested signal. in1 and in2 can be ints or sequences of length n.
+    The model state (filters, random generator, counters, registered muxers)
+    is kept between calls.
+    """
+    lpf_offset = 4
+    hpf_offset = 0
+
+    def __init__(self,pico=None,icdf=None):
+        self.pico = load_table('pico_data.dat') if pico is None else list(pico)
+        self.icdf = load_table('icdf_data.dat') if icdf is None else list(icdf)
+        self.regs = dict(regs_default)
+        self.reset()
+
+    def reset(self):
+        self.clk        = 0
+        self.signal_in  = 0
+        self.lpf_sum    = 0
+        self.hpf_sum    = 0
+        self.hpf_last   = 0
+        self.pico_out   = 0
+        self.simul_out  = 0
+        self.rand       = list(rand_seed)
+        self.icdf_reg   = 0
+        self.ramp       = 0
+        self.drift_o    = 0
+        self.drift_way  = 1
+        self.cnt        = 0
+        self.oscA       = 0
+        self.oscB       = 0
+
+    def set(self,values=None,**kwargs):
+        """Sets register values. Unknown names are ignored"""
+        for k,v in dict(values or {}, **kwargs).items():
+            if k in self.regs:
+                self.regs[k] = int(v)
+
+    def run(self,n,in1=0,in2=0,signals=('salida',)):
+        r = self.regs
+        entrada, lpf_on, hpf_on = r['entrada'], r['lpf_on'], r['hpf_on']
+        lpf_sh   = self.lpf_offset + r['lpf_val']
+        hpf_sh   = self.hpf_offset + r['hpf_val']
+        peak_pos, sg_amp, sg_width, sg_base = r['peak_pos'], r['sg_amp'], r['sg_width'], r['sg_base']
+        noise_enable, noise_amp = r['noise_enable'], r['noise_amp']
+        drift_enable, cnt_max   = r['drift_enable'], 1 << r['drift_time']
+        oscA_sw, oscB_sw        = r['oscA_sw'], r['oscB_sw']
+        out1_sw, out2_sw        = r['out1_sw'], r['out2_sw']
+        pico, icdf = self.pico, self.icdf
+        smax, smin = (1<<(S-1))-1, -(1<<(S-1))
+
+        in1_seq = hasattr(in1,'__len__')
+        in2_seq = hasattr(in2,'__len__')
+        out = { y:[] for y in signals }
+        X,Y,Z,W = self.rand
+
+        for i in range(n):
+            a = int(in1[i]) if in1_seq else in1
+            b = int(in2[i]) if in2_seq else in2
+            v = {}
+            v['in1'], v['in2'] = a, b
+            signal_in  = self.signal_in
+            # filters
+            lpf_div    = wrap(self.lpf_sum >> lpf_sh, 31)
+            signal_lpf = wrap(lpf_div,14) if lpf_on else signal_in
+            indiff     = signal_lpf - self.hpf_last
+            hpf_div    = wrap(self.hpf_sum >> hpf_sh, 31)
+            signal_hpf = wrap(hpf_div,14) if hpf_on else signal_lpf
+            # drift and ramp
+            drift      = wrap((self.drift_o>>1) - 4095, 14) if drift_enable else 0
+            ramp       = wrap(self.ramp,14)
+            # peak
+            pico_in    = sat(wrap(peak_pos + wrap((signal_hpf*sg_width)>>13,14) + drift, 15))
+            rand_norm  = wrap(-self.icdf_reg,14) if W>>31 else self.icdf_reg
+            noise      = wrap((rand_norm*noise_amp)>>13,14) if noise_enable else 0
+            val_fun    = wrap((self.pico_out*sg_amp)>>13,14)
+            base       = wrap((sg_base*signal_in)>>14,14)
+            salida     = sat(val_fun + noise + base)
+            simul_in   = sat(wrap(peak_pos + wrap((ramp*sg_width)>>13,14) + drift, 15))
+            val_simul  = wrap((self.simul_out*sg_amp)>>13,14)
+            simul      = sat(val_simul + noise + wrap((sg_base*ramp)>>14,14))
+
+            v.update(signal_in=signal_in, signal_lpf=signal_lpf, signal_hpf=signal_hpf,
+                     pico_in=pico_in, pico_out=self.pico_out, rand_norm=rand_norm,
+                     noise=noise, val_fun=val_fun, base=base, salida=salida,
+                     ramp=ramp, drift=drift, simul=simul, zero=0,
+                     oscA=self.oscA, oscB=self.oscB)
+            v['out1'] = v[out_sel[out1_sw]] if out1_sw<len(out_sel) else 0
+            v['out2'] = v[out_sel[out2_sw]] if out2_sw<len(out_sel) else 0
+            for y in signals:
+                out[y].append(v[y])
+
+            # registers update
+            self.signal_in = [a, b, sat(a+b), sat(a-b)][entrada] if entrada<4 else 0
+            sn = signal_in - lpf_div + self.lpf_sum
+            self.lpf_sum   = smax if sn>smax else smin if sn<smin else sn
+            sn = self.hpf_sum - hpf_div + wrap(indiff<<hpf_sh,31) - indiff
+            self.hpf_sum   = smax if sn>smax else smin if sn<smin else sn
+            self.hpf_last  = signal_lpf
+            self.pico_out  = pico[min(abs(pico_in),2047)]
+            self.simul_out = pico[min(abs(simul_in),2047)]
+            # fun_icdf compares 'in >= 11'b0' unsigned, so pos is the raw input
+            self.icdf_reg  = icdf[(W>>21) & 0x3FF]
+            if noise_enable:
+                T = (X ^ (X<<11)) & M32
+                X,Y,Z,W = Y, Z, W, (W ^ (W>>19)) ^ (T ^ (T>>8))
+            self.ramp = 0 if self.ramp==16383 else self.ramp+1
+            way = 0 if self.drift_o==16383 else 1 if self.drift_o==0 else self.drift_way
+            if not drift_enable:
+                self.drift_o = 0
+            elif self.cnt==0:
+                self.drift_o = (self.drift_o + (1 if self.drift_way else -1)) & 0x3FFF
+            self.drift_way = way
+            self.cnt  = 0 if self.cnt==cnt_max else (self.cnt+1) & 0xFFFF
+            self.oscA = v[oscA_sel[oscA_sw]] if oscA_sw<len(oscA_sel) else 0
+            self.oscB = v[oscB_sel[oscB_sw]] if oscB_sw<len(oscB_sel) else 0
+            self.clk += 1
+
+        self.rand = [X,Y,Z,W]
+        return out
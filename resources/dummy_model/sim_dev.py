@@ -0,0 +1,346 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Simulated Red Pitaya memory for the dummy app.
+
+Serves a regular file (or a file in /dev/shm, shared memory) with the same
+layout as /dev/mem for the dummy registers (0x40600000), the oscilloscope
+registers (0x40100000) and the scope buffers (0x40110000, 0x40120000).
+A simulation engine polls the registers and reacts to writes:
+
+  - dummy registers are kept at their bus width, as the FPGA does
+  - the pico memory window (0x40602000) holds the peak table of the model:
+    it starts with pico_data.dat and writes replace the model table
+  - read only taps (in1, in2, out1, out2, oscA, oscB, val_fun) are updated
+    from a software model of dummy.v, unless read_ctrl Freeze bit is set
+  - cnt_clk/cnt_clk2 count 125 MHz ticks of real time since start_clk was
+    set (on each poll, so with the poll period resolution), held by Freeze
+  - when TrgSrc is armed, the scope buffers are refilled with a simulated
+    acquisition (decimation, averaging, level triggers and TrgDelay), then
+    TrgWpt/CurWpt are set and TrgSrc goes back to 0
+
+The control input is an external scan (like a ramp from the device under
+test) on in1 and 0 on in2. It can be changed with the scan options or by
+setting sim_device.inputs.
+
+Usage, off-device:
+    python3 sim_dev.py --dev-file /dev/shm/hugo_mem &
+    export HUGO_DEV_FILE=/dev/shm/hugo_mem
+    ../../dummy_simulator/py/dummy.py peak_pos 100
+    ../../dummy_simulator/py/osc_trig.py -s now
+
+@author: lolo
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import mmap
+import struct
+import argparse
+from time import sleep,monotonic
+
+import numpy as np
+
+
+py_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','..','dummy_simulator','py')
+if py_dir not in sys.path:
+    sys.path.append(py_dir)
+
+from hugo import osc,dm,make_dev_file
+
+try:
+    from .ref_model import wrap
+    from .core import dummy_core
+except (ImportError, ValueError):
+    from ref_model import wrap
+    from core import dummy_core
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+CLK = 125e6
+
+
+def triangle_scan(amp=8000,period=2**17):
+    """
+    Returns an inputs(clk0,n) function with a triangle scan of +-amp and
+    `period` clocks on in1 and 0 on in2
+    """
+    half = period//2
+    def inputs(clk0,n):
+        p = np.arange(clk0,clk0+n, dtype=np.int64) % period
+        p = np.where(p<half, p, period-p)
+        return (-amp + 2*amp*p//half).astype(np.int32), 0
+    return inputs
+
+
+class sim_device():
+    """
+    Simulation engine behind a memory file.
+
+    Usage:
+        sim = sim_device('/dev/shm/hugo_mem')
+        sim.run()                 # polls forever
+        sim.poll()                # one iteration: registers, trigger, taps
+
+    Params:
+        dev_file    : memory file, created sparse if it does not exist
+        model       : model of dummy.v with set() and run(); dummy_core() by default
+        inputs      : function (clk0,n) -> (in1,in2)
+        tap_clocks  : clocks simulated on each poll to update the taps
+        max_clocks  : max clocks simulated for one acquisition. Decimations that
+                      need more are reduced, and a warning is printed
+    """
+    scope_signals = ('oscA','oscB')
+    tap_signals   = ('in1','in2','out1','out2','oscA','oscB','val_fun')
+
+    def __init__(self,dev_file,model=None,inputs=None,tap_clocks=64,max_clocks=2**22):
+        self.dev_file   = dev_file
+        self.model      = dummy_core() if model is None else model
+        self.inputs     = triangle_scan() if inputs is None else inputs
+        self.tap_clocks = tap_clocks
+        self.max_clocks = max_clocks
+        self.wpt        = 0
+        self.warned     = set()
+        make_dev_file(dev_file)
+        self.fd   = os.open(dev_file, os.O_RDWR)
+        self.dm   = mmap.mmap(self.fd, dm.size , offset=dm.base_addr )
+        self.osc  = mmap.mmap(self.fd, osc.size, offset=osc.base_addr)
+        self.chs  = [ mmap.mmap(self.fd, osc.ch_len*4, offset=y) for y in osc.ch_addr ]
+        self.last = None
+        self.clk_start = None
+        m = dm.mems['pico']
+        self.dm[m.offset:m.offset+4*m.depth] = np.asarray(self.model.pico, dtype='<i4').tobytes()
+        self.pico_last = None
+        self.load_pico()
+        self.reg_write(osc, 'Dec', 1)
+        self.reg_write(osc, 'TrgDelay', osc.ch_len//2)
+
+    def close(self):
+        for m in [self.dm,self.osc]+self.chs:
+            m.close()
+        os.close(self.fd)
+
+    def reg_read(self,bank,name):
+        r = bank[name]
+        return r.fmt.unpack_from(self.dm if bank is dm else self.osc, r.index*4)[0]
+
+    def reg_write(self,bank,name,value):
+        r = bank[name]
+        v = wrap(int(value), r.nbits) if r.signed else int(value) & ((1<<r.nbits)-1)
+        r.fmt.pack_into(self.dm if bank is dm else self.osc, r.index*4, v)
+        if bank is dm and self.last is not None:
+            # our own writes are not host writes: keep load_regs from seeing them
+            r.fmt.pack_into(self.last, r.index*4, v)
+
+    def load_pico(self):
+        """
+        Reads the pico memory window. When it changed, the words are truncated
+        to 14 bits (as the bus read back gives them) and the model takes the
+        new peak table.
+        """
+        m   = dm.mems['pico']
+        raw = bytes(self.dm[m.offset:m.offset+4*m.depth])
+        if raw==self.pico_last:
+            return False
+        vals = wrap(np.frombuffer(raw, dtype='<i4').astype(np.int64), m.nbits)
+        self.dm[m.offset:m.offset+4*m.depth] = vals.astype('<i4').tobytes()
+        self.model.pico = vals.tolist() if isinstance(self.model.pico, list) else vals.astype(np.int32)
+        self.pico_last = bytes(self.dm[m.offset:m.offset+4*m.depth])
+        return True
+
+    def load_regs(self):
+        """
+        Reads the dummy registers, truncates them to their bus width (as the
+        FPGA does) and passes the values to the model when something changed.
+        The peak table is checked first (load_pico).
+        """
+        self.load_pico()
+        raw = bytes(self.dm[:len(dm.regs)*4])
+        if raw==self.last:
+            return False
+        # snapshot before the model runs: a host write after it is seen in the next poll
+        self.last = bytearray(raw)
+        vals = {}
+        for r in dm.regs:
+            v = self.reg_read(dm, r.name)
+            n = wrap(v, r.nbits) if r.signed else v & ((1<<r.nbits)-1)
+            if n!=v:
+                self.reg_write(dm, r.name, n)
+            vals[r.name] = n
+        self.model.set(vals)
+        return True
+
+    def simulate(self,n,signals):
+        out = {}
+        clk = self.model.clk
+        while n>0:
+            m = min(n, 1<<16)
+            in1,in2 = self.inputs(clk, m)
+            res = self.model.run(m, in1, in2, signals=signals)
+            for y in signals:
+                out.setdefault(y,[]).append(np.asarray(res[y], dtype=np.int32))
+            clk += m
+            n   -= m
+        return { y:np.concatenate(out[y]) for y in out }
+
+    def update_clock(self):
+        """Sample clock: ticks since start_clk, both halves in one write"""
+        ctrl = self.reg_read(dm,'read_ctrl')
+        if not ctrl & 2:
+            self.clk_start = None
+        elif self.clk_start is None:
+            self.clk_start = monotonic()
+        if ctrl & 1:
+            return
+        tick = 0 if self.clk_start is None else int((monotonic()-self.clk_start)*CLK)
+        # one slice copy: pack_into clears the bytes before packing, and a
+        # reader could see the zeros
+        i = dm['cnt_clk'].index*4
+        self.dm[i:i+8] = struct.pack('<Q', tick)
+        if self.last is not None:
+            self.last[i:i+8] = self.dm[i:i+8]
+
+    def update_taps(self):
+        if self.reg_read(dm,'read_ctrl') & 1:
+            return
+        res = self.simulate(self.tap_clocks, self.tap_signals)
+        for y in self.tap_signals:
+            self.reg_write(dm, y, int(res[y][-1]))
+
+    def decimation(self):
+        dec = max(1, self.reg_read(osc,'Dec'))
+        if osc.ch_len*2*dec > self.max_clocks:
+            red = max(1, self.max_clocks//(osc.ch_len*2))
+            if dec not in self.warned:
+                eprint('sim_dev: Dec={:d} needs too many clocks, using Dec={:d}'.format(dec,red))
+                self.warned.add(dec)
+            dec = red
+        return dec
+
+    def acquire(self,dec,num):
+        """Simulates num scope samples at decimation dec. Returns (chA,chB)"""
+        res = self.simulate(num*dec, self.scope_signals)
+        chA, chB = res['oscA'], res['oscB']
+        if dec==1:
+            return chA, chB
+        avg = self.reg_read(osc,'AvgEn') & 1
+        if avg and dec in (8,64,1024,8192,65536):
+            sh = dec.bit_length()-1
+            return ( wrap(chA.reshape(-1,dec).sum(axis=1, dtype=np.int64)>>sh, 14),
+                     wrap(chB.reshape(-1,dec).sum(axis=1, dtype=np.int64)>>sh, 14) )
+        return chA[dec-1::dec], chB[dec-1::dec]
+
+    def find_trigger(self,src,chA,chB,start):
+        """Index of the first trigger event in the samples, or None"""
+        if src in (1,6,7,8,9):    # manual, and external/ASG (not simulated): fire now
+            return start
+        ch  = chA if src in (2,3) else chB
+        th  = wrap(self.reg_read(osc, 'ChAth' if src in (2,3) else 'ChBth'), 14)
+        hys = self.reg_read(osc, 'ChAHys' if src in (2,3) else 'ChBHys')
+        ch = ch[start:]
+        if src in (2,4):      # rising: armed below th-hys, fires at th
+            arm, fire = ch<th-hys, ch>=th
+        else:
+            arm, fire = ch>th+hys, ch<=th
+        i = np.flatnonzero(arm)
+        if len(i)==0:
+            return None
+        j = np.flatnonzero(fire[i[0]+1:])
+        return start+i[0]+1+j[0] if len(j)>0 else None
+
+    def trigger(self,src):
+        """
+        Simulated acquisition. Fills the buffers with ch_len samples around the
+        trigger event, TrgDelay samples after it. As in the FPGA, the trigger
+        is accepted once the pre-trigger samples are in the buffer.
+        Returns False if a level trigger did not happen within max_clocks.
+        """
+        n     = osc.ch_len
+        dec   = self.decimation()
+        post  = min(self.reg_read(osc,'TrgDelay'), n)
+        chA,chB = self.acquire(dec, n)
+        trg     = self.find_trigger(src, chA, chB, n-post)
+        clocks  = n*dec
+        while trg is None and clocks<self.max_clocks:
+            a2,b2 = self.acquire(dec, n)
+            clocks  += n*dec
+            chA, chB = np.concatenate((chA[-n:],a2)), np.concatenate((chB[-n:],b2))
+            trg      = self.find_trigger(src, chA, chB, n)
+        if trg is None:
+            return False
+        if trg+post>len(chA):
+            a2,b2 = self.acquire(dec, trg+post-len(chA))
+            chA, chB = np.concatenate((chA,a2)), np.concatenate((chB,b2))
+        chA, chB = chA[trg+post-n:trg+post], chB[trg+post-n:trg+post]
+        start = (self.wpt+1) % n
+        for ch,buf in zip((chA,chB),self.chs):
+            buf[:] = (np.roll(ch,start) & 0x3FFF).astype('<u4').tobytes()
+        self.wpt = (start+n-1) % n
+        self.reg_write(osc,'TrgWpt', (start+n-post) % n)
+        self.reg_write(osc,'CurWpt', self.wpt)
+        return True
+
+    def poll(self):
+        self.load_regs()
+        conf = self.reg_read(osc,'conf')
+        if conf & 2:                        # reset, self clearing
+            conf = 0
+            self.reg_write(osc,'conf', conf)
+        src = self.reg_read(osc,'TrgSrc')
+        if src>0:
+            # conf bit 2 (trigger status) stays set until the next reset
+            self.reg_write(osc,'conf', conf | 4)
+            if self.trigger(src):
+                self.reg_write(osc,'TrgSrc', 0)
+        self.update_taps()
+        self.update_clock()
+
+    def run(self,period=1e-3,killer=None):
+        """Polls every `period` seconds until killer.kill_now"""
+        while killer is None or not killer.kill_now:
+            t0 = monotonic()
+            self.poll()
+            dt = period-(monotonic()-t0)
+            if dt>0:
+                sleep(dt)
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("--dev-file", type=str, dest='dev_file', default='/dev/shm/hugo_mem',
+                    help="memory file to serve. Created if it does not exist")
+parser.add_argument("--period", type=float, default=1e-3,
+                    help="poll period in seconds")
+parser.add_argument("--scan-amp", type=int, dest='scan_amp', default=8000,
+                    help="amplitude of the triangle scan on in1")
+parser.add_argument("--scan-period", type=int, dest='scan_period', default=2**17,
+                    help="period of the triangle scan on in1, in clocks")
+parser.add_argument("--max-clocks", type=int, dest='max_clocks', default=2**22,
+                    help="max clocks simulated for each acquisition")
+
+
+if __name__ == '__main__':
+    import signal
+
+    class GracefulKiller:
+        kill_now = False
+        def __init__(self):
+            signal.signal(signal.SIGINT, self.exit_gracefully)
+            signal.signal(signal.SIGTERM, self.exit_gracefully)
+        def exit_gracefully(self,signum, frame):
+            self.kill_now = True
+
+    args = parser.parse_args()
+    sim  = sim_device(args.dev_file, inputs=triangle_scan(args.scan_amp,args.scan_period),
+                      max_clocks=args.max_clocks)
+    eprint('serving '+args.dev_file)
+    eprint('export HUGO_DEV_FILE='+args.dev_file)
+    try:
+        sim.run(args.period, GracefulKiller())
+    finally:
+        sim.close()
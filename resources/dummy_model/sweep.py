@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps of the simulated peak response.
+
+Each point of a design (a set of register values) runs dummy_core with the
+same control waveform on in1, and the response (salida by default) is
+reduced on the fly to a profile (mean response for each control bin) and to
+summary metrics:
+
+    center : control value at the top of the peak
+    fwhm   : full width at half maximum, in control units
+    slope  : response/control slope at the lock point (left half maximum)
+    height : peak height over the baseline (signed)
+    snr    : |height| / rms of the response around the profile
+
+The points are evaluated in a process pool and the results are written in
+shared memory arrays, so the workers only get the point indexes.
+
+Usage:
+    d = grid_design(peak_pos=[-200,0,200], sg_width=[1000,2000,4000])
+    d = random_design(10000, seed=1, peak_pos=(-500,500), noise_amp=(0,2000))
+    res = run_sweep(d, triangle(2**16), fixed={'sg_amp':6000,'noise_enable':1,'lpf_on':1,'hpf_on':1})
+    res['center'], res['fwhm'], res['profile'], res['x']
+
+    python3 sweep.py --points 10000 --workers 8 --out sweep.npz
+
+@author: lolo
+"""
+
+from __future__ import print_function
+
+import sys
+import argparse
+import itertools
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    from .core import dummy_core
+    from .ref_model import regs_default
+except (ImportError, ValueError):
+    from core import dummy_core
+    from ref_model import regs_default
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+metric_names = ('center','fwhm','slope','height','snr')
+
+# Registers usually swept, with the ranges used by random_design() by default.
+# lpf_val and hpf_val only act with lpf_on / hpf_on set (see cli_fixed)
+default_ranges = {
+    'peak_pos'  : (-2000, 2000),
+    'sg_width'  : (500, 8191),
+    'sg_amp'    : (1000, 8191),
+    'sg_base'   : (-2000, 2000),
+    'lpf_val'   : (0, 15),
+    'hpf_val'   : (0, 15),
+    'noise_amp' : (0, 4000),
+}
+
+# Registers fixed by the command line sweep
+cli_fixed = { 'noise_enable':1, 'lpf_on':1, 'hpf_on':1 }
+
+
+def bypassed(names,fixed=None):
+    """Names of the *_val registers in names whose filter is off (*_on 0, not swept)"""
+    fixed = dict(regs_default, **(fixed or {}))
+    return [ y for y in names if y.endswith('_val') and y[:-4]+'_on' in fixed
+             and y[:-4]+'_on' not in names and fixed[y[:-4]+'_on']==0 ]
+
+
+def triangle(n,amp=8000):
+    """One period of a triangle scan of +-amp, n samples"""
+    half = n//2
+    p = np.arange(n)
+    p = np.where(p<half, p, n-p)
+    return (-amp + 2*amp*p//half).astype(np.int32)
+
+
+def grid_design(**axes):
+    """All the combinations of the values given for each register. Returns a Dict of arrays"""
+    names = list(axes)
+    vals  = np.array(list(itertools.product(*[ axes[y] for y in names ])), dtype=np.int64)
+    return { y:vals[:,i] for i,y in enumerate(names) }
+
+
+def random_design(n,seed=0,fixed=None,**ranges):
+    """
+    n random points, uniform in the (lo,hi) range (inclusive) of each register.
+    Uses default_ranges if no range is given. Returns a Dict of arrays.
+    fixed: the registers that run_sweep will fix, to warn about filter
+           values swept with the filter off
+    """
+    rng = np.random.default_rng(seed)
+    ranges = ranges or default_ranges
+    for y in bypassed(ranges, fixed):
+        eprint('random_design: {:s} is swept but {:s} is 0, it has no effect'.format(y, y[:-4]+'_on'))
+    return { y:rng.integers(lo, hi+1, n) for y,(lo,hi) in ranges.items() }
+
+
+def peak_metrics(x,p):
+    """
+    Metrics of the profile p (response for each control value x).
+    Returns a Dict with center, fwhm, slope and height.
+    """
+    ok  = ~np.isnan(p)
+    x,p = x[ok], p[ok]
+    med = np.median(p)
+    sgn = 1 if p.max()-med >= med-p.min() else -1
+    q   = sgn*p
+    k   = int(q.argmax())
+    bot = q.min()
+    half = (q[k]+bot)/2
+    out = { 'center': x[k], 'height': sgn*(q[k]-bot), 'fwhm': np.nan, 'slope': np.nan }
+    if q[k]==bot:
+        return out
+    if 0<k<len(q)-1 and q[k-1]-2*q[k]+q[k+1]<0:     # parabola through the top bins
+        out['center'] += 0.5*(q[k-1]-q[k+1])/(q[k-1]-2*q[k]+q[k+1]) * (x[k+1]-x[k-1])/2
+    below = np.flatnonzero(q[:k]<half)
+    if len(below)>0:
+        j  = below[-1]
+        dq = q[j+1]-q[j]
+        xl = x[j] + (half-q[j])/dq*(x[j+1]-x[j])
+        out['slope'] = sgn*dq/(x[j+1]-x[j])
+    else:
+        xl = x[0]
+    below = np.flatnonzero(q[k:]<half)
+    if len(below)>0:
+        j  = k+below[0]
+        xr = x[j-1] + (q[j-1]-half)/(q[j-1]-q[j])*(x[j]-x[j-1])
+    else:
+        xr = x[-1]
+    out['fwhm'] = xr-xl
+    return out
+
+
+def binning(control,nbins):
+    """Bin of each control sample, and the bin centres"""
+    c  = np.asarray(control, dtype=np.int64)
+    lo = int(c.min())
+    w  = int(c.max())-lo+1
+    nbins = min(nbins, w)
+    b  = (c-lo)*nbins//w
+    return b, lo + (np.arange(nbins)+0.5)*w/nbins
+
+
+# Worker state, set by init_worker()
+_ctx = {}
+
+
+def init_worker(control,fixed,warmup,signal,nbins,shm_names,npoints):
+    b, x = binning(control, nbins)
+    shm  = [ shared_memory.SharedMemory(name=y) for y in shm_names ]
+    _ctx.update(control=np.asarray(control, dtype=np.int32), fixed=fixed, warmup=warmup,
+                signal=signal, bins=b, x=x, counts=np.bincount(b, minlength=len(x)), shm=shm,
+                metrics=np.ndarray((npoints,len(metric_names)), dtype=np.float64, buffer=shm[0].buf),
+                profile=np.ndarray((npoints,len(x)), dtype=np.float64, buffer=shm[1].buf))
+
+
+def run_points(idx,points):
+    """Evaluates the points (list of Dicts) and stores the results in rows idx"""
+    c = _ctx
+    for i,pt in zip(idx,points):
+        m = dummy_core()
+        m.set(c['fixed'])
+        m.set(pt)
+        if c['warmup']>0:
+            m.run(c['warmup'], in1=int(c['control'][0]), signals=())
+        y = m.run(len(c['control']), in1=c['control'], signals=(c['signal'],))[c['signal']]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            p   = np.bincount(c['bins'], weights=y, minlength=len(c['x'])) / c['counts']
+            met = peak_metrics(c['x'], p)
+            rms = np.sqrt(np.mean((y-p[c['bins']])**2))
+            met['snr'] = abs(met['height'])/rms if rms>0 else np.inf
+        c['metrics'][i] = [ met[y] for y in metric_names ]
+        c['profile'][i] = p
+    return len(idx)
+
+
+def run_sweep(design,control,fixed=None,signal='salida',warmup=2**14,nbins=256,
+              workers=None,chunk=16,verbose=False):
+    """
+    Evaluates every point of design (Dict of arrays of register values) with
+    the control waveform on in1.
+
+    Params:
+        fixed   : register values common to all the points
+        signal  : response signal (ref_model.signal_names)
+        warmup  : clocks run with the first control value before the waveform,
+                  so the filters start settled
+        nbins   : bins of the response profile
+        workers : processes. 0 runs in this process
+        chunk   : points for each task
+
+    Returns a Dict with an array for each metric (metric_names), 'profile'
+    (points x bins), 'x' (bin centres) and the design.
+    """
+    names   = list(design)
+    npoints = len(design[names[0]]) if names else 0
+    fixed   = dict(fixed or {})
+    x       = binning(control, nbins)[1]
+    sizes   = [ npoints*len(metric_names)*8, npoints*len(x)*8 ]
+    shm     = [ shared_memory.SharedMemory(create=True, size=max(1,y)) for y in sizes ]
+    args    = (control, fixed, warmup, signal, nbins, [ y.name for y in shm ], npoints)
+    tasks   = []
+    for i in range(0,npoints,chunk):
+        idx = list(range(i,min(i+chunk,npoints)))
+        tasks.append(( idx, [ { y:int(design[y][k]) for y in names } for k in idx ] ))
+    try:
+        t0 = perf_counter()
+        done = 0
+        if workers==0:
+            init_worker(*args)
+            for t in tasks:
+                done += run_points(*t)
+        else:
+            with ProcessPoolExecutor(workers, initializer=init_worker, initargs=args) as ex:
+                for k in ex.map(run_points, *zip(*tasks)):
+                    done += k
+                    if verbose:
+                        eprint('{:d}/{:d} points, {:.1f} s'.format(done, npoints, perf_counter()-t0))
+        metrics = np.ndarray((npoints,len(metric_names)), dtype=np.float64, buffer=shm[0].buf).copy()
+        profile = np.ndarray((npoints,len(x)), dtype=np.float64, buffer=shm[1].buf).copy()
+    finally:
+        _ctx.clear()
+        for y in shm:
+            y.close()
+            y.unlink()
+    out = { y:metrics[:,i] for i,y in enumerate(metric_names) }
+    out.update(profile=profile, x=x, design=design)
+    return out
+
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-n", "--points", type=int, dest='points', default=1000,
+                    help="points of the random design (default_ranges)")
+parser.add_argument("-w", "--workers", type=int, dest='workers', default=None,
+                    help="worker processes. Default: one for each cpu")
+parser.add_argument("--samples", type=int, dest='samples', default=2**16,
+                    help="samples of the triangle control waveform")
+parser.add_argument("--amp", type=int, dest='amp', default=8000,
+                    help="amplitude of the control waveform")
+parser.add_argument("--seed", type=int, dest='seed', default=0,
+                    help="seed of the random design")
+parser.add_argument("-o", "--out", type=str, dest='out', default='sweep.npz',
+                    help="output file (numpy npz)")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    d    = random_design(args.points, seed=args.seed, fixed=cli_fixed)
+    t0   = perf_counter()
+    res  = run_sweep(d, triangle(args.samples, args.amp), fixed=cli_fixed,
+                     workers=args.workers, verbose=True)
+    eprint('{:d} points in {:.1f} s'.format(args.points, perf_counter()-t0))
+    np.savez(args.out, x=res['x'], profile=res['profile'],
+             **{ y:res[y] for y in metric_names }, **{ 'reg_'+y:d[y] for y in d })
+    eprint('saved '+args.out)
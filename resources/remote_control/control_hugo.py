@@ -135,20 +135,27 @@ class red_pitaya_control():
         
         osc.get_data()    # Returns a Dict with all the regs and values loeaded
     
+    With client (a hugo_client connected to hugo_server.py) and bank ('osc' or
+    'dummy'), load/get/set go through the open connection of the register
+    server instead of a new ssh command each time:
+    osc = red_pitaya_control(name='osc', parent=self, client=hugo_client(port=6001), bank='osc')
+    
     """
 
-    def __init__(self,name,parent,cmd=''):
+    def __init__(self,name,parent,cmd='',client=None,bank=None):
         self.cmd            = cmd
         self.parent         = parent
         self.keys           = []
         self.data           = {}
         self.name           = name
+        self.client         = client
+        self.bank           = bank
         #self.upload_changes = True
         
     def __setattr__(self, name, value):
         #if self.__dict__.get("_locked") and name == "x":
         #    raise AttributeError("MyClass does not allow assignment to .x member")
-        if name in ['cmd' , 'parent' , 'keys', 'data' , 'name']:
+        if name in ['cmd' , 'parent' , 'keys', 'data' , 'name', 'client', 'bank']:
             self.__dict__[name] = value
         elif name in self.keys :
             self.set(name,value)
@@ -165,9 +172,13 @@ class red_pitaya_control():
         """
         Loads all the avaible keys values for the memory slot of red_pitaya_control
         """
-        self.parent.log('rp.'+self.name+'.load(): '+self.cmd )
-        for rta in self.parent.ssh_cmd(self.cmd).strip().split('\n'):
-            self.data[ rta.strip().split(':')[0].strip() ] = int(rta.strip().split(':')[1].strip())
+        if self.client is not None:
+            self.parent.log('rp.'+self.name+'.load(): hugo_client snapshot '+self.bank )
+            self.data.update( self.client.snapshot(self.bank) )
+        else:
+            self.parent.log('rp.'+self.name+'.load(): '+self.cmd )
+            for rta in self.parent.ssh_cmd(self.cmd).strip().split('\n'):
+                self.data[ rta.strip().split(':')[0].strip() ] = int(rta.strip().split(':')[1].strip())
         self.keys  = list(self.data.keys())
         #self.upload_changes = False
         for i in self.keys:
@@ -189,6 +200,11 @@ class red_pitaya_control():
         If par is in self.keys , it load from RP the 'par' reg and returns it value.
         """
         if par in self.keys:
+            if self.client is not None:
+                self.parent.log('rp.'+self.name+'.get(par='+par+'): hugo_client' )
+                self.data.update( self.client.get(par) )
+                self.__dict__[par] = self.data[par]
+                return self.data[par]
             self.parent.log('rp.'+self.name+'.get(par='+par+'): '+self.cmd+' '+par )
             result = self.parent.ssh_cmd(self.cmd+' '+par)
             for rta in result.strip().split('\n'):
@@ -207,6 +223,12 @@ class red_pitaya_control():
         Sets in RP the reg 'par' to value val
         """
         if par in self.keys:
+            if self.client is not None:
+                self.parent.log('rp.'+self.name+'.set(par='+par+',val='+str(val)+'): hugo_client' )
+                self.data.update( self.client.set({par:val}) )
+                self.__dict__[par] = self.data[par]
+                print(self.name+'.set('+par+','+str(val)+')')
+                return self.data[par]
             self.parent.log('rp.'+self.name+'.set(par='+par+',val='+str(val)+'): '+self.cmd+' '+par+' '+str(val) )
             result = self.parent.ssh_cmd(self.cmd+' '+par+' '+str(val))
             for rta in result.stdout.decode().strip().split('\n'):
@@ -234,6 +256,11 @@ class red_pitaya_app():
     This creates the rp object associated to RP 'rp-f01d89.local' , connecting through port 22
     and will save any data to the file '/home/user/experience01.npz'.
     
+    With hugo=hugo_client(...) the registers are read and set through the resident register
+    server (dummy_simulator/py/hugo_server.py), reached through an ssh tunnel:
+        ssh -N -L 6001:127.0.0.1:6001 root@rp-f01d89.local &
+        rp=red_pitaya_app('dummy_simulator','rp-f01d89.local',hugo=hugo_client(port=6001))
+    
     Usage:
         
         rp.log('msj')          # Logging messages you want to keep    
@@ -259,10 +286,13 @@ class red_pitaya_app():
         
         rp.stop_streaming()    # Stops a long time length streaming
         
+        rp.pull_segments()     # Copies to localhost the segments of a recording
+                               # made on RP with data_dump.py --record
+        
     """
     
 
-    def __init__(self,AppName,host,port=22,password='',user='root',key_path='',filename=None):
+    def __init__(self,AppName,host,port=22,password='',user='root',key_path='',filename=None,hugo=None):
         self.filename       = filename
         self.AppName        = AppName
         self.host           = host
@@ -284,8 +314,11 @@ class red_pitaya_app():
         self.today          = datetime.now().strftime("%Y%m%d")
         self.log_db     = []
         self.data       = []
-        self.osc        = red_pitaya_control(cmd='/opt/redpitaya/www/apps/'+ self.AppName +'/py/osc.py' ,name='osc' ,parent=self)
-        self.app        = red_pitaya_control(cmd='/opt/redpitaya/www/apps/'+ self.AppName +'/py/dummy.py',name=AppName,parent=self)
+        self.hugo       = hugo
+        self.osc        = red_pitaya_control(cmd='/opt/redpitaya/www/apps/'+ self.AppName +'/py/osc.py' ,name='osc' ,parent=self,
+                                             client=hugo, bank='osc')
+        self.app        = red_pitaya_control(cmd='/opt/redpitaya/www/apps/'+ self.AppName +'/py/dummy.py',name=AppName,parent=self,
+                                             client=hugo, bank='dummy')
         self.oscA_sw    = [ 'ch'+str(y) for y in range(32) ]
         self.oscB_sw    = [ 'ch'+str(y) for y in range(32) ]
         self.newfig     = True
@@ -566,6 +599,75 @@ class red_pitaya_app():
                            'log': log
                             }
                            ] )
+    def segments_index(self,remote_dir='/tmp/rec'):
+        """
+        Reads the index of a recording made with data_dump.py --record
+
+        Returns a list of Dicts with keys seq, slot, records, t_first, t_last
+        sorted by seq, and a Dict with the recording layout (head_size,
+        record_size, seg_records, segments)
+        """
+        txt = self.ssh_cmd('cat '+remote_dir+'/index.txt')
+        layout = {}
+        segs   = []
+        for line in txt.strip().split('\n'):
+            if line.startswith('# head_size'):
+                vv=line[2:].split(' ')
+                layout={ vv[i]:int(vv[i+1]) for i in range(0,len(vv),2) }
+            elif len(line)>0 and not line.startswith('#'):
+                seq,slot,records,t_first,t_last = line.split(',')
+                segs.append({ 'seq': int(seq), 'slot': int(slot), 'records': int(records),
+                              't_first': float(t_first), 't_last': float(t_last) })
+        return sorted(segs, key=lambda x: x['seq']), layout
+
+    def pull_segments(self,remote_dir='/tmp/rec',local_dir=None,t_start=None,t_end=None):
+        """
+        Copies to localhost the segments of a recording made on RP with
+        data_dump.py --record . Only the segments that overlap the time
+        range [t_start,t_end] (unix timestamps, None means open) are copied,
+        and each one is trimmed to its recorded length.
+
+        Usage:
+            self.pull_segments(remote_dir='/tmp/rec',local_dir=None,t_start=None,t_end=None)
+
+        Each local file is a regular .bin dump, readable with read_dump().
+        Returns the list of local filenames.
+
+        Example:
+            files = rp.pull_segments('/tmp/rec', t_start=time.time()-3600)
+            d = read_dump(files[-1])
+        """
+        local_dir = self.dir if local_dir is None else local_dir
+        segs, layout = self.segments_index(remote_dir)
+        if not self.ssh_connect():
+            raise SSHError('Could not connect trought ssh')
+        sftp  = self.ssh.open_sftp()
+        files = []
+        for seg in segs:
+            if seg['records']==0:
+                continue
+            if t_start is not None and seg['t_last']<t_start:
+                continue
+            if t_end is not None and seg['t_first']>t_end:
+                continue
+            remote = '{:s}/seg_{:03d}.bin'.format(remote_dir,seg['slot'])
+            local  = os.path.join(local_dir, '{:s}_{:06d}.bin'.format(
+                        datetime.fromtimestamp(seg['t_first']).strftime("%Y%m%d_%H%M%S"), seg['seq'] ))
+            size   = layout['head_size'] + seg['records']*layout['record_size']
+            with sftp.open(remote,'rb') as fr, open(local,'wb') as fw:
+                fr.prefetch(size)
+                left = size
+                while left>0:
+                    buff = fr.read(min(left,1<<20))
+                    if len(buff)==0:
+                        break
+                    fw.write(buff)
+                    left -= len(buff)
+            self.log('rp.pull_segments(): '+remote+' -> '+local, silent=not self.verbose)
+            files.append(local)
+        sftp.close()
+        return files
+
     def save(self):
         """
         Saves stored data, logs, etc in self.filename using numpy.savez()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Client for the farm of simulated Red Pitayas (resources/dummy_model/farm.py)
+
+@author: lolo
+"""
+
+import socket
+import struct
+import subprocess
+
+
+OP_EXEC  = 0
+OUT_PART = 255     # answer code of a partial stdout frame, the answer follows
+
+head = struct.Struct('!BL')
+
+
+class FarmError(Exception):
+    def __init__(self, msj):
+        self.msj = msj
+    def __str__(self):
+        return repr(self.msj)
+
+
+class farm_link():
+    """
+    This class runs commands on one device of the farm, as they would run
+    over ssh on a Red Pitaya. The connection is kept open, and commands on
+    one link run one after the other: use another link to stop a running
+    data_dump.py (ps ax / kill).
+
+    Example:
+        c = farm_link(host='localhost', port=7003)
+
+    Usage:
+        r = c.run('/root/py/dummy.py peak_pos 100')   # subprocess.CompletedProcess
+        r.returncode, r.stdout
+        c.run('/root/py/osc_trig.py -n 0 --stream', stream=f.write)   # frames as they come
+        txt = c.ssh_cmd('/root/py/osc.py')            # stdout text, as red_pitaya_app.ssh_cmd
+        c.close()
+
+    To drive the farm with the host classes:
+        rp = farm_app(7003)                            # red_pitaya_app on a farm device
+    """
+
+    def __init__(self,host='localhost',port=7000,timeout=None):
+        self.host    = host
+        self.port    = port
+        self.timeout = timeout
+        self.sock    = None
+        self.connect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host,self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def recv_exact(self,size):
+        buf  = bytearray(size)
+        view = memoryview(buf)
+        pos  = 0
+        while pos<size:
+            n = self.sock.recv_into(view[pos:])
+            if n==0:
+                raise FarmError('connection closed by server')
+            pos+=n
+        return bytes(buf)
+
+    def run(self,cmd,stream=None):
+        """
+        Runs cmd on the device. Returns a subprocess.CompletedProcess with
+        the exit status and stdout (or stderr when the status is not 0).
+        stream: function called with each part of stdout sent while the
+                command runs (osc_trig.py multi-shot), instead of keeping it
+                in stdout
+        """
+        b = cmd.encode()
+        self.sock.sendall( head.pack(OP_EXEC,len(b)) + b )
+        parts = []
+        while True:
+            rc,size = head.unpack( self.recv_exact(head.size) )
+            data = self.recv_exact(size) if size>0 else b''
+            if rc!=OUT_PART:
+                break
+            if stream is None:
+                parts.append(data)
+            else:
+                stream(data)
+        out = b''.join(parts+[data])
+        return subprocess.CompletedProcess(cmd, rc, out if rc==0 else b'', out if rc!=0 else b'')
+
+    def ssh_cmd(self,cmd):
+        return self.run(cmd).stdout.decode()
+
+
+def farm_app(port,host='localhost',AppName='dummy_simulator',filename=None):
+    """red_pitaya_app (control_hugo.py) whose commands run on a farm device"""
+    from control_hugo import red_pitaya_app
+    link = farm_link(host,port)
+    class app(red_pitaya_app):
+        def ssh_connect(self):
+            return True
+        def ssh_cmd(self,cmd):
+            return link.ssh_cmd(cmd)
+    return app(AppName, host, port, filename=filename)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Client for the resident register server (dummy_simulator/py/hugo_server.py)
+
+@author: lolo
+"""
+
+import socket
+import struct
+import time
+
+from numpy import frombuffer
+
+
+OP_LIST, OP_GET, OP_SET, OP_SNAPSHOT, OP_SCOPE = range(5)
+ST_OK, ST_ERR = 0, 1
+
+head     = struct.Struct('!BL')
+bank_ids = [ 'osc' , 'dummy' ]
+
+
+class HugoError(Exception):
+    def __init__(self, msj):
+        self.msj = msj
+    def __str__(self):
+        return repr(self.msj)
+
+
+class hugo_client():
+    """
+    This class talks to the register server running on the RedPitaya. The
+    connection is kept open, so each operation costs one network round trip.
+
+    Example:
+        c = hugo_client(host='rp-f01d89.local', port=6001)
+        c = hugo_client(unix='/tmp/hugo.sock')   # local stand-in server
+
+    Usage:
+        c.get('peak_pos','sg_amp')       # Returns a Dict with the values
+        c.set(peak_pos=100,sg_amp=2000)  # Sets several regs in one request
+        c.snapshot('dummy')              # Returns a Dict with all the regs of a bank
+        c.scope()                        # Reads oscilloscope channels
+        c.scope(trig='now',timeout=5)    # Fires the trigger and reads the channels
+        c.ping()                         # Round trip time in seconds
+        c.close()
+
+    Reg names are looked up in both banks ('osc' and 'dummy').
+    """
+
+    trig_val = {'now':1,'chAup':2,'chAdown':3,'chBup':4,'chBdown':5, 'ext':6}
+
+    def __init__(self,host='localhost',port=6001,unix=None,timeout=10):
+        self.host    = host
+        self.port    = port
+        self.unix    = unix
+        self.timeout = timeout
+        self.sock    = None
+        self.regs    = {}
+        self.banks   = { y:[] for y in bank_ids }
+        self.connect()
+        self.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        if self.unix:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.unix)
+        else:
+            self.sock = socket.create_connection((self.host,self.port), timeout=self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def recv_exact(self,size):
+        buf  = bytearray(size)
+        view = memoryview(buf)
+        pos  = 0
+        while pos<size:
+            n = self.sock.recv_into(view[pos:])
+            if n==0:
+                raise HugoError('connection closed by server')
+            pos+=n
+        return buf
+
+    def request(self,op,payload=b''):
+        """Sends one frame and returns the answer payload"""
+        self.sock.sendall( head.pack(op,len(payload)) + payload )
+        st,size = head.unpack( self.recv_exact(head.size) )
+        out = self.recv_exact(size) if size>0 else b''
+        if st!=ST_OK:
+            raise HugoError(out.decode())
+        return out
+
+    def load(self):
+        """Loads the reg names, banks and indexes from the server"""
+        self.regs  = {}
+        self.banks = { y:[] for y in bank_ids }
+        for line in self.request(OP_LIST).decode().strip().split('\n'):
+            b,i,name,signed,rw = line.split(',')
+            self.regs[name] = ( int(b) , int(i) )
+            self.banks[bank_ids[int(b)]].append(name)
+
+    def get(self,*names):
+        """
+        Usage:
+            self.get('peak_pos','sg_amp')
+
+        Returns a Dict with the values of the regs
+        """
+        if len(names)==1 and type(names[0]) in [list,tuple]:
+            names = names[0]
+        payload = b''.join( struct.pack('!BB',*self.regs[n]) for n in names )
+        vals = struct.unpack('!{:d}q'.format(len(names)), self.request(OP_GET,payload))
+        return dict(zip(names,vals))
+
+    def set(self,values=None,**kwargs):
+        """
+        Usage:
+            self.set(peak_pos=100,sg_amp=2000)
+            self.set({'peak_pos':100})
+
+        Returns a Dict with the values read back after writing
+        """
+        values = dict(values or {}, **kwargs)
+        names  = list(values)
+        payload = b''.join( struct.pack('!BBq', *self.regs[n], int(values[n]) ) for n in names )
+        vals = struct.unpack('!{:d}q'.format(len(names)), self.request(OP_SET,payload))
+        return dict(zip(names,vals))
+
+    def snapshot(self,bank='dummy'):
+        """Returns a Dict with all the regs of the bank read at once"""
+        names = self.banks[bank]
+        out   = self.request(OP_SNAPSHOT, struct.pack('!B', bank_ids.index(bank)))
+        return dict(zip(names, struct.unpack('!{:d}q'.format(len(names)), out)))
+
+    def scope(self,trig=None,timeout=10):
+        """
+        Reads oscilloscope channels. If trig is one of self.trig_val keys,
+        fires the trigger and waits for the acquisition before reading.
+
+        Returns a Dict with 'ch1', 'ch2' int16 arrays, 'TrgWpt' and 'CurWpt'
+        """
+        tv  = self.trig_val[trig] if trig in self.trig_val else 0
+        out = self.request(OP_SCOPE, struct.pack('!Bd', tv, timeout))
+        trg,cur = struct.unpack_from('!HH', out)
+        data = frombuffer(out, dtype='>i2', offset=4).reshape(-1,2).astype('int16')
+        return { 'ch1': data[:,0], 'ch2': data[:,1], 'TrgWpt': trg, 'CurWpt': cur }
+
+    def ping(self,num=100):
+        """Mean round trip time in seconds of a one reg get"""
+        name = list(self.regs)[0]
+        tbuff = time.perf_counter()
+        for i in range(num):
+            self.get(name)
+        return (time.perf_counter()-tbuff)/num
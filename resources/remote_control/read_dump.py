@@ -11,7 +11,9 @@ import matplotlib.pyplot as plt
 
 #%%
 
+import os
 import glob
+import hashlib
 import subprocess
 from datetime import datetime
 import struct
@@ -71,6 +73,61 @@ def is_int(s):
 
 today=datetime.now().strftime("%Y%m%d")
 
+# time_stats() dt histogram: 0.1 us to 10000 s, 100 bins per decade
+dt_edges=10**linspace(-7,4,1101)
+
+# slope of log(mdev) vs log(tau) for each power law noise
+noise_slopes={ 'wpm':-1.5, 'fpm':-1.0, 'wfm':-0.5, 'ffm':0.0, 'rwfm':0.5 }
+
+
+def edf_simple(N,m,noise):
+    """
+    Equivalent degrees of freedom of the overlapping Allan variance, simple
+    approximations of NIST SP 1065 (Table 5). N phase points, averaging
+    factor m, noise in noise_slopes keys.
+    """
+    N=float(N)
+    m=float(m)
+    if noise=='wpm':
+        edf=(N+1)*(N-2*m)/(2*(N-m))
+    elif noise=='fpm':
+        edf=exp(sqrt( log(maximum((N-1)/(2*m),1.0)) * log((2*m+1)*(N-1)/4) ))
+    elif noise=='wfm':
+        edf=( 3*(N-1)/(2*m) - 2*(N-2)/N ) * 4*m**2/(4*m**2+5)
+    elif noise=='ffm':
+        edf=2*(N-2)/(2.3*N-4.9) if m==1 else 5*N**2/(4*m*(N+3*m))
+    else:
+        edf=(N-2)/m * ((N-1)**2-3*m*(N-1)+4*m**2)/(N-3)**2
+    return float(maximum(edf,1.0))
+
+
+def chi2_interval(var,edf,sigma=1.0):
+    """
+    (low,high) confidence interval of a variance with edf degrees of freedom,
+    +-sigma normal equivalent. Chi-square quantiles by Wilson-Hilferty.
+    """
+    h=2/(9*edf)
+    q_lo=edf*maximum(1-h-sigma*sqrt(h),1e-3)**3
+    q_hi=edf*(1-h+sigma*sqrt(h))**3
+    return var*edf/q_hi, var*edf/q_lo
+
+
+def rolling_std(x,w,block=2**18):
+    """
+    Standard deviation of each w consecutive values of x (len(x)-w+1 values,
+    the i-th one ends at x[i+w-1]), from cumulative sums. The sums are made
+    by blocks of centered values, so large offsets do not spoil the variance.
+    """
+    out=zeros(int(maximum(len(x)-w+1,0)))
+    for i in range(0,len(out),block):
+        y=x[i:i+block+w-1].astype(float64)
+        y-=y.mean()
+        S =concatenate(( [0.0] , cumsum(y)   ))
+        S2=concatenate(( [0.0] , cumsum(y*y) ))
+        m=(S[w:]-S[:-w])/w
+        out[i:i+len(m)]=sqrt(maximum((S2[w:]-S2[:-w])/w-m*m,0))
+    return out
+
 
 
 class read_dump():
@@ -88,18 +145,28 @@ class read_dump():
     streaming start. Both numbers can be changed for special situatiosn using head1_size
     and head2_size params.
     
+    The records are used through a numpy memmap (d.records()) with a structured
+    dtype (self.dtype), so loading a range is a view of the file: nothing is read
+    until a column is used. After a load, d.t, d.n and d.SIGNAL_NAME are columns
+    of the selection, made when they are first asked.
+    Time positions are found with a sparse time index (d.load_index()), saved as
+    filename_tindex.npz unless index=False.
+    
     
     
     Usage:
         d.load_params()     # loads regs values from self.filename headers
         d.load_range()      # loads a range of values by index position
         d.load_time()       # loads a range of values by time position
+        d.load_index()      # loads/makes the sparse time index used by load_time
         d.plot()            # Plots a loaded range
         d.plotr()           # Loads a range of values by index and plots
         d.plott()           # Loads a range of values by time and plots
         d.fast_plotr()      # Fast plot by index range
         
         d.time_stats()      # Calcs useful time statistical information
+        d.find_locked()     # Finds the locked ranges (rolling std of the signals)
+        d.print_locked_ranges() # Prints the longest locked ranges
         d.allan_range()     # Calcs Allan deviation of a data set selected by index range
         d.allan_range2()    # Calcs Allan deviation of a data set selected by index range
                             # with a heavier algorithm that takes care of error intervals
@@ -115,19 +182,28 @@ class read_dump():
         
     
     """
-    def __init__(self,filename,head1_size=100,head2_size=3400):
+    def __init__(self,filename,head1_size=100,head2_size=3400,index=True):
         self.filename   = filename
         self.head1_size = head1_size
         self.head2_size = head2_size
         self.head_size  = head1_size+head2_size
         self.load_params()
-        self.plotlim    = 1000000
-        self.data       = array([])
+        self.mm         = None
+        self.mm_size    = 0
+        self.trailer    = {}
+        self.tindex     = None
+        self.index_k    = 4096
+        self.index_save = index
+        self.index_file = os.path.splitext(filename)[0]+'_tindex.npz'
+        self.stats_file = os.path.splitext(filename)[0]+'_tstats.npz'
+        self.lock_file  = os.path.splitext(filename)[0]+'_locked.npz'
+        self.max_gaps   = 100000
+        self.select(zeros(0,dtype=self.dtype))
         self.newfig     = True
         self.allan      = []
         self.locked_ranges = []
+        self.locked_table  = zeros((0,4))
         self.time_stats_data = {}
-        self.t          = []
         self.t0         = datetime.fromtimestamp( float([ y.split(' ')[-1] for y in filter(lambda x: 'timestamp' in x , self.txt1.decode().split('\n') ) ][0]))
         
     def load_params(self):
@@ -142,6 +218,11 @@ class read_dump():
         are stored in self.params as a Dictionary.
         The names for the signals sotred in the .bin file are stored in self.names .
         Labels for plots are stored in dself.ylbl
+        The record format is stored in self.strstr: '!Qq'+'l'*N (sample clock
+        tick, host time in us, signals) if the header has a 'clock' line with
+        the tick frequency (self.clock), or the old '!f'+'l'*N.
+        The same format as a numpy dtype is stored in self.dtype, with fields
+        tick,host or t, and one field for each signal (self.fields[name]).
         
         Example:
             d=read_dump(filename='/home/lolo/data/20171109_184719.bin')
@@ -155,21 +236,130 @@ class read_dump():
             txt2=f.read(self.head2_size)
         txt=txt1+txt2
         N=len(txt.decode().split('\n')[0].split(','))
-        self.strstr='!f'+'l'*N
+        clock=[ y.split(' ')[-1] for y in filter(lambda x: x.startswith('clock ') , txt1.decode().split('\n') ) ]
+        self.clock=int(clock[0]) if len(clock)>0 else None
+        self.strstr=('!Qq' if self.clock else '!f')+'l'*N
+        self.rec=struct.Struct(self.strstr)
+        self.tick0=0
+        self.host0=0.0
+        if self.clock:
+            with open(self.filename,'rb') as f:
+                f.seek(self.head1_size+self.head2_size)
+                fc=f.read(self.rec.size)
+            if len(fc)==self.rec.size:
+                self.tick0,host=self.rec.unpack(fc)[0:2]
+                self.host0=host*1e-6
         self.ylbl=txt1.decode().split('\n')[0].split(' ')[1].split(',')
         self.names=['t']
         self.names.extend(self.ylbl)
+        self.fields={}
+        for y in self.ylbl:
+            f=y
+            while f in self.fields.values() or f in ('t','n','tick','host'):
+                f+='_'
+            self.fields[y]=f
+        head=[('tick','>u8'),('host','>i8')] if self.clock else [('t','>f4')]
+        self.dtype=dtype( head+[ (self.fields[y],'>i4') for y in self.ylbl ] )
         self.txt1=txt1
+        self.txt2=txt2
         self.params={}
         for i in txt2.decode().split('{')[1].split('}')[0].replace('\n','').split(','):
             if len(i)>2:
                 self.params[i.split(':')[0].split('"')[1]]=float(i.split(':')[1])
     
+    def unpack(self,fc):
+        """
+        Values of the record fc: time in seconds followed by the signals.
+
+        Records with sample clock ticks ('clock' line in the header) get
+        the time from the tick, relative to the first record (its host time
+        keeps the offset from t0), so the time axis has no sampling jitter
+        and no float32 rounding. Old records give their float32 time.
+        """
+        vv=self.rec.unpack(fc)
+        if not self.clock:
+            return vv
+        return ( self.host0+(vv[0]-self.tick0)/self.clock ,)+vv[2:]
+
+    def records(self):
+        """
+        Records of the file as a read only numpy memmap of self.dtype.
+        The mapping is made again when the file grew. A partial record at
+        the end (file being written) and the stats trailer are left out.
+        
+        Usage:
+            rr = d.records()
+            rr[1000:5000:10]['error']     # view, no copy
+        """
+        n=int(maximum(0, (os.path.getsize(self.filename)-self.head_size)//self.dtype.itemsize))
+        if self.mm is None or self.mm_size!=n:
+            self.mm_size=n
+            n-=self.load_trailer(n)
+            if n==0:
+                self.mm=zeros(0,dtype=self.dtype)
+            else:
+                self.mm=memmap(self.filename, dtype=self.dtype, mode='r', offset=self.head_size, shape=(n,))
+        return self.mm
+    
+    def load_trailer(self,n):
+        """
+        Reads the stats trailer that data_dump.py writes at the end of a
+        '!Qq' stream (text records and a last record with an all ones tick)
+        into self.trailer: samples, rate, lag_mean, lag_std, lag_max, missed.
+        Returns the number of records it takes, 0 if there is none.
+        """
+        self.trailer={}
+        if not self.clock or n==0:
+            return 0
+        cs=self.dtype.itemsize
+        with open(self.filename,'rb') as f:
+            f.seek(self.head_size+(n-1)*cs)
+            tick,size=struct.unpack('!Qq',f.read(16))
+            if tick!=0xFFFFFFFFFFFFFFFF or size%cs!=0 or size//cs>=n:
+                return 0
+            f.seek(self.head_size+(n-1)*cs-size)
+            txt=f.read(size).decode('ascii','replace').split()
+        if len(txt)==0 or txt[0]!='stats':
+            return 0
+        self.trailer={ txt[i]:float(txt[i+1]) for i in range(1,len(txt)-1,2) }
+        return size//cs+1
+    
+    def times(self,rec):
+        """Time in seconds (float64) of the records rec, as unpack() gives it"""
+        if not self.clock:
+            return rec['t'].astype(float64)
+        return self.host0+(rec['tick'].astype(int64)-int64(self.tick0))/self.clock
+    
+    def select(self,rec,start=0,step=1):
+        """
+        Sets the loaded data: rec is a slice of records() that starts at
+        index start and takes one record every step. The columns are made
+        by __getattr__ when they are used, and kept until the next select.
+        """
+        self.data=rec
+        self.data_start=start
+        self.data_step=step
+        self.cols={}
+    
+    def __getattr__(self, key):
+        # Only called for missing attributes: lazy columns of the loaded data
+        d=self.__dict__
+        if 'cols' not in d or not ( key in ('t','n') or key in d['fields'] ):
+            raise AttributeError(key)
+        if key not in d['cols']:
+            if key=='t':
+                d['cols'][key]=self.times(self.data)
+            elif key=='n':
+                d['cols'][key]=arange(self.data_start, self.data_start+self.data_step*len(self.data), self.data_step)
+            else:
+                d['cols'][key]=self.data[d['fields'][key]]
+        return d['cols'][key]
+    
     def __getitem__(self, key):
         if type(key)==int:
             return self.data[key]
         if type(key)==str:
-            return self.data[self.names.index(key)]
+            return getattr(self,key)
         if type(key)==slice:
             return self.data[key]
         
@@ -204,7 +394,8 @@ class read_dump():
             step  : step size in number of bins between data. step==1 means no jumps.
             large : if defined, data reading is stopped after getting 'large' data points.
             
-        After succesfully reading the data, its stored in self.data. 
+        After succesfully reading the data, its stored in self.data, as a view of
+        the records memmap (nothing is read from disk until it is used).
         
         Example:
              d=read_dump(filename='/home/lolo/data/20171109_184719.bin')
@@ -213,44 +404,25 @@ class read_dump():
              plt.plot( d.t , d.oscA ) 
              
         """
-        self.check_time_stats()
+        rr=self.records()
         autoset=False
         if end<0:
-            end=self.time_stats_data['data_length']-end
+            end=len(rr)+1+end
             autoset=True
+        end=int(minimum(end,len(rr)))
         if not is_int(step):
-            step=int(max(1, 10**floor(log10( end-start )-4) ))
+            step=int(maximum(1, 10**floor(log10( maximum(end-start,1) )-4) ))
             autoset=True
         if autoset:
             print('autoset: end={:d}, step={:d}'.format(end,step))
         
-        large_break = is_int(large);
-        
         tbuff=time.time()
-        with open(self.filename,'rb') as f:
-            f.read(self.head_size)
-            cs=struct.calcsize(self.strstr)
-            if start>1:
-                f.read(cs*start)
-            fc=f.read(cs)
-            j=start
-            data=[]
-            while fc:
-                if j % step==0:
-                    data.append( [j]+ list(struct.unpack(self.strstr,fc)) )
-                fc=f.read(cs)
-                j+=1
-                if round((j-start)/step)>self.plotlim:
-                    print('ERROR: data length exeded {:d} points'.format(self.plotlim))
-                    break
-                if j>=end:
-                    break
-                if large_break and round((j-start)/step)>large:
-                    break
+        start=-(-int(maximum(start,0))//step)*step   # same points for any start: n % step == 0
+        sel=rr[start:end:step]
+        if is_int(large):
+            sel=sel[:large]
+        self.select(sel,start,step)
         print('Load time: {:f} sec'.format( time.time()-tbuff ))
-        self.data=array(data)
-        for i,n in enumerate(['n']+self.names):
-            setattr(self,n,self.data[:,i])
     
     def load_time(self,start=0,end=-1,large=None,step='auto'):
         """
@@ -272,7 +444,8 @@ class read_dump():
             step  : step size in number of bins between data. step==1 means no jumps.
             large : if defined, data reading is stopped after getting 'large' seconds of data points.
             
-        After succesfully reading the data, its stored in self.data. 
+        After succesfully reading the data, its stored in self.data, as a view of
+        the records memmap (nothing is read from disk until it is used).
         
         Example:
              d=read_dump(filename='/home/lolo/data/20171109_184719.bin')
@@ -281,59 +454,86 @@ class read_dump():
              plt.plot( d.t , d.oscA ) 
              
         """
-#        self.check_time_stats()
-#        if end==None and large==None:
-#            print('needs start + end|large')
-#            return
-#        end_break   = is_int(end);
-#        large_break = is_int(large);
-        
-        self.check_time_stats()
+        rr=self.records()
         autoset=False
         if end<0:
-            end=self.time_stats_data['last_time']-end
+            end=self.times(rr[-1:])[0] if len(rr)>0 else 0
             autoset=True
+        if is_int(large):
+            end=minimum(end,start+large)
+        j0=self.time_index(start)
+        j1=self.time_index(end,side='right')       # records with time <= end
         if not is_int(step):
-            dl=int(( end-start )/self.time_stats_data['last_time']*self.time_stats_data['data_length'])
-            step=int(max(1, 10**floor(log10( dl )-4) ))
+            step=int(maximum(1, 10**floor(log10( maximum(j1-j0,1) )-4) ))
             autoset=True
         if autoset:
-            print('autoset: end={:d}, step={:d}'.format(end,step))
-        
-        large_break = is_int(large);
+            print('autoset: end={:f}, step={:d}'.format(end,step))
         
         tbuff=time.time()
-        with open(self.filename,'rb') as f:
-            f.read(self.head_size)
-            cs=struct.calcsize(self.strstr)
-            fc=f.read(cs)
-            j=0
-            j0=0
-            data=[]
-            save_data=False
-            while fc:
-                tnow=struct.unpack(self.strstr,fc)[0]
-                if save_data==False and tnow>start:
-                    save_data=True
-                    j0=j
-                if save_data and (j-j0) % step==0:
-                    data.append( [j]+ list(struct.unpack(self.strstr,fc)) )
-                fc=f.read(cs)
-                j+=1
-                if round((j-j0)/step)>self.plotlim:
-                    print('ERROR: data length exeded {:d} points'.format(self.plotlim))
-                    break
-                if end_break and tnow>=end:
-                    break
-                if large_break and tnow-start>large:
-                    break
+        self.select(rr[j0:j1:step],j0,step)
         print('Load time: {:f} sec'.format( time.time()-tbuff ))
-        self.data=array(data)
         print('Data length: {:d}'.format( len(self.data) ) )
-        for i,n in enumerate(['n']+self.names):
-            setattr(self,n,self.data[:,i])
     
-
+    def time_at(self,j):
+        """Time in seconds of record j"""
+        return float(self.times(self.records()[j:j+1])[0])
+    
+    def load_index(self,save=None):
+        """
+        Sparse time index: time of every self.index_k-th record. It is kept
+        in self.tindex and saved next to the dump (filename_tindex.npz) when
+        save (self.index_save by default) is True. A saved index is used if
+        it was made for the same header, and it is extended when the file
+        grew.
+        
+        Usage:
+            d.load_index()
+        """
+        save=self.index_save if save is None else save
+        rr=self.records()
+        k=self.index_k
+        if self.tindex is None and os.path.isfile(self.index_file):
+            try:
+                with load(self.index_file) as ii:
+                    if int(ii['k'])==k and bytes(ii['head'])==self.txt1+self.txt2:
+                        self.tindex=ii['time']
+            except (OSError,KeyError,ValueError):
+                pass
+            # same header but another payload (file rewritten)
+            if self.tindex is not None and ( len(self.tindex)>-(-len(rr)//k) or
+                    ( len(self.tindex)>0 and self.tindex[-1]!=self.time_at((len(self.tindex)-1)*k) ) ):
+                self.tindex=None
+        if self.tindex is None:
+            self.tindex=zeros(0)
+        n=len(self.tindex)
+        if n*k<len(rr):
+            self.tindex=concatenate(( self.tindex , self.times(rr[n*k::k]) ))
+            if save:
+                try:
+                    savez(self.index_file, k=k, time=self.tindex,
+                          offset=self.head_size+arange(len(self.tindex))*k*self.dtype.itemsize,
+                          head=frombuffer(self.txt1+self.txt2,dtype=uint8))
+                except OSError:
+                    pass
+        return self.tindex
+    
+    def time_index(self,t,side='right'):
+        """
+        Index of the first record with time > t (side='right') or >= t
+        (side='left'). len(records()) if there is none.
+        The times are monotonic, so it is a searchsorted on the sparse index
+        (load_index) and then on the index_k records around t.
+        """
+        tindex=self.load_index()
+        rr=self.records()
+        k=self.index_k
+        j=int(searchsorted(tindex,t,side=side))
+        if j==0:
+            return 0
+        lo=(j-1)*k
+        hi=int(minimum(j*k+1,len(rr)))
+        return lo+int(searchsorted(self.times(rr[lo:hi]),t,side=side))
+    
     def plot_from_range(self):
         rr=array(plt.ginput(2)).astype(int)[:,0]
         step=max(1, 10**floor(log10( abs(diff(rr)) ) -4) )
@@ -430,75 +630,255 @@ class read_dump():
     def fast_plotr(self,signals,index=10000,large=10000,relative=False):
         self.plotr(signals,start=int(index-large/2),end=int(index+large/2),relative=relative )
     
-    def time_stats(self):
+    def time_stats(self,chunk=2**22,save=None,gap_factor=5):
         """
-        Calculates time statistics data
+        Calculates time statistics data, stored in self.time_stats_data:
+            data_length, first_time, last_time, mean_dt, max_dt, min_dt (>0)
+            dt_edges, dt_hist : histogram of dt, 100 log bins per decade from 0.1 us
+            dt_nonpos         : number of dt <= 0
+            dt_percentiles    : Dict, percentile -> dt (from the histogram)
+            gap_dt            : dt threshold of gaps, gap_factor times the median
+                                dt of the first records
+            gaps, gaps_num    : rows (index, time, dt) of the records after a gap
+        
+        The times are read in chunks of `chunk` records of the memmap. The
+        result is saved in filename_tstats.npz (if save, self.index_save by
+        default) with the file size, mtime and a hash of the headers: a known
+        dump is not read again, and for a grown one only the new records are.
         
         Usage:
-            self.time_stats())
+            self.time_stats()
              
         """
+        save=self.index_save if save is None else save
         tbuff=time.time()
-        with open(self.filename,'rb') as f:
-            f.read(self.head_size)
-            cs=struct.calcsize(self.strstr)
-            fc=f.read(cs)
-            j=0
-            data=[]
-            # first read
-            tnow  = struct.unpack(self.strstr,fc)[0]
-            tlast = struct.unpack(self.strstr,fc)[0]
-            fc=f.read(cs)
-            max_dt=0
-            min_dt=1e100
-            j=1
-            while fc:
-                tlast=tnow
-                tnow=struct.unpack(self.strstr,fc)[0]
-                max_dt=max(max_dt,tnow-tlast)
-                if tnow-tlast>0:
-                    min_dt=min(min_dt,tnow-tlast)
-                fc=f.read(cs)
-                j+=1
+        rr=self.records()
+        st=self.time_stats_state(len(rr))
+        fresh=st['n']==len(rr)
+        edges=dt_edges
+        for i in range(st['n'],len(rr),chunk):
+            tt=self.times(rr[i:i+chunk])
+            if st['n']==0:
+                st['first_time']=tt[0]
+                dt=diff(tt)
+            else:
+                dt=diff(concatenate(( [st['last_time']] , tt )))
+            pos=dt[dt>0]
+            if st['gap_dt']==0 and len(pos)>0:
+                st['gap_dt']=gap_factor*median(pos[:65536])
+            if len(dt)>0:
+                st['max_dt']=float(maximum(st['max_dt'],dt.max()))
+            if len(pos)>0:
+                st['min_dt']=float(minimum(st['min_dt'],pos.min()))
+            st['dt_nonpos']+=len(dt)-len(pos)
+            st['dt_hist']+=histogram(pos,edges)[0]
+            if st['gap_dt']>0:
+                k=nonzero(dt>st['gap_dt'])[0]
+                st['gaps_num']+=len(k)
+                k=k[:int(maximum(0,self.max_gaps-len(st['gaps'])))]
+                jj=i+k+(1 if st['n']==0 else 0)     # record after the gap
+                st['gaps']=concatenate(( st['gaps'] , array([ jj , tt[jj-i] , dt[k] ]).T.reshape(-1,3) ))
+            st['n']=i+len(tt)
+            st['last_time']=tt[-1]
+        if save and not fresh:
+            self.save_time_stats(st)
+        n=st['n']
+        cum=cumsum(st['dt_hist'])
+        perc={}
+        for p in (1,5,50,95,99,99.9):
+            if cum[-1]>0:
+                b=int(searchsorted(cum, p/100*cum[-1]))
+                perc[p]=sqrt(edges[b]*edges[b+1])
+        self.time_stats_data= { 'data_length':n , 'last_time': st['last_time'], 'first_time': st['first_time'],
+                                'mean_dt': (st['last_time']-st['first_time'])/(n-1) if n>1 else 0.0,
+                                'max_dt' :st['max_dt'], 'min_dt':st['min_dt'],
+                                'dt_edges': edges, 'dt_hist': st['dt_hist'], 'dt_nonpos': st['dt_nonpos'],
+                                'dt_percentiles': perc, 'gap_dt': st['gap_dt'],
+                                'gaps': st['gaps'], 'gaps_num': st['gaps_num'] }
         print('Load time   : {:f} sec'.format( time.time()-tbuff ))
-        print('Data length : {:d}'.format( j ) )
-        print('Last time   : {:f} sec'.format( tnow ) )
-        print('Max dt      : {:f} sec'.format( max_dt ) )
-        print('Min dt      : {:f} sec'.format( min_dt ) )
-        self.time_stats_data= { 'data_length':j , 'last_time': tnow, 'max_dt' :max_dt, 'min_dt':min_dt }
-
-    def find_locked(self,error_signal=1,ctrl_signal=2):
-        tbuff=time.time()
-        with open(self.filename,'rb') as f:
-            f.read(self.head_size)
-            cs=struct.calcsize(self.strstr)
-            j=0
-            error_std=[0]*10
-            ctrl_std =[0]*10
-            locked=False
-            self.locked_ranges=[]
-            for i in range(9):
-                fc=f.read(cs)
-                error_std[i] = struct.unpack(self.strstr,fc)[error_signal]
-                ctrl_std[i]  = struct.unpack(self.strstr,fc)[ctrl_signal]
-                j+=1
-            print(j)
-            while fc:
-                fc=f.read(cs)
-                error_std[j%10] = struct.unpack(self.strstr,fc)[error_signal]
-                ctrl_std[j%10]  = struct.unpack(self.strstr,fc)[ctrl_signal]
-                #print( [j, std(error_std) , std(ctrl_std)] )
-                if locked==False and ( std(error_std)<70 and std(ctrl_std)<500 ):
-                    locked=True
-                    self.locked_ranges.append( [j,-1] )
-                if locked==True and ( std(error_std)>=70 or std(ctrl_std)>=500 ):
-                    locked=False
-                    self.locked_ranges[-1][1]=j
-                    print(self.locked_ranges[-1])
-                j+=1
-        print('Load time: {:f} sec'.format( time.time()-tbuff ))
-        self.locked_range= j
+        print('Data length : {:d}'.format( n ) )
+        print('Last time   : {:f} sec'.format( st['last_time'] ) )
+        print('Max dt      : {:f} sec'.format( st['max_dt'] ) )
+        print('Min dt      : {:f} sec'.format( st['min_dt'] ) )
+        if 50 in perc:
+            print('dt p50/p99  : {:f} / {:f} sec'.format( perc[50], perc[99] ) )
+        print('Gaps        : {:d} (dt > {:f} sec)'.format( st['gaps_num'], st['gap_dt'] ) )
+    
+    def fingerprint(self):
+        """(size, mtime in ns, md5 of the headers) of self.filename"""
+        fs=os.stat(self.filename)
+        return fs.st_size, fs.st_mtime_ns, hashlib.md5(self.txt1+self.txt2).hexdigest()
+    
+    def time_stats_state(self,n):
+        """
+        time_stats() state saved in self.stats_file, if it was made for these
+        headers and the records it counted are still in the file.
+        Otherwise, the state of an empty file.
+        """
+        st={ 'n':0, 'first_time':0.0, 'last_time':0.0, 'max_dt':0.0, 'min_dt':1e100,
+             'dt_hist':zeros(len(dt_edges)-1,dtype=int64), 'dt_nonpos':0, 'gap_dt':0.0,
+             'gaps':zeros((0,3)), 'gaps_num':0 }
+        if not os.path.isfile(self.stats_file):
+            return st
+        size,mtime,head=self.fingerprint()
+        try:
+            with load(self.stats_file) as ss:
+                if str(ss['head'])!=head:
+                    return st
+                old={ y:ss[y] for y in st }
+                same=int(ss['size'])==size and int(ss['mtime'])==mtime
+        except (OSError,KeyError,ValueError):
+            return st
+        for y in old:
+            old[y]=old[y] if old[y].ndim>0 else old[y].item()
+        if not same and ( old['n']>n or ( old['n']>0 and self.time_at(old['n']-1)!=old['last_time'] ) ):
+            return st
+        return old
+    
+    def save_time_stats(self,st):
+        size,mtime,head=self.fingerprint()
+        try:
+            savez(self.stats_file, size=size, mtime=mtime, head=head, **st)
+        except OSError:
+            pass
+    
+    def find_locked(self,error_signal=1,ctrl_signal=2,thresholds=None,window=10,hysteresis=1.0,
+                    min_time=0.0,chunk=2**22,save=None):
+        """
+        Finds the locked ranges of the data: the signals are locked while the
+        rolling standard deviation of each one is under its threshold.
+        
+        The rolling std of 'window' records is made from cumulative sums over
+        chunks of the memmap (rolling_std). The lock starts when every signal
+        is under its lock threshold and ends when any is at or over its unlock
+        threshold (hysteresis). Ranges shorter than min_time seconds are left out.
+        
+        The result is the interval table self.locked_table, with rows
+        (start index, end index, start time, end time), end included, and
+        self.locked_ranges with the [start,end] indexes. The open range at the
+        end of the file ends at the last record.
+        The detector state is saved in filename_locked.npz (if save,
+        self.index_save by default): a known dump is not read again, and for a
+        grown one only the new records are.
         
+        Usage:
+            self.find_locked(error_signal=1,ctrl_signal=2,thresholds=None,window=10,hysteresis=1.0,min_time=0.0)
+        
+        Params:
+            error_signal,ctrl_signal : signals (names or self.names index) of the default thresholds
+            thresholds : Dict, signal -> lock threshold or (lock,unlock) thresholds of the std.
+                         Default: {error_signal: 70, ctrl_signal: 500}
+            window     : records of the rolling std. Int, or Dict signal -> records
+            hysteresis : unlock threshold = hysteresis * lock threshold, when only one is given
+            min_time   : minimum length of a locked range, seconds
+        
+        Example:
+            d=read_dump(filename='/home/lolo/data/20171109_184719.bin')
+            d.find_locked(thresholds={'error':(50,80), 'ctrl_A':500}, window={'error':20,'ctrl_A':10}, min_time=60)
+            d.print_locked_ranges()
+            d.allan_range('error', lock=3)
+             
+        """
+        save=self.index_save if save is None else save
+        name=lambda y: self.names[y] if type(y)==int else y
+        if thresholds is None:
+            thresholds={ error_signal: 70, ctrl_signal: 500 }
+        sigs=[]
+        for y,th in thresholds.items():
+            lo,hi=(th,th*hysteresis) if type(th) in (int,float) else th
+            w=int(window.get(y, window.get(name(y), 10)) if type(window)==dict else window)
+            if hi<lo or w<2:
+                raise ValueError('find_locked: {:s} needs unlock >= lock threshold and window >= 2'.format(name(y)))
+            sigs.append( (self.fields[name(y)],w,float(lo),float(hi)) )
+        sigs.sort()
+        key=repr(sigs)
+        W=int(max([ y[1] for y in sigs ]))
+        tbuff=time.time()
+        rr=self.records()
+        N=len(rr)
+        st=self.lock_state(N,key)
+        fresh=st['n']==N
+        for i in range(st['n'],N,chunk):
+            j0=i-W+1 if i>=W-1 else 0
+            cc=rr[j0:i+chunk]
+            nr=len(cc)-(i-j0)
+            ok =ones(nr,dtype=bool)
+            bad=zeros(nr,dtype=bool)
+            for field,w,lo,hi in sigs:
+                sd=full(nr,nan)
+                k=i-j0-w+1             # records of cc before the first window that ends at i
+                v=rolling_std(cc[field][k if k>0 else 0:],w)
+                sd[nr-len(v):]=v
+                ok &= sd<lo
+                bad|= sd>=hi
+            t=arange(nr)
+            t_on =maximum.accumulate(where(ok , t, -1))
+            t_off=maximum.accumulate(where(bad, t, -1))
+            lk=where(t_on>t_off, True, where(t_off>t_on, False, bool(st['locked'])))
+            edges=diff(concatenate(( [int(st['locked'])] , lk.astype(int8) )))
+            starts=(i+nonzero(edges==1)[0]).tolist()
+            ends  =(i+nonzero(edges==-1)[0]-1).tolist()
+            if st['open']>=0:
+                starts=[st['open']]+starts
+            st['open']=starts.pop() if len(starts)>len(ends) else -1
+            st['ranges']=concatenate(( st['ranges'] , array([starts,ends],dtype=int64).T.reshape(-1,2) ))
+            st['locked']=bool(lk[-1])
+            st['n']=i+nr
+            st['last_time']=float(self.times(cc[-1:])[0])
+        if save and not fresh:
+            self.save_lock_state(st,key)
+        rg=st['ranges']
+        if st['open']>=0:
+            rg=concatenate(( rg , [[st['open'],N-1]] ))
+        tt=self.times(rr[rg.flatten()]).reshape(-1,2) if len(rg)>0 else zeros((0,2))
+        keep=(tt[:,1]-tt[:,0])>=min_time
+        self.locked_table = concatenate(( rg , tt ),axis=1)[keep]
+        self.locked_ranges= rg[keep]
+        self.locked_range = N
+        print('Load time    : {:f} sec'.format( time.time()-tbuff ))
+        print('Locked ranges: {:d} ({:d} shorter than {:f} sec left out)'.format( len(self.locked_table), int(sum(~keep)), min_time ))
+        print('Locked time  : {:f} sec'.format( float(sum(self.locked_table[:,3]-self.locked_table[:,2])) ))
+    
+    def lock_state(self,n,key):
+        """
+        find_locked() state saved in self.lock_file, if it was made for these
+        headers, signals, windows and thresholds (key) and the records it read
+        are still in the file. Otherwise, the state of an empty file.
+        """
+        st={ 'n':0, 'locked':False, 'open':-1, 'last_time':0.0, 'ranges':zeros((0,2),dtype=int64) }
+        if not os.path.isfile(self.lock_file):
+            return st
+        size,mtime,head=self.fingerprint()
+        try:
+            with load(self.lock_file) as ss:
+                if str(ss['head'])!=head or str(ss['key'])!=key:
+                    return st
+                old={ y:ss[y] for y in st }
+                same=int(ss['size'])==size and int(ss['mtime'])==mtime
+        except (OSError,KeyError,ValueError):
+            return st
+        for y in old:
+            old[y]=old[y] if old[y].ndim>0 else old[y].item()
+        if not same and ( old['n']>n or ( old['n']>0 and self.time_at(old['n']-1)!=old['last_time'] ) ):
+            return st
+        return old
+    
+    def save_lock_state(self,st,key):
+        size,mtime,head=self.fingerprint()
+        try:
+            savez(self.lock_file, size=size, mtime=mtime, head=head, key=key, **st)
+        except OSError:
+            pass
+    
+    def lock_range(self,num):
+        """
+        [start,end] indexes of the locked range num of self.locked_table.
+        Run find_locked() first.
+        """
+        if len(self.locked_table)==0:
+            raise ValueError('lock_range: no locked ranges (run self.find_locked() first)')
+        return [ int(y) for y in self.locked_table[num,:2] ]
+    
     def save_buff(self):
         """
         Saves data in file: self.filename+'_buff.npz'
@@ -509,6 +889,7 @@ class read_dump():
         """
         savez(self.filename.split('.')[0:-1][0]+'_buff.npz', 
               locked_ranges   = self.locked_ranges,
+              locked_table    = self.locked_table,
               time_stats_data = self.time_stats_data ,
               allan           = self.allan )
     
@@ -522,30 +903,53 @@ class read_dump():
         """
         data=load(self.filename.split('.')[0:-1][0]+'_buff.npz')
         self.locked_ranges   = data['locked_ranges']
+        if 'locked_table' in data:
+            self.locked_table = data['locked_table']
         self.time_stats_data = data['time_stats_data'].tolist()
         self.allan           = data['allan'].tolist()
     
-    def print_locked_ranges(self):
-        min_val=sort(diff(self.locked_ranges).flatten())[-10]-1
-        for i,num in enumerate(diff(self.locked_ranges).flatten()):
-            if num> min_val:
-                print('j={:15d}:{:<15d} , large={:15d}'.format(
-                        self.locked_ranges[i][0],
-                        self.locked_ranges[i][1],
-                        num ) )
-                
-    def export_range(self,signal,start=0,end=1,sp=0):
+    def print_locked_ranges(self,num=10):
+        """
+        Prints the 'num' longest ranges of self.locked_table (find_locked), in
+        time order, with their number for lock_range() and the lock param of
+        export_range() and the Allan routines.
+        
+        Usage:
+            self.print_locked_ranges(num=10)
+             
+        """
+        if len(self.locked_table)==0:
+            print('Not locked ranges. Run self.find_locked()')
+            return False
+        large=self.locked_table[:,3]-self.locked_table[:,2]
+        for i in sort(argsort(-large,kind='stable')[:num]):
+            print('num={:5d} , j={:15d}:{:<15d} , large={:15d} , t={:12.3f}:{:<12.3f} , {:12.3f} sec'.format(
+                    i,
+                    int(self.locked_table[i,0]),
+                    int(self.locked_table[i,1]),
+                    int(self.locked_table[i,1]-self.locked_table[i,0])+1,
+                    self.locked_table[i,2],
+                    self.locked_table[i,3],
+                    large[i] ) )
+    
+    def export_range(self,signal,start=0,end=1,sp=0,lock=None):
         """
         Exports data.
         
         Usage:
-            self.export_range(signal,start=0,end=1,sp=0)
+            self.export_range(signal,start=0,end=1,sp=0,lock=None)
+        
+        Params:
+            lock : number of a locked range (print_locked_ranges) to use as start,end
              
         """
+        if lock is not None:
+            start,end=self.lock_range(lock)
         self.check_time_stats()
+        if end==1:
+            end=self.time_stats_data['data_length']-1
         s_ind=self.names.index(signal)
-        max_dt_oom=floor(log10(self.time_stats_data['max_dt']))
-        max_dt=ceil(self.time_stats_data['max_dt']*10**(-max_dt_oom))/10**(-max_dt_oom)
+        max_dt=self.min_time_bin()
         print('Min time bin: {:f} sec'.format(max_dt))
         tbuff=time.time()
         time_already=False
@@ -558,20 +962,8 @@ class read_dump():
                     print('already have time info')
                     break
         if not time_already:
-            with open(self.filename,'rb') as f:
-                f.read(self.head_size)
-                cs=struct.calcsize(self.strstr)
-                fc=f.read(cs)
-                j=0
-                while fc:
-                    tnow=struct.unpack(self.strstr,fc)[0]
-                    if j==start:
-                        t0=tnow
-                    if j==end:
-                        t1=tnow
-                        break
-                    fc=f.read(cs)
-                    j+=1
+            t0=self.time_at(start)
+            t1=self.time_at(end)
         print('Load time: {:f} sec'.format( time.time()-tbuff ))
         print('t0: {:f} sec'.format( t0 ) )
         print('t1: {:f} sec'.format( t1 ) )
@@ -587,19 +979,18 @@ class read_dump():
         #v_lastmod  = 1e10
         v_lasttime = t0
         percentage      = '0%'
-        percentage_step = int((end-start)/1000)
+        percentage_step = int(maximum(1, (end-start)/1000))
         j=0
         with open(self.filename,'rb') as f:
             with open(self.filename.split('.')[0:-1][0]+'_export_'+signal+'.dat', 'w') as output:
-                f.read(self.head_size)
-                cs=struct.calcsize(self.strstr)
-                for j in range(start):
-                    fc=f.read(cs)  
-                    j+=1
+                cs=self.rec.size
+                f.seek(self.head_size+start*cs)
+                fc=True
+                j=start
                 n=0
                 while fc:
                     fc=f.read(cs)
-                    vv=struct.unpack(self.strstr,fc)
+                    vv=self.unpack(fc)
                     tnow=vv[0]
                     if tnow > v_lasttime + steps:
                         v_lasttime=tnow
@@ -718,24 +1109,22 @@ class read_dump():
         self.ax[-1].legend()
         plt.tight_layout()
     
-    def allan_range2(self,signal,start=0,end=1,sp=0,div=16):
+    def allan_range2(self,signal,start=0,end=1,sp=0,div=16,lock=None):
         """
-        Calculates allan deviation of the signal ( 'signal'- sp ) from 'start' index to 'end' index.
-        First, it analyses the data range and auto set the best time bin length to divide the time array.
-        The, calculates the mean value of each time bin creating a v_s vector of the signal data that is
-        equally spaced in time.
-        Then calculates the allan deviation on the v_s vector.
+        Calculates allan deviation of the signal ( 'signal'- sp ) from 'start' index to 'end' index,
+        with error intervals.
+        It is deviations() with all the results: overlapping Allan deviation with its confidence
+        interval in allan_dev_min/allan_dev_max, plus modified Allan, Hadamard and time deviations.
         
         Usage:
-            self.allan_range2(signal,start=0,end=1,sp=0,div=16)
+            self.allan_range2(signal,start=0,end=1,sp=0,div=16,lock=None)
         
         Params:
             signal    : signal name to be processed
             start,end : index limits of data to process
             sp        : set-point value to supress from signal
-            div       : for time ranges that uses several time bins, the allan deviation is calculated
-                        from at most 'div' diferent time offsets. This produces several values for time
-                        range, that enables so select the max, min and mean value for error plotting.
+            div       : not used. The overlapping estimators use every time offset
+            lock      : number of a locked range (print_locked_ranges) to use as start,end
             
         
         Example:
@@ -744,157 +1133,25 @@ class read_dump():
             d.plot_allan_error()
              
         """
-        # First we find the optimal time range
-        self.check_time_stats()
-        if end==1:
-            end=self.time_stats_data['data_length']-1
-        print('Analysing vector "{:s}" in range {:d}:{:d}'.format(signal,start,end))
-        s_ind=self.names.index(signal)
-        max_dt_oom=floor(log10(self.time_stats_data['max_dt']))
-        max_dt=ceil(self.time_stats_data['max_dt']*10**(-max_dt_oom))/10**(-max_dt_oom)
-        print('Min time bin: {:f} sec'.format(max_dt))
-        tbuff=time.time()
-        time_already=False
-        if len(self.allan)>0:
-            for i in self.allan:
-                if i['range']==[start,end]:
-                    t0=i['t0']
-                    t1=i['t1']
-                    time_already=True
-                    print('already have time info')
-                    break
-        if not time_already:
-            print('Looking for time information')
-            with open(self.filename,'rb') as f:
-                f.read(self.head_size)
-                cs=struct.calcsize(self.strstr)
-                fc=f.read(cs)
-                j=0
-                while fc:
-                    tnow=struct.unpack(self.strstr,fc)[0]
-                    if j==start:
-                        t0=tnow
-                    if j==end:
-                        t1=tnow
-                        break
-                    fc=f.read(cs)
-                    j+=1
-        print('Load time: {:f} sec'.format( time.time()-tbuff ))
-        print('t0: {:f} sec'.format( t0 ) )
-        print('t1: {:f} sec'.format( t1 ) )
-        print('Dt: {:f} sec | {:f} min'.format( t1-t0, (t1-t0)/60 ) )
-        print('')
-        bins_num=int(  floor(log( (t1-t0)/max_dt )/log(2)) -1 )
-        print('Number of bins: {:d}'.format(bins_num))
-        
-        steps = max_dt * 2**arange(bins_num)
-        step  = max_dt
-        v_s   = []
-        v_n   = []
-        v_tmp = []
-        v_lasttime = t0
-        percentage      = '0%'
-        percentage_step = int((end-start)/1000)
-        with open(self.filename,'rb') as f:
-            f.read(self.head_size)
-            cs=struct.calcsize(self.strstr)
-            fc=True
-            j=0
-            for j in range(start):
-                fc=f.read(cs)
-                j+=1
-            while fc:
-                fc=f.read(cs)
-                vv=struct.unpack(self.strstr,fc)
-                tnow=vv[0]
-                for i in range(bins_num):
-                    if tnow > v_lasttime + step:
-                        v_lasttime+=step
-                        v_s.append( mean( v_tmp ) )
-                        v_n.append(len(v_tmp))
-                        v_tmp=[ vv[s_ind] - sp   ]
-                        
-                    else:
-                        v_tmp.append(  vv[s_ind] - sp    )
-                j+=1
-                if j>end:
-                    break
-                if int((j-start))%percentage_step==0:
-                    if not percentage == str(int((j-start)/(end-start)*100)) + '%':
-                        percentage = str(int((j-start)/(end-start)*100)) + '%'
-                        print( percentage )
-        ss=(steps/steps[0]).astype(int)
-        #vv=v_s[:]
-        allan_var_all = []
-        allan_dev_all = []
-        for i in ss:
-            print(i)
-            alvar=[]
-            aldev=[]
-            for k in arange(0,i,i/min(i,div)).astype(int):
-                np=int(len(v_s[k:])-len(v_s[k:])%i)
-                tmp = []
-                nnn = []
-                for j in range(i):
-                    tmp += v_s[k+j:np+k:i]
-                    nnn += v_n[k+j:np+k:i]
-                tmp = array(tmp).reshape( (i,int(np/i)) )
-                nnn = array(nnn).reshape( (i,int(np/i)) )
-                #tmp = mean(tmp,axis=1).tolist()
-                tmp = sum(tmp*nnn,axis=0)
-                nnn = sum(nnn,axis=0)
-                tmp = (tmp/nnn).tolist()
-                
-                if len(v_s[k+np:])>0:
-                    tmp.append( sum( array(v_s[k+np:])*array(v_n[k+np:]) ) / sum( array(v_n[k+np:]) ) ) 
-                #v_s.append(tmp)
-                aa=array(tmp)
-                alvar.append( sum((aa[0:-1]-aa[1:])**2) / ( 2 * (len(aa)-1) )  )  
-                aldev.append( sqrt(alvar[-1]) )
-            allan_var_all.append(alvar)
-            allan_dev_all.append(aldev)
-        
-        allan_dev     = []
-        allan_dev_max = []
-        allan_dev_min = []
-        allan_dev_std = []
-        allan_var     = []
-        for i in allan_dev_all:
-            allan_dev.append(     mean(i) )
-            allan_dev_max.append( max(i) )
-            allan_dev_min.append( min(i) )
-            allan_dev_std.append( std(i) )
-        for i in allan_var_all:
-            allan_var.append(     mean(i) )
-            
-        i=len(self.allan)
-        self.allan.append( { 'num':i, 'signal':signal, 'signal_index': s_ind,
-                             't0':t0  , 't1':t1,
-                             'steps':steps, 'v_s':v_s , 'v_n':v_n ,'range': [start,end]  ,
-                             'allan_dev_max':allan_dev_max , 'allan_dev_min':allan_dev_min ,
-                             #'allan_dev_all':allan_dev_all , 'allan_var_all':allan_var_all ,
-                             'allan_dev_std':allan_dev_std, 'factor': 1 ,
-                             'allan_var':allan_var , 'allan_dev':allan_dev })
-        print('Total Load time: {:f} sec'.format( time.time()-tbuff ))
-
-
-    
+        return self.deviations(signal,start=start,end=end,sp=sp,lock=lock)
     
-    def allan_range(self,signal,start=0,end=1,sp=0):
+    def allan_range(self,signal,start=0,end=1,sp=0,lock=None):
         """
         Calculates allan deviation of the signal ( 'signal'- sp ) from 'start' index to 'end' index.
         First, it analyses the data range and auto set the best time bin length to divide the time array.
         The, calculates the mean value of each time bin creating a v_s vector of the signal data that is
         equally spaced in time.
         Then calculates the allan deviation on the v_s vector.
+        Same as allan_range2(), see deviations().
         
         Usage:
-            self.allan_range(signal,start=0,end=1,sp=0)
+            self.allan_range(signal,start=0,end=1,sp=0,lock=None)
         
         Params:
             signal    : signal name to be processed
             start,end : index limits of data to process
             sp        : set-point value to supress from signal            
+            lock      : number of a locked range (print_locked_ranges) to use as start,end
         
         Example:
             d=read_dump(filename='/home/lolo/data/20171109_184719.bin')
@@ -902,101 +1159,143 @@ class read_dump():
             d.plot_allan()
              
         """
-        # First we find the optimal time range
+        return self.deviations(signal,start=start,end=end,sp=sp,lock=lock)
+    
+    def min_time_bin(self):
+        """
+        Default time bin of deviations() and export_range(): the 99.9
+        percentile of dt (time_stats), so dropout gaps do not set it, rounded
+        up to one significant digit.
+        """
+        self.check_time_stats()
+        dt=self.time_stats_data.get('dt_percentiles',{}).get(99.9, self.time_stats_data['max_dt'])
+        dt_oom=floor(log10(dt))
+        return ceil(dt*10**(-dt_oom))/10**(-dt_oom)
+    
+    def bin_signal(self,signal,start,end,tau0,sp=0,chunk=2**22):
+        """
+        Sums and number of samples of ( 'signal' - sp ) in time bins of tau0
+        seconds from the time of record start, for records start to end.
+        The records are read in chunks of the memmap.
+        Returns (sums, counts, t0, t1).
+        """
+        rr=self.records()
+        field=self.fields[signal]
+        t0=self.time_at(start)
+        t1=self.time_at(end)
+        nb=int(floor((t1-t0)/tau0))+1
+        sums=zeros(nb)
+        cnts=zeros(nb,dtype=int64)
+        for i in range(start,end+1,chunk):
+            cc=rr[i:int(minimum(i+chunk,end+1))]
+            b=clip(floor((self.times(cc)-t0)/tau0).astype(int64),0,nb-1)
+            b0=b.min()
+            n=b.max()-b0+1
+            sums[b0:b0+n]+=bincount(b-b0, weights=cc[field].astype(float64)-sp, minlength=n)
+            cnts[b0:b0+n]+=bincount(b-b0, minlength=n)
+        return sums,cnts,t0,t1
+    
+    def deviations(self,signal,start=0,end=1,sp=0,tau0=None,noise='auto',sigma=1.0,chunk=2**22,lock=None):
+        """
+        Overlapping Allan, modified Allan, Hadamard and time deviations of
+        ( 'signal' - sp ) from 'start' index to 'end' index, for tau = tau0*2**k.
+        
+        The signal is binned once to a uniform time grid of tau0 (bin_signal),
+        reading the file by chunks. Each average over tau comes from cumulative
+        sums of the bins weighted by their number of samples, so every tau is
+        O(bins) and empty bins (gaps) only remove the terms that use them.
+        
+        Confidence intervals (+-sigma) use the equivalent degrees of freedom of
+        the overlapping Allan variance (edf_simple) for the noise type of each
+        tau, found from the slope of the modified Allan deviation (noise='auto')
+        or given as one of noise_slopes keys. The same edf is used for the
+        other deviations.
+        
+        Usage:
+            self.deviations(signal,start=0,end=1,sp=0,tau0=None,noise='auto',sigma=1.0,lock=None)
+        
+        Params:
+            signal    : signal name to be processed
+            start,end : index limits of data to process. end=1 means up to the last record
+            sp        : set-point value to supress from signal
+            tau0      : bin length in seconds. Default: 99.9 percentile of dt (time_stats)
+                        rounded up to one significant digit
+            lock      : number of a locked range (print_locked_ranges) to use as start,end
+        
+        The result is appended to self.allan (plot_allan / plot_allan_error) and returned:
+            steps                               : tau values
+            allan_var, allan_dev                : overlapping Allan
+            allan_dev_min, allan_dev_max        : its confidence interval
+            mdev, hdev, tdev (and _min, _max)   : modified Allan, Hadamard, time deviations
+            edf, noise                          : degrees of freedom and noise type for each tau
+        
+        Example:
+            d=read_dump(filename='/home/lolo/data/20171109_184719.bin')
+            d.deviations('error', start=6944, end=8148326)
+            d.plot_allan_error()
+             
+        """
+        if lock is not None:
+            start,end=self.lock_range(lock)
         self.check_time_stats()
         if end==1:
             end=self.time_stats_data['data_length']-1
         print('Analysing vector "{:s}" in range {:d}:{:d}'.format(signal,start,end))
         s_ind=self.names.index(signal)
-        max_dt_oom=floor(log10(self.time_stats_data['max_dt']))
-        max_dt=ceil(self.time_stats_data['max_dt']*10**(-max_dt_oom))/10**(-max_dt_oom)
-        print('Min time bin: {:f} sec'.format(max_dt))
+        if tau0 is None:
+            tau0=self.min_time_bin()
+        print('Min time bin: {:f} sec'.format(tau0))
         tbuff=time.time()
-        time_already=False
-        if len(self.allan)>0:
-            for i in self.allan:
-                if i['range']==[start,end]:
-                    t0=i['t0']
-                    t1=i['t1']
-                    time_already=True
-                    print('already have time info')
-                    break
-        if not time_already:
-            print('Looking for time information')
-            with open(self.filename,'rb') as f:
-                f.read(self.head_size)
-                cs=struct.calcsize(self.strstr)
-                fc=f.read(cs)
-                j=0
-                while fc:
-                    tnow=struct.unpack(self.strstr,fc)[0]
-                    if j==start:
-                        t0=tnow
-                    if j==end:
-                        t1=tnow
-                        break
-                    fc=f.read(cs)
-                    j+=1
+        sums,cnts,t0,t1=self.bin_signal(signal,start,end,tau0,sp=sp,chunk=chunk)
         print('Load time: {:f} sec'.format( time.time()-tbuff ))
         print('t0: {:f} sec'.format( t0 ) )
         print('t1: {:f} sec'.format( t1 ) )
         print('Dt: {:f} sec | {:f} min'.format( t1-t0, (t1-t0)/60 ) )
         print('')
-        bins_num=int(  floor(log( (t1-t0)/max_dt )/log(2)) -1 )
-        print('Number of bins: {:d}'.format(bins_num))
-        
-        steps=max_dt * 2**arange(bins_num)
-        v_s=[]
-        for i in range(bins_num):
-            v_s.append([])
-        v_tmp=[]
-        for i in range(bins_num):
-            v_tmp.append([])
-        v_n = []
-        for i in range(bins_num):
-            v_n.append([])
-        v_lastmod  = ones(bins_num)*1e10
-        v_lasttime = ones(bins_num)*t0
-        percentage      = '0%'
-        percentage_step = int((end-start)/1000)
-        with open(self.filename,'rb') as f:
-            f.read(self.head_size)
-            cs=struct.calcsize(self.strstr)
-            fc=True
-            j=0
-            for j in range(start):
-                fc=f.read(cs)
-                j+=1
-            while fc:
-                fc=f.read(cs)
-                vv=struct.unpack(self.strstr,fc)
-                tnow=vv[0]
-                for i in range(bins_num):
-                    if tnow > v_lasttime[i] + steps[i]:
-                        #v_lasttime[i]=tnow
-                        v_lasttime[i]+=steps[i]
-                        v_s[i].append( mean( v_tmp[i] ) )
-                        v_n[i].append(len(v_tmp[i]))
-                        v_tmp[i]=[ vv[s_ind] - sp   ]
-                    else:
-                        v_tmp[i].append(  vv[s_ind] - sp    )
-                j+=1
-                if j>end:
-                    break
-                if int((j-start))%percentage_step==0:
-                    if not percentage == str(int((j-start)/(end-start)*100)) + '%':
-                        percentage = str(int((j-start)/(end-start)*100)) + '%'
-                        print( percentage )
-        allan_var = []
-        for i in v_s:
-            aa=array(i)
-            allan_var.append(  sum((aa[0:-1]-aa[1:])**2) / ( 2 * (len(aa)-1) )  )
-        allan_dev=sqrt(array(allan_var))
+        S=concatenate(( [0.0] , cumsum(sums) ))
+        C=concatenate(( [0]   , cumsum(cnts) ))
+        del sums,cnts
+        M=len(S)-1
+        mm=2**arange(int(floor(log2(maximum(M/4,1))))+1)
+        print('Number of bins: {:d}'.format(len(mm)))
+        avar=zeros(len(mm))
+        mvar=zeros(len(mm))
+        hvar=zeros(len(mm))
+        for i,m in enumerate(mm):
+            n=C[m:]-C[:-m]
+            Y=(S[m:]-S[:-m])/where(n>0,n,1)
+            Y[n==0]=nan
+            d1=Y[m:]-Y[:-m]
+            d2=d1[m:]-d1[:-m]
+            avar[i]=nanmean(d1**2)/2
+            hvar[i]=nanmean(d2**2)/6
+            ok=~isnan(d1)
+            D=concatenate(( [0.0] , cumsum(where(ok,d1,0)) ))
+            V=concatenate(( [0]   , cumsum(ok) ))
+            w=(V[m:]-V[:-m])==m
+            mvar[i]=mean( ((D[m:]-D[:-m])[w]/m)**2 )/2 if w.any() else nan
+        steps=tau0*mm
+        mdev=sqrt(mvar)
+        if noise=='auto':
+            slope=gradient(log(mdev),log(steps)) if len(mm)>1 else zeros(len(mm))
+            kk=list(noise_slopes)
+            noise=[ kk[int(argmin(abs(array(list(noise_slopes.values()))-y)))] for y in slope ]
+        else:
+            noise=[noise]*len(mm)
+        edf=array([ edf_simple(M+1,m,y) for m,y in zip(mm,noise) ])
+        a_lo,a_hi=chi2_interval(avar,edf,sigma)
+        m_lo,m_hi=chi2_interval(mvar,edf,sigma)
+        h_lo,h_hi=chi2_interval(hvar,edf,sigma)
+        tdev=steps/sqrt(3)*mdev
         i=len(self.allan)
         self.allan.append( { 'num':i, 'signal':signal, 'signal_index': s_ind,
-                             't0':t0  , 't1':t1, 'v_n':v_n ,
-                             'steps':steps, 'v_s':v_s , 'range': [start,end]  ,
-                             'allan_var':allan_var , 'allan_dev':allan_dev })
+                             't0':t0  , 't1':t1, 'tau0':tau0,
+                             'steps':steps, 'range': [start,end]  , 'factor': 1 ,
+                             'allan_var':avar , 'allan_dev':sqrt(avar),
+                             'allan_dev_min':sqrt(a_lo) , 'allan_dev_max':sqrt(a_hi) ,
+                             'mdev':mdev, 'mdev_min':sqrt(m_lo), 'mdev_max':sqrt(m_hi),
+                             'hdev':sqrt(hvar), 'hdev_min':sqrt(h_lo), 'hdev_max':sqrt(h_hi),
+                             'tdev':tdev, 'tdev_min':steps/sqrt(3)*sqrt(m_lo), 'tdev_max':steps/sqrt(3)*sqrt(m_hi),
+                             'edf':edf, 'noise':noise })
         print('Total Load time: {:f} sec'.format( time.time()-tbuff ))
-
-
+        return self.allan[-1]